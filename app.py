@@ -3,12 +3,27 @@ from streamlit_calendar import calendar
 import datetime
 from datetime import timedelta, time
 from pymongo import MongoClient
-from bson import ObjectId
+import hmac
+import io
 import os
+import logging
 import certifi
 import pandas as pd
 import altair as alt
 
+from archive import start_scheduler as start_archiver
+from caching import TENANT_KEY, cache_stats, cached_reader, collection_versions, current_tenant, invalidate
+from ical import export_calendar, import_calendar
+from perf import MongoCommandListener, finish_trace, start_trace, timed, traced_fragment
+from recurrence import ExpansionCache, make_rule, new_series, next_occurrences
+from scheduling import (
+    blockout_style, build_blockout_index, find_free_slots, invitation_windows, month_grid_range, padded_window,
+    same_time_windows, to_calendar_events, upcoming_events,
+)
+from storage import CALENDAR_FIELDS, DEFAULT_HOUSEHOLD, NOTE_FIELDS, UPCOMING_FIELDS, create_repository
+from storage.mongo import POOL_OPTIONS
+from trends import MOOD_METRICS, default_trend_range, downsample, pick_granularity
+
 # --- App Configuration ---
 st.set_page_config(
     page_title="Our Connection Calendar",
@@ -16,12 +31,28 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded",
 )
+PERF_TRACE_FILE = os.environ.get("RENDEZVOUS_TRACE_FILE") or st.secrets.get("perf_trace_file")
+PERF_PANEL = st.secrets.get("perf_panel", False) or st.query_params.get("perf") == "1"
+PERF_HISTORY = 20  # recent traces (full and fragment reruns) listed in the panel
+# Reply sizes need a BSON re-encode of every reply: only pay for it when someone looks at them.
+start_trace("rerun", cache_stats(), measure_bytes=PERF_PANEL or bool(PERF_TRACE_FILE))
+
+def record_trace(trace):
+    """Keeps the session's recent traces, so the panel shows fragment interactions too."""
+    if trace is not None:
+        history = st.session_state.setdefault("perf_history", [])
+        history.append(trace)
+        del history[:-PERF_HISTORY]
+
+traced = traced_fragment(cache_stats, PERF_TRACE_FILE, measure_bytes=PERF_PANEL or bool(PERF_TRACE_FILE),
+                         on_finish=record_trace)
 
 # ==============================================================================
 # 1. CONFIGURATION & STYLING
 # ==============================================================================
 
 LOGO_IMAGE = "logo.png"
+ALERT_REFRESH_SECONDS = 1
 
 def get_css_variables():
     """Returns a dictionary of CSS variables based on the current Streamlit theme."""
@@ -53,6 +84,20 @@ CALENDAR_OPTIONS = {
         "left": "prev,next today", "center": "title", "right": "dayGridMonth,timeGridWeek,timeGridDay"
     }
 }
+CALENDAR_PREFETCH_DAYS = 7
+NOTES_PAGE_SIZE = 25
+DEFAULT_EVENT_LENGTH = timedelta(hours=2)  # events saved before `end` was stored
+FREE_SLOT_COUNT = 5
+SLOT_SEARCH_DAYS = 7  # alternatives to a clashing time: the same time of day over this many days
+INVITATION_TIMINGS = ["Sometime tonight", "Soon", "This afternoon", "Tomorrow evening", "This weekend"]
+REPEAT_OPTIONS = {
+    "Does not repeat": None,
+    "Every day": {"freq": "daily"},
+    "Every weekday": {"freq": "weekly", "byweekday": [0, 1, 2, 3, 4]},
+    "Every week": {"freq": "weekly"},
+    "Every 2 weeks": {"freq": "weekly", "interval": 2},
+    "Every month": {"freq": "monthly"},
+}
 
 def apply_global_styles():
     """Applies custom CSS to the entire Streamlit app."""
@@ -114,9 +159,14 @@ apply_global_styles()
 
 @st.cache_resource
 def init_connection():
-    """Initializes and returns a connection to MongoDB."""
+    """Initializes and returns the process-wide MongoDB client, shared by every session and household.
+
+    The pool is sized by storage.mongo.POOL_OPTIONS; override any option with the `mongo_pool` secret table.
+    """
     try:
-        client = MongoClient(st.secrets["mongo_uri"], tlsCAFile=certifi.where())
+        pool_options = dict(POOL_OPTIONS, **st.secrets.get("mongo_pool", {}))
+        client = MongoClient(st.secrets["mongo_uri"], tlsCAFile=certifi.where(),
+                             event_listeners=[MongoCommandListener()], **pool_options)
         return client
     except Exception as e:
         st.error(f"Failed to connect to MongoDB. Check secrets and IP Access List. Error: {e}")
@@ -127,100 +177,282 @@ def get_db():
     """Returns the database instance."""
     return init_connection().get_database("rendezvous")
 
-def setup_database():
-    """Sets up initial database state and indexes if they don't exist."""
-    db = get_db()
-    if db.app_state.count_documents({"key": "partner_names"}) == 0:
-        db.app_state.insert_one({"key": "partner_names", "value": ["Partner 1", "Partner 2"]})
-    db.love_notes.create_index([("timestamp", -1)])
-    db.moods.create_index([("partner", 1), ("date", -1)])
+@st.cache_resource
+def get_storage():
+    """Returns the storage backend named by the `storage_backend` secret ("mongo" by default, or "memory").
+
+    Backend setup (schema migrations and indexes for Mongo) runs once per process, not on every rerun.
+    """
+    backend = st.secrets.get("storage_backend", "mongo")
+    repo = create_repository(backend, db=get_db()) if backend == "mongo" else create_repository(backend)
+    repo.prepare(log=logging.getLogger(__name__).info)
+    return repo
+
+@st.cache_resource
+def get_archiver():
+    """The background archiver for every household (`archive_interval_hours` secret), or None when it is off.
+
+    start_scheduler keeps one thread per process, so clearing or evicting this cache never starts a second one.
+    """
+    if not st.secrets.get("archive_interval_hours"):
+        return None
+    return start_archiver(get_storage(), st.secrets["archive_interval_hours"] * 3600,
+                          dict(st.secrets.get("archive_max_age_days", {})), log=logging.getLogger(__name__).info)
+
+def get_repo():
+    """The storage backend scoped to the session's household (sharing the process-wide connection)."""
+    return get_storage().for_household(current_tenant())
 
-setup_database()
+def resolve_household():
+    """The session's household, decided by who the session is, never by what the URL asks for.
+
+    Without a `households` secret the deployment serves the one household named by the `household`
+    secret. With it, each entry maps a household id to the login emails (`members`, via st.login)
+    and/or the link `token` (`?token=`) allowed in; anyone matching no entry is stopped here.
+    """
+    configured = st.secrets.get("households")
+    if not configured:
+        return st.secrets.get("household", DEFAULT_HOUSEHOLD)
+    user = getattr(st, "user", None)
+    email = user.get("email") if user is not None and user.get("is_logged_in") else None
+    token = st.query_params.get("token", "")
+    allowed = [
+        household for household, access in configured.items()
+        if (email is not None and email in access.get("members", ()))
+        or (token and access.get("token") and hmac.compare_digest(token.encode(), str(access["token"]).encode()))
+    ]
+    if not allowed:
+        if email is None and "auth" in st.secrets:
+            st.button("Log in", on_click=st.login)
+        else:
+            st.error("You don't have access to a household here.")
+        st.stop()
+    # Someone in several households may pick one, but only among those they were let into.
+    requested = st.query_params.get("household")
+    return requested if requested in allowed else allowed[0]
 
-@st.cache_data(ttl=60)
+@timed()
+@cached_reader("app_state", ttl=60)
 def get_partner_names():
-    doc = get_db().app_state.find_one({"key": "partner_names"})
-    return doc['value'] if doc else ["Partner 1", "Partner 2"]
+    return get_repo().get_partner_names() or ["Partner 1", "Partner 2"]
 
+@timed()
 def update_partner_names(p1, p2):
-    get_db().app_state.update_one({"key": "partner_names"}, {"$set": {"value": [p1, p2]}}, upsert=True)
-    st.cache_data.clear()
+    get_repo().set_partner_names([p1, p2])
+    invalidate("app_state")
 
-def add_event(title, start_time, booker, is_spontaneous, event_type, partner_colors):
+def event_style(booker, is_spontaneous, event_type, partner_colors):
+    """Every stored event field except title and times."""
     base_colors = {
         "intimate": "#E8B4CB" if is_spontaneous else "#D498B5", "date": "#87CEEB",
         "self_care": "#98D8C8", "wellness": "#FFB3BA"
     }
     color = partner_colors.get(booker, base_colors.get(event_type, "#D498B5"))
-    get_db().events.insert_one({
-        "title": title, "start": start_time.isoformat(), "backgroundColor": color,
-        "borderColor": color, "booker": booker, "is_spontaneous": is_spontaneous,
-        "event_type": event_type
-    })
-    st.cache_data.clear()
-
-def add_blockout(title, start_time, end_time, all_day, blockout_type):
-    color_map = {"health": "#FF9999", "work": "#B0B0B0", "family": "#D4C5B9", "personal": "#A7C7E7", "general": "#C0C0C0"}
-    color = color_map.get(blockout_type, "#C0C0C0")
-    get_db().blockouts.insert_one({
-        "title": title, "start": start_time.isoformat(), "end": end_time.isoformat(),
-        "allDay": all_day, "backgroundColor": color, "borderColor": color,
-        "display": "background", "blockout_type": blockout_type
-    })
-    st.cache_data.clear()
+    return {"backgroundColor": color, "borderColor": color, "booker": booker, "is_spontaneous": is_spontaneous,
+            "event_type": event_type}
+
+@timed()
+def add_event(title, start_time, booker, is_spontaneous, event_type, partner_colors, end_time=None, recurrence=None):
+    event = {
+        "title": title, "start": start_time, "end": end_time or start_time + DEFAULT_EVENT_LENGTH,
+        **event_style(booker, is_spontaneous, event_type, partner_colors),
+    }
+    if recurrence:
+        get_repo().insert_series("events", new_series(event, recurrence))
+        invalidate("event_series")
+    else:
+        get_repo().insert_event(event)
+        invalidate("events")
+
+@timed()
+def add_blockout(title, start_time, end_time, all_day, blockout_type, recurrence=None):
+    blockout = {"title": title, "start": start_time, "end": end_time, "allDay": all_day, **blockout_style(blockout_type)}
+    if recurrence:
+        get_repo().insert_series("blockouts", new_series(blockout, recurrence))
+        invalidate("blockout_series")
+    else:
+        get_repo().insert_blockout(blockout)
+        invalidate("blockouts")
 
-@st.cache_data(ttl=30)
-def get_events():
-    return [dict(event, _id=str(event['_id'])) for event in get_db().events.find()]
+@timed()
+def import_ics(uploaded_file, kind, template):
+    """Streams an uploaded .ics file into `kind` in batches; caches are invalidated once for the whole import.
 
-@st.cache_data(ttl=30)
-def get_blockouts():
-    return [dict(blockout, _id=str(blockout['_id'])) for blockout in get_db().blockouts.find()]
+    Bytes that aren't UTF-8 (some exporters write Latin-1) become U+FFFD rather than failing the import; a file that
+    isn't a calendar, or is cut short, raises ValueError.
+    """
+    lines = io.TextIOWrapper(uploaded_file, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        return import_calendar(get_repo(), lines, kind, template)
+    finally:
+        # Earlier batches may already be written when a later part of the file turns out to be broken.
+        invalidate(kind, f"{kind[:-1]}_series")
+
+@timed()
+def export_ics(kinds, range_start, range_end):
+    return "".join(export_calendar(get_repo(), kinds, range_start, range_end))
+
+@timed()
+def skip_occurrence(kind, series_id, original_start):
+    get_repo().add_series_exception(kind, series_id, original_start)
+    invalidate(f"{kind[:-1]}_series")
+
+@timed()
+@cached_reader("event_series", ttl=60)
+def get_event_series():
+    """Every recurring event series (one document each); occurrences are expanded per window."""
+    return [dict(series, _id=str(series['_id'])) for series in get_repo().find_series("events")]
+
+@timed()
+@cached_reader("blockout_series", ttl=60)
+def get_blockout_series():
+    return [dict(series, _id=str(series['_id'])) for series in get_repo().find_series("blockouts")]
 
+@st.cache_resource
+def get_expansion_cache():
+    """Process-wide cache of series expansions per (series, revision, window)."""
+    return ExpansionCache()
+
+def calendar_occurrences(kind, series_list, range_start, range_end):
+    """Occurrences intersecting the range, projected like stored calendar documents (plus the series, and its kind, they belong to)."""
+    return [
+        dict({key: value for key, value in occ.items() if key in CALENDAR_FIELDS or key in ("_id", "series_id", "occurrence_start")},
+             series_kind=kind)
+        for occ in get_expansion_cache().expand_all(series_list, range_start, range_end)
+    ]
+
+@timed()
+@cached_reader("events", "event_series", ttl=60)
+def get_upcoming_events(minute, limit=3):
+    """The next `limit` events after `minute`; callers pass "now" truncated to the minute so reruns share a cache entry."""
+    events = [dict(event, _id=str(event['_id'])) for event in get_repo().upcoming_events(minute, limit, UPCOMING_FIELDS)]
+    events += [occ for series in get_event_series() for occ in next_occurrences(series, minute, limit)]
+    return upcoming_events(events, minute, limit)
+
+@timed()
+@cached_reader("blockouts", ttl=30)
+def get_blockouts():
+    return [dict(blockout, _id=str(blockout['_id'])) for blockout in get_repo().find_blockouts()]
+
+@timed()
+@cached_reader("events", "event_series", ttl=30)
+def get_events_between(range_start, range_end):
+    """Events (including recurring occurrences) inside [range_start, range_end), projected to the fields FullCalendar renders."""
+    events = [dict(event, _id=str(event['_id'])) for event in get_repo().events_between(range_start, range_end, CALENDAR_FIELDS)]
+    return events + calendar_occurrences("events", get_event_series(), range_start, range_end)
+
+@timed()
+@cached_reader("blockouts", "blockout_series", ttl=30)
+def get_blockouts_between(range_start, range_end):
+    """Blockouts and recurring blockout occurrences intersecting [range_start, range_end); singles come from the start/end index."""
+    blockouts = [dict(blockout, _id=str(blockout['_id']))
+                 for blockout in get_repo().blockouts_between(range_start, range_end, CALENDAR_FIELDS)]
+    return blockouts + calendar_occurrences("blockouts", get_blockout_series(), range_start, range_end)
+
+@st.cache_resource(ttl=30, max_entries=512)
+def _build_blockout_index(tenant, versions):
+    return build_blockout_index(get_blockouts())
+
+@timed()
+def get_blockout_index():
+    """The household's blockout interval index, built once per blockouts version stamp."""
+    tenant = current_tenant()
+    return _build_blockout_index(tenant, collection_versions(("blockouts",), tenant))
+
+@timed()
 def check_for_overlap(new_start, new_end):
-    for blockout in get_blockouts():
-        block_start = datetime.datetime.fromisoformat(blockout['start'])
-        block_end = datetime.datetime.fromisoformat(blockout['end'])
-        if new_start < block_end and new_end > block_start:
-            return blockout
-    return None
-
+    """Returns every blockout (or recurring blockout occurrence) that overlaps the given range (empty list when the slot is free)."""
+    conflicts = get_blockout_index().overlapping(new_start, new_end)
+    return conflicts + get_expansion_cache().expand_all(get_blockout_series(), new_start, new_end)
+
+def event_interval(event):
+    return event['start'], event.get('end') or event['start'] + DEFAULT_EVENT_LENGTH
+
+def events_near(range_start, range_end):
+    # Day-aligned so the cached event window doesn't change with every tick of `now`.
+    return get_events_between(*padded_window(range_start, range_end, 1))
+
+@timed()
+def clashing_events(new_start, new_end):
+    """Returns every event (or recurring event occurrence) that overlaps the given range, as counted busy by find_mutual_free_slots."""
+    return [e for e in events_near(new_start, new_end)
+            if e['start'] < new_end and event_interval(e)[1] > new_start]
+
+def describe_conflicts(conflicts):
+    return ", ".join(f"'{b.get('title') or 'Untitled'}'" for b in conflicts)
+
+@timed()
+def find_mutual_free_slots(windows, duration, count=FREE_SLOT_COUNT):
+    """Earliest future slots of `duration` across `windows` that clash with no blockout and no existing event."""
+    now = datetime.datetime.now()
+    slots = []
+    for window_start, window_end in windows:
+        window_start = max(window_start, now)
+        if window_start >= window_end:
+            continue
+        busy = [(b['start'], b['end']) for b in check_for_overlap(window_start, window_end)]
+        busy += [event_interval(e) for e in events_near(window_start, window_end)]
+        slots += find_free_slots(busy, duration, window_start, window_end, count - len(slots))
+        if len(slots) >= count:
+            break
+    return slots
+
+@timed()
 def add_love_note(author, message):
-    get_db().love_notes.insert_one({
+    get_repo().insert_love_note({
         "author": author, "message": message, "timestamp": datetime.datetime.now(), "type": "love_note"
     })
-    st.cache_data.clear()
+    invalidate("love_notes")
+
+@timed()
+@cached_reader("love_notes", ttl=10)
+def get_love_notes_page(before=None, limit=NOTES_PAGE_SIZE):
+    """One page of notes, newest first, after the `before` (timestamp, _id) cursor (keyset pagination on that index)."""
+    return get_repo().love_notes_page(before=before, limit=limit, fields=NOTE_FIELDS)
+
+@timed()
+@cached_reader("love_notes", ttl=60)
+def search_love_notes(query, author=None, range_start=None, range_end=None, page=0, limit=NOTES_PAGE_SIZE):
+    """One ranked page of notes matching `query` (text index on Mongo, inverted index in memory), and whether more follow."""
+    results = get_repo().search_love_notes(query, author, range_start, range_end, skip=page * limit, limit=limit + 1,
+                                           fields=NOTE_FIELDS)
+    return results[:limit], len(results) > limit
 
-@st.cache_data(ttl=10)
-def get_all_love_notes():
-    return list(get_db().love_notes.find({"type": "love_note"}).sort("timestamp", -1))
+@st.cache_resource
+def get_notifier():
+    """Process-wide alert notifier for every household; `notification_backend` secret picks "change_stream" (default) or "in_process"."""
+    return get_storage().notification_backend(st.secrets.get("notification_backend", "change_stream"))
 
+@timed()
 def send_emergency_alert(sender, urgency, message):
-    get_db().love_notes.insert_one({
+    alert = {
         "sender": sender, "timestamp": datetime.datetime.now(), "type": "emergency_alert",
         "urgency": urgency, "message": message, "seen": False
-    })
-    st.cache_data.clear()
+    }
+    get_repo().insert_alert(alert)
+    get_notifier().notify_sent(alert)
 
-@st.cache_data(ttl=5)
 def get_unseen_emergency_alert():
-    return get_db().love_notes.find_one({"type": "emergency_alert", "seen": False})
+    return get_notifier().unseen_alert(current_tenant())
 
+@timed()
 def mark_emergency_as_seen(alert_id):
-    get_db().love_notes.update_one({"_id": ObjectId(alert_id)}, {"$set": {"seen": True}})
-    st.cache_data.clear()
+    get_repo().mark_alert_seen(alert_id)
+    get_notifier().notify_seen(alert_id)
 
+@timed()
 def log_mood(partner, date, energy, desire, stress, notes):
-    get_db().moods.update_one(
-        {"partner": partner, "date": date.isoformat()[:10]},
-        {"$set": {"energy": energy, "desire": desire, "stress": stress, "notes": notes, "timestamp": datetime.datetime.now()}},
-        upsert=True
+    get_repo().upsert_mood(
+        partner, datetime.datetime.combine(date, time()),
+        {"energy": energy, "desire": desire, "stress": stress, "notes": notes, "timestamp": datetime.datetime.now()},
     )
-    st.cache_data.clear()
+    invalidate("moods")
 
-@st.cache_data(ttl=60)
-def get_all_moods():
-    return list(get_db().moods.find())
+@timed()
+@cached_reader("moods", ttl=60)
+def get_mood_trends(range_start, range_end, unit):
+    """Per-partner averages and rolling means per `unit` ("day", "week" or "month"), aggregated by the backend."""
+    return downsample(get_repo().mood_trends(range_start, range_end, unit))
 
 # ==============================================================================
 # 3. UI HELPERS
@@ -234,10 +466,42 @@ def partner_colored_badge(partner_name, all_partner_names):
     color_class = "partner1" if partner_name == all_partner_names[0] else "partner2"
     return f'<span class="partner-badge {color_class}">{initials}</span>'
 
+def format_slot(slot):
+    start, end = slot
+    return f"{start.strftime('%a, %b %d')} · {start.strftime('%I:%M %p')} – {end.strftime('%I:%M %p')}"
+
+def repeat_rule(choice, until_date=None):
+    """The recurrence rule for a "Repeats" choice, or None for a one-off."""
+    options = REPEAT_OPTIONS[choice]
+    if options is None:
+        return None
+    return make_rule(until=datetime.datetime.combine(until_date, time.max) if until_date else None, **options)
+
+def parse_calendar_date(value):
+    """Parses a FullCalendar date string into the naive local datetimes stored in Mongo."""
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=None)
+
+def default_calendar_view():
+    start, end = month_grid_range(datetime.date.today())
+    return {"type": CALENDAR_OPTIONS["initialView"], "start": start, "end": end,
+            "initial_date": datetime.date.today().isoformat()}
+
+def calendar_view_from_dates_set(dates_set):
+    """Turns the component's datesSet callback payload into the visible range we load data for."""
+    view = dates_set.get("view", {})
+    start = parse_calendar_date(dates_set["start"])
+    return {"type": view.get("type", CALENDAR_OPTIONS["initialView"]), "start": start,
+            "end": parse_calendar_date(dates_set["end"]),
+            "initial_date": parse_calendar_date(view.get("currentStart", dates_set["start"])).date().isoformat()}
+
 # ==============================================================================
 # 4. MAIN APP LAYOUT & LOGIC
 # ==============================================================================
 
+# --- Household for this session (cached readers and the repository are scoped to it) ---
+st.session_state[TENANT_KEY] = resolve_household()
+get_archiver()
+
 # --- Get Partner Names for entire app ---
 partner_names = get_partner_names()
 p1_name, p2_name = partner_names
@@ -257,6 +521,13 @@ with st.sidebar:
         st.success("Names updated!")
         st.rerun()
 
+    with st.expander("📊 Cache stats"):
+        stats = cache_stats()
+        if stats:
+            st.dataframe(pd.DataFrame.from_dict(stats, orient="index"), use_container_width=True)
+        else:
+            st.caption("No cached reads yet.")
+
 # --- Main Header ---
 col1, col2 = st.columns([3, 1])
 with col1:
@@ -292,166 +563,296 @@ if st.session_state.show_emergency_modal:
     show_emergency_dialog()
 
 # --- Display Active Emergency Alert Banner ---
-active_alert = get_unseen_emergency_alert()
-if active_alert:
-    sender = active_alert.get('sender', 'Your partner')
-    alert_id = active_alert.get('_id')
-    urgency_msg = active_alert.get('urgency', 'Your partner wants to connect!')
-    st.error(f"🚨 **HIGH PRIORITY ALERT!** {urgency_msg.replace('**', '')} - Sent by {sender}", icon="🔥")
-    if st.button(f"I see it! Clear Alert", key=f"clear_alert_{alert_id}", use_container_width=True):
-        mark_emergency_as_seen(alert_id)
-        st.success("Alert cleared. Time to connect. 😉")
-        st.rerun()
-    st.markdown("---")
-
-# --- Main App Tabs ---
-dashboard_tab, calendar_tab, wellness_tab, notes_tab = st.tabs(
-    ["🏡 Dashboard", "📅 Our Calendar", "🌿 Our Wellness", "💌 Messages"]
-)
+# The notifier pushes alerts into process memory, so this fragment's refresh never queries Mongo.
+# Not traced: it polls every second and would only flood the trace file.
+@st.fragment(run_every=ALERT_REFRESH_SECONDS)
+def emergency_alert_banner():
+    active_alert = get_unseen_emergency_alert()
+    if active_alert:
+        sender = active_alert.get('sender', 'Your partner')
+        alert_id = active_alert.get('_id')
+        urgency_msg = active_alert.get('urgency', 'Your partner wants to connect!')
+        st.error(f"🚨 **HIGH PRIORITY ALERT!** {urgency_msg.replace('**', '')} - Sent by {sender}", icon="🔥")
+        if st.button(f"I see it! Clear Alert", key=f"clear_alert_{alert_id}", use_container_width=True):
+            mark_emergency_as_seen(alert_id)
+            st.success("Alert cleared. Time to connect. 😉")
+            st.rerun(scope="fragment")
+        st.markdown("---")
+
+emergency_alert_banner()
+
+# --- Main Sections ---
+# Only the selected section runs on each rerun, and forms/widgets with their own
+# state are fragments, so interacting with them reruns just that fragment. A full
+# rerun happens only after a successful write that other parts of the page show.
 
 # ==============================================================================
-# TAB 1: DASHBOARD
+# SECTION 1: DASHBOARD
 # ==============================================================================
-with dashboard_tab:
-    st.header("Today's Dashboard")
-    st.markdown("---")
-
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        st.subheader("✨ Feeling Spontaneous?")
-        if st.button("Send a Spontaneous Invitation", use_container_width=True):
-            st.session_state.show_spontaneous_request = not st.session_state.get('show_spontaneous_request', False)
+@st.fragment
+@traced
+def spontaneous_invitation():
+    st.subheader("✨ Feeling Spontaneous?")
+    if st.button("Send a Spontaneous Invitation", use_container_width=True):
+        st.session_state.show_spontaneous_request = not st.session_state.get('show_spontaneous_request', False)
 
     if st.session_state.get('show_spontaneous_request', False):
-        with st.form("spontaneous_form"):
+        # Not an st.form: the free slots refresh as soon as "When?" changes (this fragment only).
+        with st.container(border=True):
             st.subheader("Create Your Invitation")
-            requester = st.selectbox("This invitation is from", partner_names)
-            vibe = st.text_input("What's the vibe?", placeholder="e.g., Passionate & Intense, Playful & Fun")
-            timing = st.selectbox("When?", ["Sometime tonight", "Soon", "This afternoon", "Tomorrow evening", "This weekend"])
-            if st.form_submit_button("Send Invitation 💕", use_container_width=True):
-                planned_time = datetime.datetime.now()
-                if "tonight" in timing.lower(): planned_time = planned_time.replace(hour=21, minute=0)
-                elif "tomorrow" in timing.lower(): planned_time += timedelta(days=1)
-                
-                if check_for_overlap(planned_time, planned_time + timedelta(hours=2)):
-                    st.error("That time conflicts with a blocked-out period.")
-                else:
-                    add_event(f"Spontaneous: {vibe}", planned_time, requester, True, "intimate", partner_colors)
+            requester = st.selectbox("This invitation is from", partner_names, key="invite_from")
+            vibe = st.text_input("What's the vibe?", placeholder="e.g., Passionate & Intense, Playful & Fun", key="invite_vibe")
+            timing = st.selectbox("When?", INVITATION_TIMINGS, key="invite_timing")
+            slots = find_mutual_free_slots(invitation_windows(timing, datetime.datetime.now()), DEFAULT_EVENT_LENGTH)
+            if not slots:
+                st.warning("You're both booked up then. Try another time!")
+            else:
+                slot = st.selectbox("Free for both of you", slots, format_func=format_slot, key="invite_slot")
+                if st.button("Send Invitation 💕", use_container_width=True):
+                    add_event(f"Spontaneous: {vibe}", slot[0], requester, True, "intimate", partner_colors, end_time=slot[1])
                     st.success("Your invitation has been sent! 💕✨")
                     st.session_state.show_spontaneous_request = False
                     st.rerun()
 
+@timed()
+def upcoming_time_together():
+    st.subheader("🗓️ Upcoming Time Together")
+    now = datetime.datetime.now()
+    # Fetched per minute bucket; anything that started since the bucket began is dropped here.
+    upcoming = [e for e in get_upcoming_events(now.replace(second=0, microsecond=0)) if e['start'] > now]
+    if not upcoming:
+        st.info("The calendar is open! Time to plan your next connection.")
+    else:
+        for event in upcoming:
+            with st.container(border=True):
+                event_date = event['start']
+                icon = "🔥" if event.get("is_spontaneous") else "💕"
+                booker = event.get('booker', 'Unknown')
+                badge = partner_colored_badge(booker, partner_names)
+                st.markdown(
+                    f"{badge} **{icon} {event['title']}**<br>"
+                    f"_{event_date.strftime('%A, %b %d at %I:%M %p')}_", unsafe_allow_html=True
+                )
+
+@timed()
+def render_dashboard():
+    st.header("Today's Dashboard")
+    st.markdown("---")
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        spontaneous_invitation()
     with col2:
-        st.subheader("🗓️ Upcoming Time Together")
-        all_upcoming = sorted(
-            [e for e in get_events() if datetime.datetime.fromisoformat(e['start']) > datetime.datetime.now()],
-            key=lambda x: x['start']
-        )
-        if not all_upcoming:
-            st.info("The calendar is open! Time to plan your next connection.")
-        else:
-            for event in all_upcoming[:3]:
-                with st.container(border=True):
-                    event_date = datetime.datetime.fromisoformat(event['start'])
-                    icon = "🔥" if event.get("is_spontaneous") else "💕"
-                    booker = event.get('booker', 'Unknown')
-                    badge = partner_colored_badge(booker, partner_names)
-                    st.markdown(
-                        f"{badge} **{icon} {event['title']}**<br>"
-                        f"_{event_date.strftime('%A, %b %d at %I:%M %p')}_", unsafe_allow_html=True
-                    )
+        upcoming_time_together()
 
 # ==============================================================================
-# TAB 2: CALENDAR
+# SECTION 2: CALENDAR
 # ==============================================================================
-with calendar_tab:
+@st.fragment
+@traced
+def plan_event_form():
+    with st.expander("📅 Plan Together Time", expanded=True):
+        # Not an st.form: conflicts and alternative slots update live as the time changes (this fragment only).
+        planner = st.selectbox("Who's planning this?", partner_names, key="plan_planner")
+        event_title = st.text_input("Event Title", placeholder="E.g. Date Night", key="plan_title")
+        event_type = st.selectbox("Event Type", ["intimate", "date", "self_care", "wellness"], key="plan_type")
+        start_dt = st.date_input("Date", value=datetime.date.today(), key="plan_date")
+        start_time = st.time_input("Time", value=time(hour=20, minute=0), key="plan_time")
+        duration = timedelta(hours=st.slider("Duration (hours)", 0.5, 6.0, 2.0, 0.5, key="plan_duration"))
+        repeats = st.selectbox("Repeats", list(REPEAT_OPTIONS), key="plan_repeats")
+        repeat_until = st.date_input("Repeat until (optional)", value=None, key="plan_until") if REPEAT_OPTIONS[repeats] else None
+        start_datetime = datetime.datetime.combine(start_dt, start_time)
+        chosen = (start_datetime, start_datetime + duration)
+        conflicts = check_for_overlap(*chosen)
+        clashes = clashing_events(*chosen)
+        if conflicts:
+            st.warning(f"That time conflicts with a blocked-out period: {describe_conflicts(conflicts)}.")
+        if clashes:
+            st.warning(f"That time overlaps something already planned: {describe_conflicts(clashes)}.")
+        if conflicts or clashes:
+            slots = find_mutual_free_slots(same_time_windows(start_datetime, duration, SLOT_SEARCH_DAYS), duration)
+            chosen = st.radio("Nearest times you're both free", slots, format_func=format_slot, key="plan_slot") if slots else None
+            if chosen is None:
+                st.error("No free slot in the following week. Try another date.")
+        if st.button("Add Event", use_container_width=True, disabled=chosen is None):
+            add_event(event_title, chosen[0], planner, False, event_type, partner_colors, end_time=chosen[1],
+                      recurrence=repeat_rule(repeats, repeat_until))
+            st.session_state.pop("plan_title", None)
+            st.success("Event added!"); st.rerun()
+
+@st.fragment
+@traced
+def blockout_form():
+    with st.expander("📵 Block Out Time", expanded=True):
+        with st.form("new_blockout", clear_on_submit=True):
+            blockout_title = st.text_input("Blockout Title", placeholder="E.g. Work Project")
+            blockout_type = st.selectbox("Blockout Type", ["general", "health", "work", "family", "personal"])
+            start_block_date = st.date_input("Start Date", value=datetime.date.today(), key='bsd')
+            start_block_time = st.time_input("Start Time", value=time(hour=9), key='bst')
+            end_block_date = st.date_input("End Date", value=datetime.date.today(), key='bed')
+            end_block_time = st.time_input("End Time", value=time(hour=17), key='bet')
+            repeats = st.selectbox("Repeats", list(REPEAT_OPTIONS), key='brp')
+            repeat_until = st.date_input("Repeat until (optional)", value=None, key='bru')
+            if st.form_submit_button("Add Blockout", use_container_width=True):
+                start_dt = datetime.datetime.combine(start_block_date, start_block_time)
+                end_dt = datetime.datetime.combine(end_block_date, end_block_time)
+                if start_dt >= end_dt:
+                    st.error("End time must be after start time.")
+                else:
+                    add_blockout(blockout_title, start_dt, end_dt, False, blockout_type,
+                                 recurrence=repeat_rule(repeats, repeat_until))
+                    st.success("Blockout added!"); st.rerun()
+
+@st.fragment
+@traced
+def calendar_sync():
+    with st.expander("🔄 Import / Export (.ics)"):
+        col1, col2 = st.columns(2)
+        with col1:
+            uploaded = st.file_uploader("Import a calendar file", type=["ics"], key="ics_upload")
+            import_as = st.radio("Import as", ["Blockouts", "Events"], horizontal=True, key="ics_kind")
+            if import_as == "Blockouts":
+                blockout_type = st.selectbox("Blockout Type", ["general", "health", "work", "family", "personal"], key="ics_type")
+                template = blockout_style(blockout_type)
+            else:
+                booker = st.selectbox("Whose events are these?", partner_names, key="ics_booker")
+                template = event_style(booker, False, "date", partner_colors)
+            if st.button("Import", use_container_width=True, disabled=uploaded is None):
+                try:
+                    stats = import_ics(uploaded, import_as.lower(), template)
+                except ValueError as e:
+                    st.error(f"Couldn't import {uploaded.name}: {e}. Entries before the problem may have been imported; "
+                             "importing the complete file again updates them in place.")
+                else:
+                    skipped = f" Skipped {stats['malformed']} unreadable entries." if stats.get("malformed") else ""
+                    st.success(f"Imported {stats.get('inserted', 0)} new and {stats.get('updated', 0)} updated entries.{skipped}")
+                    st.rerun()
+        with col2:
+            today = datetime.date.today()
+            export_range = st.date_input("Export range", value=(today - timedelta(days=30), today + timedelta(days=365)), key="ics_range")
+            kinds = st.multiselect("Include", ["events", "blockouts"], default=["events", "blockouts"], key="ics_kinds")
+            if len(export_range) == 2 and kinds and st.button("Prepare export", use_container_width=True):
+                range_start = datetime.datetime.combine(export_range[0], time())
+                range_end = datetime.datetime.combine(export_range[1], time()) + timedelta(days=1)
+                st.download_button("Download .ics", data=export_ics(kinds, range_start, range_end),
+                                   file_name="our-calendar.ics", mime="text/calendar", use_container_width=True)
+
+@timed("calendar payload")
+def calendar_payload(window_start, window_end):
+    return to_calendar_events(get_events_between(window_start, window_end) + get_blockouts_between(window_start, window_end))
+
+@st.fragment
+@traced
+def shared_calendar():
+    view = st.session_state.setdefault("calendar_view", default_calendar_view())
+    window_start, window_end = padded_window(view["start"], view["end"], CALENDAR_PREFETCH_DAYS)
+    calendar_state = calendar(
+        events=calendar_payload(window_start, window_end),
+        options=dict(CALENDAR_OPTIONS, initialView=view["type"], initialDate=view["initial_date"]),
+        callbacks=["datesSet", "eventClick"], key="shared_calendar",
+    )
+    # The component keeps returning its last callback, so each click is only acted on once.
+    if calendar_state.get("callback") == "eventClick" and calendar_state["eventClick"] != st.session_state.get("last_event_click"):
+        st.session_state.last_event_click = calendar_state["eventClick"]
+        clicked = calendar_state["eventClick"].get("event", {})
+        props = clicked.get("extendedProps", {})
+        st.session_state.selected_occurrence = (
+            {"title": clicked.get("title"), **props} if props.get("series_id") else None
+        )
+    occurrence = st.session_state.get("selected_occurrence")
+    if occurrence:
+        st.caption(f"🔁 '{occurrence['title'] or 'Untitled'}' repeats.")
+        if st.button("Skip this occurrence", key="skip_occurrence"):
+            skip_occurrence(occurrence["series_kind"], occurrence["series_id"], parse_calendar_date(occurrence["occurrence_start"]))
+            st.session_state.selected_occurrence = None
+            st.rerun(scope="fragment")
+    if calendar_state.get("callback") == "datesSet":
+        new_view = calendar_view_from_dates_set(calendar_state["datesSet"])
+        if new_view != view:
+            st.session_state.calendar_view = new_view
+            # Only refetch once the user navigates past the prefetched margin.
+            if new_view["start"] < window_start or new_view["end"] > window_end:
+                st.rerun(scope="fragment")
+
+@timed()
+def render_calendar():
     st.header("Our Shared Calendar")
     st.markdown("---")
     col1, col2 = st.columns(2)
     with col1:
-        with st.expander("📅 Plan Together Time", expanded=True):
-            with st.form("new_date", clear_on_submit=True):
-                planner = st.selectbox("Who's planning this?", partner_names)
-                event_title = st.text_input("Event Title", placeholder="E.g. Date Night")
-                event_type = st.selectbox("Event Type", ["intimate", "date", "self_care", "wellness"])
-                start_dt = st.date_input("Date", value=datetime.date.today())
-                start_time = st.time_input("Time", value=time(hour=20, minute=0))
-                duration = st.slider("Duration (hours)", 0.5, 6.0, 2.0, 0.5)
-                if st.form_submit_button("Add Event", use_container_width=True):
-                    start_datetime = datetime.datetime.combine(start_dt, start_time)
-                    end_datetime = start_datetime + timedelta(hours=duration)
-                    if check_for_overlap(start_datetime, end_datetime):
-                        st.error("This event conflicts with a blocked-out period.")
-                    else:
-                        add_event(event_title, start_datetime, planner, False, event_type, partner_colors)
-                        st.success("Event added!"); st.rerun()
-
+        plan_event_form()
     with col2:
-        with st.expander("📵 Block Out Time", expanded=True):
-            with st.form("new_blockout", clear_on_submit=True):
-                blockout_title = st.text_input("Blockout Title", placeholder="E.g. Work Project")
-                blockout_type = st.selectbox("Blockout Type", ["general", "health", "work", "family", "personal"])
-                start_block_date = st.date_input("Start Date", value=datetime.date.today(), key='bsd')
-                start_block_time = st.time_input("Start Time", value=time(hour=9), key='bst')
-                end_block_date = st.date_input("End Date", value=datetime.date.today(), key='bed')
-                end_block_time = st.time_input("End Time", value=time(hour=17), key='bet')
-                if st.form_submit_button("Add Blockout", use_container_width=True):
-                    start_dt = datetime.datetime.combine(start_block_date, start_block_time)
-                    end_dt = datetime.datetime.combine(end_block_date, end_block_time)
-                    if start_dt >= end_dt:
-                        st.error("End time must be after start time.")
-                    else:
-                        add_blockout(blockout_title, start_dt, end_dt, False, blockout_type)
-                        st.success("Blockout added!"); st.rerun()
-
+        blockout_form()
+    calendar_sync()
     st.markdown("---")
-    calendar(events=get_events() + get_blockouts(), options=CALENDAR_OPTIONS)
+    shared_calendar()
 
 # ==============================================================================
-# TAB 3: WELLNESS
+# SECTION 3: WELLNESS
 # ==============================================================================
-with wellness_tab:
+@st.fragment
+@traced
+def mood_form(partner):
+    with st.container(border=True):
+        st.subheader(f"Log for {partner}")
+        today = datetime.date.today()
+        with st.form(f"mood_form_{partner}", clear_on_submit=True):
+            energy = st.slider("Energy Level", 0, 10, 5, key=f"en_{partner}")
+            desire = st.slider("Desire Level", 0, 10, 5, key=f"de_{partner}")
+            stress = st.slider("Stress Level (inverted)", 0, 10, 5, key=f"st_{partner}", help="0=high stress, 10=no stress")
+            notes = st.text_area("Notes (optional)", key=f"no_{partner}", placeholder="How are you feeling?")
+            if st.form_submit_button("Save Wellness Data", use_container_width=True):
+                log_mood(partner, today, energy, desire, stress, notes)
+                st.success(f"Wellness data saved for {partner}!"); st.rerun()
+
+@st.fragment
+@traced
+def wellness_trends():
+    st.header("Wellness Trends")
+    trend_range = st.date_input("Date range", value=default_trend_range(), key="trend_range")
+    if len(trend_range) != 2:
+        return
+    range_start = datetime.datetime.combine(trend_range[0], time())
+    range_end = datetime.datetime.combine(trend_range[1], time()) + timedelta(days=1)
+    unit = pick_granularity(range_start, range_end)
+    mood_data = get_mood_trends(range_start, range_end, unit)
+    if not mood_data:
+        st.info("Log some wellness data above to see your trends over time!")
+    else:
+        with timed("trends chart"):
+            render_trends_chart(mood_data, unit)
+
+def render_trends_chart(mood_data, unit):
+    df_long = pd.DataFrame([
+        {"date": row["date"], "partner": row["partner"], "metric": metric,
+         "level": row[metric], "rolling": row[f"{metric}_rolling"], "days": row["days"]}
+        for row in mood_data for metric in MOOD_METRICS
+    ])
+    chart = alt.Chart(df_long).mark_line(point=True).encode(
+        x=alt.X('date:T', title='Date'), y=alt.Y('level:Q', title=f'Average level per {unit} (0-10)'),
+        color=alt.Color('partner:N', title='Partner'), strokeDash=alt.StrokeDash('metric:N', title='Metric'),
+        tooltip=['date:T', 'partner:N', 'metric:N', 'level:Q',
+                 alt.Tooltip('rolling:Q', title='Rolling mean'), alt.Tooltip('days:Q', title='Days logged')]
+    ).interactive().properties(title='Our Wellness Journey Over Time')
+    st.altair_chart(chart, use_container_width=True)
+
+@timed()
+def render_wellness():
     st.header("🌿 Wellness Hub")
     st.markdown("A space to check in with yourselves and each other.")
     st.markdown("---")
     col1, col2 = st.columns(2)
     for i, partner in enumerate(partner_names):
         with col1 if i == 0 else col2:
-            with st.container(border=True):
-                st.subheader(f"Log for {partner}")
-                today = datetime.date.today()
-                with st.form(f"mood_form_{partner}", clear_on_submit=True):
-                    energy = st.slider("Energy Level", 0, 10, 5, key=f"en_{partner}")
-                    desire = st.slider("Desire Level", 0, 10, 5, key=f"de_{partner}")
-                    stress = st.slider("Stress Level (inverted)", 0, 10, 5, key=f"st_{partner}", help="0=high stress, 10=no stress")
-                    notes = st.text_area("Notes (optional)", key=f"no_{partner}", placeholder="How are you feeling?")
-                    if st.form_submit_button("Save Wellness Data", use_container_width=True):
-                        log_mood(partner, today, energy, desire, stress, notes)
-                        st.success(f"Wellness data saved for {partner}!"); st.rerun()
-
+            mood_form(partner)
     st.markdown("---")
-    st.header("Wellness Trends")
-    mood_data = get_all_moods()
-    if not mood_data:
-        st.info("Log some wellness data above to see your trends over time!")
-    else:
-        df = pd.DataFrame(mood_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df_melted = df.melt(id_vars=['date', 'partner'], value_vars=['energy', 'desire', 'stress'],
-                            var_name='metric', value_name='level')
-        chart = alt.Chart(df_melted).mark_line(point=True).encode(
-            x=alt.X('date:T', title='Date'), y=alt.Y('level:Q', title='Level (0-10)'),
-            color=alt.Color('partner:N', title='Partner'), strokeDash=alt.StrokeDash('metric:N', title='Metric'),
-            tooltip=['date:T', 'partner:N', 'metric:N', 'level:Q']
-        ).interactive().properties(title='Our Wellness Journey Over Time')
-        st.altair_chart(chart, use_container_width=True)
+    wellness_trends()
 
 # ==============================================================================
-# TAB 4: MESSAGES
+# SECTION 4: MESSAGES
 # ==============================================================================
-with notes_tab:
-    st.header("💌 Love Notes & Messages")
-    st.markdown("---")
+@st.fragment
+@traced
+def love_note_form():
     with st.expander("💌 Send a new message", expanded=True):
         with st.form("new_love_note", clear_on_submit=True):
             author = st.selectbox("Who's writing?", partner_names)
@@ -463,16 +864,95 @@ with notes_tab:
                 else:
                     st.error("Message cannot be empty.")
 
-    st.markdown("---")
+def render_note(msg):
+    with st.container(border=True):
+        author = msg.get("author", "Unknown")
+        date_str = msg.get("timestamp", datetime.datetime.now()).strftime("%b %d, %Y at %I:%M %p")
+        badge = partner_colored_badge(author, partner_names)
+        st.markdown(f"{badge} **{author}** _wrote on {date_str}_:", unsafe_allow_html=True)
+        st.markdown(f"> {msg.get('message')}")
+
+def note_search_results(query, author, date_range):
+    range_start = datetime.datetime.combine(date_range[0], time()) if len(date_range) == 2 else None
+    range_end = datetime.datetime.combine(date_range[1], time()) + timedelta(days=1) if len(date_range) == 2 else None
+    # Reset to the first page whenever the search itself changes.
+    search_key = (query, author, range_start, range_end)
+    if st.session_state.get("note_search_key") != search_key:
+        st.session_state.note_search_key = search_key
+        st.session_state.note_search_page = 0
+    page = st.session_state.note_search_page
+    results, has_more = search_love_notes(query, author, range_start, range_end, page)
+    if not results:
+        st.info("No messages match that search.")
+    for msg in results:
+        render_note(msg)
+    col1, col2 = st.columns(2)
+    if page > 0 and col1.button("Previous results", use_container_width=True):
+        st.session_state.note_search_page -= 1
+        st.rerun(scope="fragment")
+    if has_more and col2.button("More results", use_container_width=True):
+        st.session_state.note_search_page += 1
+        st.rerun(scope="fragment")
+
+@st.fragment
+@traced
+def message_history():
     st.subheader("Our Message History")
-    messages = get_all_love_notes()
-    if not messages:
+    col1, col2, col3 = st.columns([2, 1, 1])
+    query = col1.text_input("Search messages", placeholder="e.g. anniversary dinner", key="note_query").strip()
+    author = col2.selectbox("Written by", ["Either of us"] + partner_names, key="note_author", disabled=not query)
+    date_range = col3.date_input("Between", value=[], key="note_range", disabled=not query,
+                                 help="Without a range, only recent messages are searched; archived ones need a range.")
+    if query:
+        note_search_results(query, None if author == "Either of us" else author, date_range)
+        return
+    # One cursor per loaded page; "load older" appends the (timestamp, _id) of the last note shown.
+    cursors = st.session_state.setdefault("note_cursors", [None])
+    pages = [get_love_notes_page(before=cursor) for cursor in cursors]
+    if not pages[0]:
         st.info("No messages yet. Start by sending one above!")
     else:
-        for msg in messages:
-            with st.container(border=True):
-                author = msg.get("author", "Unknown")
-                date_str = msg.get("timestamp", datetime.datetime.now()).strftime("%b %d, %Y at %I:%M %p")
-                badge = partner_colored_badge(author, partner_names)
-                st.markdown(f"{badge} **{author}** _wrote on {date_str}_:", unsafe_allow_html=True)
-                st.markdown(f"> {msg.get('message')}")
+        for page in pages:
+            for msg in page:
+                render_note(msg)
+        if len(pages[-1]) == NOTES_PAGE_SIZE:
+            if st.button("Load older messages", use_container_width=True):
+                cursors.append((pages[-1][-1]["timestamp"], pages[-1][-1]["_id"]))
+                st.rerun(scope="fragment")
+
+@timed()
+def render_messages():
+    st.header("💌 Love Notes & Messages")
+    st.markdown("---")
+    love_note_form()
+    st.markdown("---")
+    message_history()
+
+SECTIONS = {
+    "🏡 Dashboard": render_dashboard,
+    "📅 Our Calendar": render_calendar,
+    "🌿 Our Wellness": render_wellness,
+    "💌 Messages": render_messages,
+}
+active_section = st.radio("Section", list(SECTIONS), horizontal=True, label_visibility="collapsed", key="active_section")
+SECTIONS[active_section]()
+
+# --- Performance Trace ---
+# Always recorded (a few counters per rerun); the panel is opt-in via the
+# `perf_panel` secret or a `?perf=1` query parameter. Fragment reruns are traced by
+# `traced` and show up in the recent-runs table on the next full rerun.
+rerun_trace = finish_trace(cache_stats(), PERF_TRACE_FILE)
+record_trace(rerun_trace)
+if PERF_PANEL:
+    with st.sidebar.expander("⏱️ Rerun performance", expanded=True):
+        st.metric("Rerun time", f"{rerun_trace.total_ms:.0f} ms")
+        recent = [(trace.name, round(trace.total_ms, 1), trace.mongo["queries"], round(trace.mongo["ms"], 1))
+                  for trace in reversed(st.session_state.perf_history)]
+        st.dataframe(pd.DataFrame(recent, columns=["recent run", "ms", "mongo queries", "mongo ms"]),
+                     use_container_width=True, hide_index=True)
+        mongo = rerun_trace.mongo
+        st.caption(f"Mongo: {mongo['queries']} queries, {mongo['bytes'] / 1024:.1f} KiB, {mongo['ms']:.0f} ms")
+        if rerun_trace.spans:
+            st.dataframe(pd.DataFrame(rerun_trace.spans, columns=["span", "ms"]), use_container_width=True, hide_index=True)
+        if rerun_trace.cache:
+            st.dataframe(pd.DataFrame.from_dict(rerun_trace.cache, orient="index"), use_container_width=True)
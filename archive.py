@@ -0,0 +1,125 @@
+"""Cold-data archiving: moves old love notes, moods and past events out of the hot collections.
+
+Documents older than a per-collection age go to year-partitioned archive collections
+(``love_notes_archive_2023`` and so on), so the hot collections and their indexes only
+hold recent data. A run first raises the collection's watermark (kept in ``app_state``),
+then moves documents below it in batches. Each batch copies before it deletes, so an
+interrupted run is finished by simply running again. Watermarks are shared by every
+household; documents are moved one household at a time.
+
+Readers stay on the hot tier unless a read reaches below the watermark: paging past
+the newest notes, opening an old calendar month, or picking an old trends or search
+range. Only then do they also read the matching year partitions. Run it from cron::
+
+    python archive.py run
+    python archive.py run --max-age love_notes=180 --max-age events=90
+    python archive.py status
+
+or let the app run it in the background by setting the ``archive_interval_hours``
+secret (ages come from the ``archive_max_age_days`` secret table).
+"""
+import argparse
+import datetime
+import threading
+import time
+
+BATCH_SIZE = 1000
+DEFAULT_MAX_AGE_DAYS = {"love_notes": 365, "moods": 730, "events": 365}
+MIN_AGE_DAYS = 30  # never archive what the app still writes to (today's moods, this month's events)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def archive_cutoff(max_age_days, now):
+    """Midnight `max_age_days` before `now`, so every run on the same day uses the same cutoff."""
+    days = max(int(max_age_days), MIN_AGE_DAYS)
+    return datetime.datetime.combine((now - datetime.timedelta(days=days)).date(), datetime.time())
+
+
+def run_archiving(repo, max_age_days=None, now=None, batch_size=BATCH_SIZE, log=print):
+    """Archives every configured collection down to its cutoff. Returns how many documents moved per collection."""
+    max_age_days = dict(DEFAULT_MAX_AGE_DAYS, **(max_age_days or {}))
+    now = now or datetime.datetime.now()
+    targets, raised = {}, False
+    for collection, days in max_age_days.items():
+        cutoff = archive_cutoff(days, now)
+        watermark = repo.archive_watermark(collection)
+        if watermark is None or cutoff > watermark:
+            repo.set_archive_watermark(collection, cutoff)
+            watermark, raised = cutoff, True
+        # A lower cutoff than an earlier run's (a longer age) never brings documents back.
+        targets[collection] = watermark
+    if raised:
+        # Give every reader time to see the new watermarks before anything below them leaves the hot tier.
+        time.sleep(repo.watermark_ttl)
+
+    # Batches are per household so that each one is a range scan on a household-first index.
+    tenants = [repo.for_household(household) for household in repo.households()]
+    moved = {}
+    for collection, watermark in targets.items():
+        moved[collection] = 0
+        for tenant in tenants:
+            while True:
+                count = tenant.archive_batch(collection, watermark, batch_size)
+                moved[collection] += count
+                if count < batch_size:
+                    break
+        log(f"{collection}: {moved[collection]} document(s) archived below {watermark:%Y-%m-%d} "
+            f"across {len(tenants)} household(s)")
+    return moved
+
+
+def start_scheduler(repo, interval_seconds, max_age_days=None, log=print):
+    """Runs `run_archiving` on a daemon thread every `interval_seconds`; failures are logged and retried next time.
+
+    One scheduler per process: while it is running, later calls return its thread instead of starting another.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None and _scheduler.is_alive():
+            return _scheduler
+        _scheduler = threading.Thread(target=_schedule, args=(repo, interval_seconds, max_age_days, log),
+                                      name="archiver", daemon=True)
+        _scheduler.start()
+        return _scheduler
+
+
+def _schedule(repo, interval_seconds, max_age_days, log):
+    while True:
+        try:
+            run_archiving(repo, max_age_days, log=log)
+        except Exception as exc:  # keep the schedule alive through transient database errors
+            log(f"Archiving failed, retrying in {interval_seconds}s: {exc}")
+        time.sleep(interval_seconds)
+
+
+def parse_max_age(value):
+    collection, _, days = value.partition("=")
+    if collection not in DEFAULT_MAX_AGE_DAYS or not days.isdigit():
+        raise argparse.ArgumentTypeError(f"expected COLLECTION=DAYS with COLLECTION in {sorted(DEFAULT_MAX_AGE_DAYS)}")
+    return collection, int(days)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive cold love notes, moods and past events.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="move everything past its maximum age to the archive")
+    run_parser.add_argument("--max-age", type=parse_max_age, action="append", default=[], metavar="COLLECTION=DAYS")
+    run_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    commands.add_parser("status", help="show each collection's archive watermark")
+    args = parser.parse_args(argv)
+
+    from migrations import connect
+    from storage import create_repository
+    repo = create_repository("mongo", db=connect())
+    if args.command == "run":
+        run_archiving(repo, dict(args.max_age), batch_size=args.batch_size)
+    else:
+        for collection in DEFAULT_MAX_AGE_DAYS:
+            watermark = repo.archive_watermark(collection)
+            print(f"{collection:<12} {'archived below ' + f'{watermark:%Y-%m-%d}' if watermark else 'nothing archived'}")
+
+
+if __name__ == "__main__":
+    main()
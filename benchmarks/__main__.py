@@ -0,0 +1,233 @@
+"""Offline benchmark harness for the app's hot paths.
+
+Seeds the in-memory storage backend with synthetic data (by default 50k events,
+20k blockouts, 200k love notes, 5 years of daily moods for both partners and 1k
+recurring event/blockout series), plus a 100k-event .ics file to import, then
+times the same helpers the app runs on each rerun. Run from the repo root:
+
+    python -m benchmarks                   # compare against benchmarks/baseline.json
+    python -m benchmarks --update-baseline # record new baseline timings
+    python -m benchmarks --scale 0.1 --baseline small.json --update-baseline  # quicker, smaller dataset
+
+Exits non-zero when any path is slower than its baseline times ``--tolerance``
+(plus ``--slack-ms`` of absolute timer noise). The baseline records the ``--scale`` it
+was taken at, and runs at any other scale refuse to compare against it.
+Baselines are machine-specific: record them on the machine that runs the check.
+"""
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import pickle
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+from ical import import_calendar
+from recurrence import ExpansionCache, expand, make_rule, new_series
+from scheduling import (
+    build_blockout_index, find_free_slots, month_grid_range, padded_window, to_calendar_events, upcoming_events,
+)
+from shared_cache import create_cache
+from storage import CALENDAR_FIELDS, NOTE_FIELDS, UPCOMING_FIELDS, create_repository
+from trends import downsample, pick_granularity
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+EPOCH = datetime.datetime(2021, 1, 1)
+NOW = datetime.datetime(2025, 6, 15, 12, 0)
+PARTNERS = ("Partner 1", "Partner 2")
+# Love-note vocabulary with Zipf-like frequencies, offset as if stopwords had taken the top ranks:
+# the most common word appears in roughly one note in ten, the rarest in a handful.
+VOCAB = [f"word{i}" for i in range(5_000)]
+VOCAB_WEIGHTS = list(itertools.accumulate(1 / (rank + 50) for rank in range(len(VOCAB))))
+
+
+def seed(repo, scale=1.0, seed=42):
+    """Loads synthetic data spread over 5 years ending roughly at NOW."""
+    rng = random.Random(seed)
+    span_minutes = 5 * 365 * 24 * 60
+
+    def moment():
+        return EPOCH + datetime.timedelta(minutes=rng.randrange(span_minutes))
+
+    events = [
+        {"title": f"Event {i}", "start": moment(), "backgroundColor": "#87CEEB", "borderColor": "#87CEEB",
+         "booker": rng.choice(PARTNERS), "is_spontaneous": rng.random() < 0.2, "event_type": "date"}
+        for i in range(int(50_000 * scale))
+    ]
+    blockouts = []
+    for i in range(int(20_000 * scale)):
+        start = moment()
+        blockouts.append({
+            "title": f"Blockout {i}", "start": start,
+            "end": start + datetime.timedelta(minutes=rng.choice((30, 60, 120, 480, 1440))),
+            "allDay": False, "backgroundColor": "#B0B0B0", "borderColor": "#B0B0B0",
+            "display": "background", "blockout_type": "work",
+        })
+    notes = [
+        {"author": rng.choice(PARTNERS),
+         "message": " ".join(rng.choices(VOCAB, cum_weights=VOCAB_WEIGHTS, k=rng.randrange(4, 60))),
+         "timestamp": moment(), "type": "love_note"}
+        for i in range(int(200_000 * scale))
+    ]
+    days = int(5 * 365 * scale)
+    moods = [
+        {"partner": partner, "date": EPOCH + datetime.timedelta(days=day),
+         "energy": rng.randrange(11), "desire": rng.randrange(11), "stress": rng.randrange(11), "notes": ""}
+        for day in range(days) for partner in PARTNERS
+    ]
+    repo.load(events=events, blockouts=blockouts, love_notes=notes, moods=moods)
+    rules = [make_rule("daily"), make_rule("weekly", byweekday=[0, 2, 4]), make_rule("weekly", interval=2), make_rule("monthly")]
+    series_count = int(1_000 * scale)
+    for i in range(series_count):
+        start = moment()
+        doc = {"title": f"Series {i}", "start": start, "end": start + datetime.timedelta(hours=1),
+               "backgroundColor": "#B0B0B0", "borderColor": "#B0B0B0"}
+        repo.insert_series("events" if i % 2 else "blockouts", new_series(doc, rng.choice(rules)))
+    return {"events": len(events), "blockouts": len(blockouts), "love_notes": len(notes), "moods": len(moods),
+            "series": series_count}
+
+
+def ics_file(count, seed=3):
+    """A synthetic .ics calendar with `count` one-hour VEVENTs."""
+    rng = random.Random(seed)
+    chunks = ["BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//bench//EN\r\n"]
+    for i in range(count):
+        start = EPOCH + datetime.timedelta(minutes=rng.randrange(5 * 365 * 24 * 60))
+        chunks.append(
+            f"BEGIN:VEVENT\r\nUID:bench-{i}@example.com\r\nDTSTAMP:20250101T000000Z\r\n"
+            f"DTSTART:{start:%Y%m%dT%H%M%S}\r\nDTEND:{start + datetime.timedelta(hours=1):%Y%m%dT%H%M%S}\r\n"
+            f"SUMMARY:Imported {i}\r\nEND:VEVENT\r\n"
+        )
+    chunks.append("END:VCALENDAR\r\n")
+    return "".join(chunks)
+
+
+def measure(func, repeat):
+    """Median per-call ms over `repeat` samples; fast paths are looped so each sample lasts at least ~20 ms."""
+    loops, _ = timeit.Timer(func).autorange()
+    loops = max(1, loops // 10)
+    samples = [timeit.timeit(func, number=loops) * 1000 / loops for _ in range(repeat)]
+    return statistics.median(samples)
+
+
+def hot_paths(repo, scale=1.0):
+    """Name -> zero-argument callable, mirroring what the app does for each hot path."""
+    rng = random.Random(7)
+    blockout_index = build_blockout_index(repo.find_blockouts())
+    events = repo.find_events()
+    windows = []
+    for _ in range(100):
+        start = EPOCH + datetime.timedelta(minutes=rng.randrange(5 * 365 * 24 * 60))
+        windows.append((start, start + datetime.timedelta(hours=2)))
+    calendar_window = padded_window(*month_grid_range(NOW.date()), 7)
+    deepest = repo.love_notes_page(limit=100_000, fields=NOTE_FIELDS)[-1]
+    deep_cursor = (deepest["timestamp"], deepest["_id"])
+    trend_start, trend_end = NOW - datetime.timedelta(days=5 * 365), NOW
+    week = (NOW, NOW + datetime.timedelta(days=7))
+    series = repo.find_series("events") + repo.find_series("blockouts")
+    expansions = ExpansionCache()
+    ics_text = ics_file(int(100_000 * scale))
+
+    def free_slots():
+        busy = [(b["start"], b["end"]) for b in blockout_index.overlapping(*week)]
+        busy += [(e["start"], e.get("end") or e["start"] + datetime.timedelta(hours=2))
+                 for e in repo.events_between(*padded_window(*week, 1), CALENDAR_FIELDS)]
+        return find_free_slots(busy, datetime.timedelta(hours=2), *week, count=5)
+
+    # A calendar payload as another replica would have left it in the on-disk shared cache.
+    shared = create_cache("sqlite", path=os.path.join(tempfile.gettempdir(), "rendezvous-bench-cache.sqlite3"))
+    shared.set("calendar", pickle.dumps(
+        repo.events_between(*calendar_window, CALENDAR_FIELDS) + repo.blockouts_between(*calendar_window, CALENDAR_FIELDS)
+    ), 3600)
+
+    def shared_calendar_hit():
+        shared.versions(["default/events", "default/event_series"])
+        return to_calendar_events(pickle.loads(shared.get("calendar")))
+
+    def ics_import():
+        target = create_repository("memory")
+        import_calendar(target, io.StringIO(ics_text), "blockouts", {})
+        return target.blockouts_between(NOW, NOW + datetime.timedelta(days=1))  # includes the deferred re-sort
+
+    return {
+        "check_for_overlap x100": lambda: [blockout_index.overlapping(s, e) for s, e in windows],
+        "blockout index build": lambda: build_blockout_index(repo.find_blockouts()),
+        "upcoming events (indexed)": lambda: repo.upcoming_events(NOW, 3, UPCOMING_FIELDS),
+        "upcoming events (heap)": lambda: upcoming_events(events, NOW, 3),
+        "free slots (7 days)": free_slots,
+        "calendar payload": lambda: to_calendar_events(
+            repo.events_between(*calendar_window, CALENDAR_FIELDS) + repo.blockouts_between(*calendar_window, CALENDAR_FIELDS)
+        ),
+        "calendar payload (shared hit)": shared_calendar_hit,
+        "recurring expansion (calendar)": lambda: [occ for s in series for occ in expand(s, *calendar_window)],
+        "recurring expansion (cached)": lambda: expansions.expand_all(series, *calendar_window),
+        "ics import (100k events)": ics_import,
+        "note search (common term)": lambda: repo.search_love_notes("word0", fields=NOTE_FIELDS),
+        "note search (rare terms)": lambda: repo.search_love_notes("word3000 word4000", fields=NOTE_FIELDS),
+        "note search (filtered page 3)": lambda: repo.search_love_notes(
+            "word20 -word1", author=PARTNERS[0], range_start=NOW - datetime.timedelta(days=365), skip=50, fields=NOTE_FIELDS
+        ),
+        "message history first page": lambda: repo.love_notes_page(fields=NOTE_FIELDS),
+        "message history deep page": lambda: repo.love_notes_page(before=deep_cursor, fields=NOTE_FIELDS),
+        "wellness trends 5y": lambda: downsample(
+            repo.mood_trends(trend_start, trend_end, pick_granularity(trend_start, trend_end))
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths against the in-memory backend.")
+    parser.add_argument("--scale", type=float, default=1.0, help="dataset size multiplier (default 1.0)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path; the median is reported")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="allowed slowdown factor vs. the baseline")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="absolute slowdown always tolerated (timer noise)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            recorded = json.load(fh)
+        if recorded.get("scale") != args.scale:
+            # Timings grow with the dataset: comparing across scales flags (or hides) regressions that aren't there.
+            print(f"Baseline {args.baseline} was recorded at --scale {recorded.get('scale')}, not {args.scale}; "
+                  "rerun at that scale or pass --update-baseline", file=sys.stderr)
+            return 2
+        baseline = recorded["timings"]
+
+    repo = create_repository("memory")
+    t0 = time.perf_counter()
+    counts = seed(repo, scale=args.scale)
+    print(f"Seeded {counts} in {time.perf_counter() - t0:.1f}s")
+
+    results = {name: measure(func, args.repeat) for name, func in hot_paths(repo, args.scale).items()}
+    regressions = []
+    print(f"{'path':<30} {'median ms':>10} {'baseline':>10}")
+    for name, ms in results.items():
+        allowed = baseline.get(name)
+        flag = ""
+        if allowed is not None and ms > allowed * args.tolerance + args.slack_ms:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<30} {ms:>10.3f} {allowed if allowed is not None else '-':>10}{flag}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump({"scale": args.scale, "timings": {name: round(ms, 3) for name, ms in results.items()}}, fh, indent=2)
+            fh.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"{len(regressions)} path(s) regressed beyond {args.tolerance}x: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Benchmark: linear blockout scan vs. IntervalIndex.
+
+Run from the repo root with ``python -m benchmarks.bench_overlap``.
+"""
+import datetime
+import random
+import timeit
+
+from scheduling import IntervalIndex
+
+SIZES = (10_000, 100_000)
+QUERIES = 200
+EPOCH = datetime.datetime(2020, 1, 1)
+
+
+def make_blockouts(count, seed=7):
+    """Synthetic work/health blockouts spread over ~5 years, stored as ISO strings like the app does."""
+    rng = random.Random(seed)
+    blockouts = []
+    for i in range(count):
+        start = EPOCH + datetime.timedelta(minutes=rng.randrange(5 * 365 * 24 * 60))
+        end = start + datetime.timedelta(minutes=rng.choice((30, 60, 120, 480, 1440)))
+        blockouts.append({"_id": str(i), "title": f"Blockout {i}", "start": start.isoformat(), "end": end.isoformat()})
+    return blockouts
+
+
+def linear_scan(blockouts, new_start, new_end):
+    """The original check_for_overlap, extended to collect every conflict."""
+    conflicts = []
+    for blockout in blockouts:
+        block_start = datetime.datetime.fromisoformat(blockout['start'])
+        block_end = datetime.datetime.fromisoformat(blockout['end'])
+        if new_start < block_end and new_end > block_start:
+            conflicts.append(blockout)
+    return conflicts
+
+
+def build_index(blockouts):
+    return IntervalIndex(
+        (datetime.datetime.fromisoformat(b['start']), datetime.datetime.fromisoformat(b['end']), b)
+        for b in blockouts
+    )
+
+
+def main():
+    rng = random.Random(11)
+    print(f"{'blockouts':>10} {'linear ms/q':>12} {'index ms/q':>11} {'speedup':>9} {'build ms':>9}")
+    for size in SIZES:
+        blockouts = make_blockouts(size)
+        windows = []
+        for _ in range(QUERIES):
+            start = EPOCH + datetime.timedelta(minutes=rng.randrange(5 * 365 * 24 * 60))
+            windows.append((start, start + datetime.timedelta(hours=2)))
+
+        build_seconds = timeit.timeit(lambda: build_index(blockouts), number=1)
+        index = build_index(blockouts)
+        for start, end in windows[:20]:
+            assert [b["_id"] for b in index.overlapping(start, end)] == \
+                [b["_id"] for b in sorted(linear_scan(blockouts, start, end), key=lambda b: b["start"])]
+
+        linear_runs = windows[:max(1, QUERIES // 20)]
+        linear_seconds = timeit.timeit(lambda: [linear_scan(blockouts, s, e) for s, e in linear_runs], number=1)
+        index_seconds = timeit.timeit(lambda: [index.overlapping(s, e) for s, e in windows], number=1)
+        linear_ms = linear_seconds * 1000 / len(linear_runs)
+        index_ms = index_seconds * 1000 / len(windows)
+        print(f"{size:>10} {linear_ms:>12.3f} {index_ms:>11.4f} {linear_ms / index_ms:>8.0f}x {build_seconds * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Per-interaction latency from the app's trace files (see perf.py).
+
+Each line of a trace file is one run: ``rerun`` for a full script rerun or
+``fragment:<name>`` for a fragment rerunning on its own. This groups runs by name
+and reports their latency, so the cost of an interaction can be compared before and
+after a change. Record a trace file per build (``RENDEZVOUS_TRACE_FILE`` or the
+``perf_trace_file`` secret), click through the same interactions, then run from
+the repo root:
+
+    python -m benchmarks.interactions after.jsonl
+    python -m benchmarks.interactions after.jsonl --before before.jsonl
+"""
+import argparse
+import json
+import statistics
+import sys
+
+
+def load_runs(path):
+    """Run name -> list of (total ms, Mongo queries) from a JSON-lines trace file."""
+    runs = {}
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                trace = json.loads(line)
+                runs.setdefault(trace["name"], []).append((trace["total_ms"], trace["mongo"]["queries"]))
+    return runs
+
+
+def summarize(samples):
+    """(runs, p50 ms, p95 ms, median Mongo queries) for one run name."""
+    times = sorted(ms for ms, _ in samples)
+    p95 = times[min(len(times) - 1, round(0.95 * (len(times) - 1)))]
+    return len(times), statistics.median(times), p95, statistics.median(queries for _, queries in samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize per-interaction latency from trace files.")
+    parser.add_argument("trace_file")
+    parser.add_argument("--before", help="trace file from the build to compare against")
+    args = parser.parse_args(argv)
+
+    after = load_runs(args.trace_file)
+    before = load_runs(args.before) if args.before else {}
+    print(f"{'run':<34} {'runs':>5} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'before p50':>11}")
+    for name in sorted(after.keys() | before.keys()):
+        count, p50, p95, queries = summarize(after[name]) if name in after else (0, float("nan"), float("nan"), 0)
+        previous = f"{summarize(before[name])[1]:>11.1f}" if name in before else f"{'-':>11}"
+        print(f"{name:<34} {count:>5} {p50:>8.1f} {p95:>8.1f} {queries:>8.0f} {previous}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
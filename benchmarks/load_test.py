@@ -0,0 +1,186 @@
+"""Multi-household load test: per-request latency should not grow with the number of households.
+
+Seeds every household with the same modest dataset, then runs a fixed number of
+concurrent sessions, each request picking a random household and doing what one app
+rerun does against storage (calendar window, upcoming events, first notes page; now
+and then a search, a trends read or a write). The number of households grows from
+level to level while concurrency stays the same, so any growth in latency comes from
+the data of other households leaking into a household's reads. Run from the repo root:
+
+    python -m benchmarks.load_test                       # in-memory backend (harness check only)
+    python -m benchmarks.load_test --households 50 200 500 --concurrency 64
+    MONGO_URI=... python -m benchmarks.load_test --backend mongo --database rendezvous_loadtest
+
+The Mongo run is the evidence that tenancy scales: it goes through the app's connection
+pool (storage.mongo.POOL_OPTIONS) and the household-first indexes, built in a scratch
+database that is dropped afterwards. The in-memory run does not exercise either: each
+household is its own repository there, so its latency is flat by construction and it
+only checks the harness and the app's per-request work. Exits non-zero when the p95
+latency at the largest level exceeds the smallest level's by more than ``--tolerance``.
+"""
+import argparse
+import datetime
+import gc
+import itertools
+import random
+import statistics
+import sys
+import threading
+import time
+
+from scheduling import month_grid_range, padded_window
+from storage import CALENDAR_FIELDS, NOTE_FIELDS, UPCOMING_FIELDS, create_repository
+
+SCRATCH_DATABASE = "rendezvous_loadtest"
+NOW = datetime.datetime(2025, 6, 15, 12, 0)
+PARTNERS = ("Partner 1", "Partner 2")
+VOCAB = [f"word{i}" for i in range(2_000)]
+VOCAB_WEIGHTS = list(itertools.accumulate(1 / (rank + 50) for rank in range(len(VOCAB))))
+CALENDAR_WINDOW = padded_window(*month_grid_range(NOW.date()), 7)
+
+
+def household_id(number):
+    return f"household-{number:05d}"
+
+
+def household_data(rng):
+    """One household's documents: about a year of events, blockouts, notes and daily moods."""
+    span_minutes = 365 * 24 * 60
+
+    def moment():
+        return NOW - datetime.timedelta(minutes=rng.randrange(span_minutes))
+
+    events = [{"title": f"Event {i}", "start": moment(), "backgroundColor": "#87CEEB", "borderColor": "#87CEEB",
+               "booker": rng.choice(PARTNERS), "is_spontaneous": False, "event_type": "date"} for i in range(200)]
+    blockouts = []
+    for i in range(50):
+        start = moment()
+        blockouts.append({"title": f"Blockout {i}", "start": start, "end": start + datetime.timedelta(hours=2),
+                          "allDay": False, "display": "background", "blockout_type": "work"})
+    notes = [{"author": rng.choice(PARTNERS), "timestamp": moment(), "type": "love_note",
+              "message": " ".join(rng.choices(VOCAB, cum_weights=VOCAB_WEIGHTS, k=rng.randrange(4, 30)))}
+             for _ in range(300)]
+    moods = [{"partner": partner, "date": datetime.datetime.combine((NOW - datetime.timedelta(days=day)).date(), datetime.time()),
+              "energy": rng.randrange(11), "desire": rng.randrange(11), "stress": rng.randrange(11), "notes": ""}
+             for day in range(90) for partner in PARTNERS]
+    return {"events": events, "blockouts": blockouts, "love_notes": notes, "moods": moods}
+
+
+def seed_households(repo, first, count, seed=11):
+    """Adds households first..first+count-1 to the store behind `repo`."""
+    for number in range(first, first + count):
+        household = household_id(number)
+        data = household_data(random.Random(seed + number))
+        if hasattr(repo, "load"):
+            repo.for_household(household).load(**data)
+        else:
+            for collection, docs in data.items():
+                repo.db[collection].insert_many([dict(doc, household=household) for doc in docs], ordered=False)
+
+
+def session_request(tenant, rng):
+    """What one rerun of the app asks of storage, plus the occasional write or heavier read."""
+    tenant.events_between(*CALENDAR_WINDOW, CALENDAR_FIELDS)
+    tenant.blockouts_between(*CALENDAR_WINDOW, CALENDAR_FIELDS)
+    tenant.upcoming_events(NOW, 3, UPCOMING_FIELDS)
+    tenant.love_notes_page(limit=25, fields=NOTE_FIELDS)
+    roll = rng.random()
+    if roll < 0.1:
+        tenant.search_love_notes(rng.choice(VOCAB[:200]), fields=NOTE_FIELDS)
+    elif roll < 0.2:
+        tenant.mood_trends(NOW - datetime.timedelta(days=90), NOW, "week")
+    elif roll < 0.25:
+        tenant.insert_love_note({"author": PARTNERS[0], "message": "thinking of you", "timestamp": NOW, "type": "love_note"})
+
+
+def run_level(repo, households, concurrency, requests_per_session, think_ms, seed=5):
+    """Per-request latencies (ms) of `concurrency` sessions spread over `households` households.
+
+    Sessions pause for `think_ms` on average between requests, like people between reruns; without it,
+    in-memory requests never block and the numbers would measure GIL hand-offs rather than the requests.
+    """
+    tenants = [repo.for_household(household_id(number)) for number in range(households)]
+    latencies = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(concurrency)
+
+    def session(number):
+        rng = random.Random(seed * 1000 + number)
+        mine = []
+        start_line.wait()
+        for _ in range(requests_per_session):
+            time.sleep(rng.expovariate(1000 / think_ms))
+            tenant = rng.choice(tenants)
+            t0 = time.perf_counter()
+            session_request(tenant, rng)
+            mine.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=session, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def percentile(samples, fraction):
+    return statistics.quantiles(samples, n=100)[round(fraction * 100) - 1]
+
+
+def open_repository(args):
+    if args.backend == "memory":
+        return create_repository("memory"), lambda: None
+    if args.database == "rendezvous":
+        raise SystemExit("Refusing to load-test the production database; pass a scratch --database")
+    from pymongo import MongoClient
+    import certifi
+    from migrations import create_indexes, load_mongo_uri
+    from storage.mongo import POOL_OPTIONS
+    client = MongoClient(load_mongo_uri(), tlsCAFile=certifi.where(), **POOL_OPTIONS)
+    db = client.get_database(args.database)
+    create_indexes(db, log=lambda message: None)
+    return create_repository("mongo", db=db), lambda: client.drop_database(args.database)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that per-request latency stays flat as households are added.")
+    parser.add_argument("--backend", choices=("memory", "mongo"), default="memory")
+    parser.add_argument("--database", default=SCRATCH_DATABASE, help="scratch database for --backend mongo")
+    parser.add_argument("--households", type=int, nargs="+", default=[50, 200, 500],
+                        help="household counts to step through (ascending)")
+    parser.add_argument("--concurrency", type=int, default=100, help="concurrent sessions at every level")
+    parser.add_argument("--requests", type=int, default=40, help="requests per session per level")
+    parser.add_argument("--think-ms", type=float, default=50, help="mean pause between a session's requests")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed p95 growth from the smallest to the largest level")
+    args = parser.parse_args(argv)
+
+    repo, cleanup = open_repository(args)
+    try:
+        seeded, rows = 0, []
+        print(f"{'households':>10} {'requests':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for households in sorted(args.households):
+            t0 = time.perf_counter()
+            seed_households(repo, seeded, households - seeded)
+            seeded = households
+            seed_seconds = time.perf_counter() - t0
+            # Seeded documents live for the whole run: keep full collections of them out of the measurements.
+            gc.collect()
+            gc.freeze()
+            run_level(repo, households, args.concurrency, 2, args.think_ms)  # warm-up
+            latencies = run_level(repo, households, args.concurrency, args.requests, args.think_ms)
+            row = (households, len(latencies), *(percentile(latencies, q) for q in (0.5, 0.95, 0.99)), max(latencies))
+            rows.append(row)
+            print(f"{row[0]:>10} {row[1]:>9} {row[2]:>8.2f} {row[3]:>8.2f} {row[4]:>8.2f} {row[5]:>8.2f}"
+                  f"   (seeded in {seed_seconds:.1f}s)")
+    finally:
+        cleanup()
+
+    growth = rows[-1][3] / rows[0][3]
+    print(f"p95 grew {growth:.2f}x from {rows[0][0]} to {rows[-1][0]} households (tolerance {args.tolerance}x)")
+    return 0 if growth <= args.tolerance else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Collection-aware caching for the data helpers.
+
+Every cached reader declares the collections it reads. Each collection carries a
+version stamp that is part of the reader's cache key, so a write only has to bump
+the stamps of the collections it touched: dependent readers miss on their next
+call, every other reader keeps serving its cached value.
+
+Stamps and cache entries are per tenant (household): the session's household is part
+of every reader's cache key, and a write only bumps its own household's stamps.
+
+With the ``shared_cache`` secret set (e.g. ``{backend = "sqlite", path = "..."}`` or
+``{backend = "redis", url = "redis://..."}``, see ``shared_cache``), stamps live in the
+shared tier, so a write on any replica invalidates every replica, and a local miss
+first looks for the payload another replica already loaded before querying the
+database. If the shared tier is unreachable, readers fall back to process-local
+stamps and query the database, as without one, and the tier is left alone for
+``shared_cache.SHARED_RETRY_SECONDS`` so later reruns don't each wait for it to time
+out. Shared payloads are keyed on the deployed code version (``RENDEZVOUS_VERSION``,
+else a hash of the sources), so replicas mid-deploy never read what the other version
+cached.
+"""
+import functools
+import threading
+from collections import Counter
+
+import streamlit as st
+
+from shared_cache import BACKENDS, SharedTier, code_version, create_cache
+from storage import DEFAULT_HOUSEHOLD
+
+TENANT_KEY = "household"  # session_state entry naming the session's household
+LOCAL = "local"  # marks stamps that did not come from the shared tier
+_lock = threading.Lock()
+
+# Part of every shared-tier key: replicas running different code never exchange payloads.
+CODE_VERSION = code_version()
+
+
+@st.cache_resource
+def _collection_versions():
+    return Counter()
+
+
+@st.cache_resource
+def _reader_stats():
+    return {}
+
+
+@st.cache_resource
+def _shared_tier():
+    """The shared second-level cache named by the `shared_cache` secret, or None."""
+    options = dict(st.secrets.get("shared_cache", {}))
+    if not options:
+        return None
+    if "backend" not in options:
+        raise ValueError(f"The shared_cache secret needs a backend, one of {sorted(BACKENDS)}")
+    return SharedTier(create_cache(options.pop("backend"), **options), CODE_VERSION)
+
+
+def current_tenant():
+    """The household the current session reads and writes."""
+    return st.session_state.get(TENANT_KEY, DEFAULT_HOUSEHOLD)
+
+
+def collection_versions(collections, tenant=None):
+    """Current version stamps for `collections` (the current tenant's unless `tenant` is given).
+
+    Shared stamps are read in one round trip; process-local ones are tagged with LOCAL so the two never collide.
+    """
+    tenant = tenant or current_tenant()
+    shared = _shared_tier()
+    if shared is not None:
+        versions = shared.versions(tenant, collections)
+        if versions is not None:
+            return versions
+    versions = _collection_versions()
+    return (LOCAL, *(versions[tenant, name] for name in collections))
+
+
+def invalidate(*collections):
+    """Bumps the current tenant's version stamps of `collections` after a write, on every replica."""
+    tenant = current_tenant()
+    versions = _collection_versions()
+    with _lock:
+        for name in collections:
+            versions[tenant, name] += 1
+    shared = _shared_tier()
+    if shared is not None:
+        shared.bump(tenant, collections)
+
+
+def cache_stats():
+    """Per-reader call/hit/miss counters since the process started (shared hits are local misses served by the shared tier)."""
+    with _lock:
+        return {
+            name: {"calls": calls, "hits": calls - misses - shared_hits, "shared_hits": shared_hits, "misses": misses,
+                   "collections": ", ".join(collections)}
+            for name, (collections, calls, misses, shared_hits) in sorted(_reader_stats().items())
+        }
+
+
+def _record(name, collections, calls=0, misses=0, shared_hits=0):
+    stats = _reader_stats()
+    with _lock:
+        _, prev_calls, prev_misses, prev_shared_hits = stats.get(name, (collections, 0, 0, 0))
+        stats[name] = (collections, prev_calls + calls, prev_misses + misses, prev_shared_hits + shared_hits)
+
+
+def cached_reader(*collections, ttl=None):
+    """Like ``st.cache_data(ttl=...)``, but keyed on the tenant and its version stamps of `collections`.
+
+    Local misses go to the shared tier (when configured) before calling `func`, and store what `func` returns there.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def load(*args, tenant, versions, **kwargs):
+            shared = _shared_tier() if versions[0] != LOCAL else None
+            if shared is None:
+                _record(name, collections, misses=1)
+                return func(*args, **kwargs)
+            value, shared_hit = shared.load(name, args, kwargs, tenant, versions,
+                                            lambda: func(*args, **kwargs), ttl)
+            if shared_hit:
+                _record(name, collections, shared_hits=1)
+            else:
+                _record(name, collections, misses=1)
+            return value
+
+        cached = st.cache_data(ttl=ttl)(load)
+
+        @functools.wraps(func)
+        def reader(*args, **kwargs):
+            _record(name, collections, calls=1)
+            tenant = current_tenant()
+            return cached(*args, tenant=tenant, versions=collection_versions(collections, tenant), **kwargs)
+
+        reader.collections = collections
+        return reader
+    return decorator
@@ -0,0 +1 @@
+"""Puts the repository root on sys.path so tests import the app's modules as the app does."""
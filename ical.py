@@ -0,0 +1,359 @@
+"""Streaming iCalendar (.ics) import and export for events and blockouts.
+
+Import reads a file line by line, turns each VEVENT into an event or blockout
+document and writes them in batches keyed on the VEVENT ``UID``, so re-importing
+a file updates what it imported before instead of duplicating it. Memory stays
+bounded by the batch size. Recurring VEVENTs become one series document (see
+``recurrence``); modified instances (``RECURRENCE-ID``) are imported as single
+documents and skipped in their series. Export is a generator over the backend's
+cursor. From the command line::
+
+    python ical.py import work.ics --as blockouts --type work
+    python ical.py export ours.ics --start 2025-01-01 --end 2026-01-01
+
+Times are stored as naive local datetimes, like the rest of the app: UTC and
+``TZID`` times are converted to this machine's local time, and floating times are
+kept as they are.
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import re
+import sys
+import zoneinfo
+from collections import Counter
+
+from recurrence import make_rule, new_series
+
+IMPORT_BATCH_SIZE = 1000
+PRODID = "-//Rendezvous//Our Connection Calendar//EN"
+ICS_WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+SUPPORTED_RRULE_PARTS = {"FREQ", "INTERVAL", "BYDAY", "UNTIL", "COUNT", "WKST"}
+DURATION_PATTERN = re.compile(r"([-+])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+ESCAPED_TEXT = re.compile(r"\\([\\;,nN])")
+
+
+# --- parsing ---
+
+def unfold(lines):
+    """Joins RFC 5545 folded lines (continuations start with a space or tab), dropping line endings and blanks."""
+    current = None
+    for raw in lines:
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_line(line):
+    """Splits a content line into (NAME, {PARAM: value}, value)."""
+    if '"' in line:
+        # Quoted parameter values may contain ':'; the value starts at the first colon outside quotes.
+        in_quotes = False
+        for split_at, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ":" and not in_quotes:
+                break
+        head, value = line[:split_at], line[split_at + 1:]
+    else:
+        head, _, value = line.partition(":")
+    name, *raw_params = head.split(";")
+    params = {}
+    for param in raw_params:
+        key, _, param_value = param.partition("=")
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+
+def iter_vevents(lines):
+    """Yields each top-level VEVENT as {NAME: (params, value)}; EXDATE maps to a list. Nested components are skipped.
+
+    Raises ValueError for input that is not a calendar, checked before anything is yielded, and for one that ends
+    inside a VEVENT.
+    """
+    props, depth, started = None, 0, False
+    for line in unfold(lines):
+        name, params, value = parse_line(line)
+        if not started:
+            if name != "BEGIN" or value.upper() != "VCALENDAR":
+                raise ValueError("not an iCalendar file (it does not start with BEGIN:VCALENDAR)")
+            started = True
+        elif name == "BEGIN":
+            if props is None:
+                if value.upper() == "VEVENT":
+                    props = {}
+            else:
+                depth += 1
+        elif name == "END":
+            if props is not None:
+                if depth:
+                    depth -= 1
+                else:
+                    yield props
+                    props = None
+        elif props is not None and not depth:
+            if name == "EXDATE":
+                props.setdefault(name, []).append((params, value))
+            else:
+                props[name] = (params, value)
+    if not started:
+        raise ValueError("the file is empty")
+    if props is not None:
+        raise ValueError("the file ends inside an event; it may be truncated")
+
+
+@functools.lru_cache(maxsize=64)
+def _zone(tzid):
+    try:
+        return zoneinfo.ZoneInfo(tzid.strip("/"))
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def parse_datetime(value, params):
+    """(naive local datetime, is_all_day) for a DATE or DATE-TIME value."""
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:8])), True
+    # Sliced by hand: strptime would dominate the cost of a large import.
+    moment = datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                               int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    zone = datetime.timezone.utc if value.endswith("Z") else _zone(params["TZID"]) if "TZID" in params else None
+    if zone is not None:
+        moment = moment.replace(tzinfo=zone).astimezone().replace(tzinfo=None)
+    return moment, False
+
+
+def parse_duration(value):
+    match = DURATION_PATTERN.match(value)
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = datetime.timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                                  minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == "-" else duration
+
+
+def unescape(value):
+    if "\\" not in value:
+        return value
+    return ESCAPED_TEXT.sub(lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+
+def parse_rrule(value):
+    """The recurrence rule for an RRULE value, or None when it uses parts we cannot expand."""
+    parts = dict(part.split("=", 1) for part in value.upper().split(";") if "=" in part)
+    if set(parts) - SUPPORTED_RRULE_PARTS:
+        return None
+    freq, interval = parts.get("FREQ", ""), int(parts.get("INTERVAL", 1))
+    if freq == "YEARLY":
+        freq, interval = "MONTHLY", interval * 12
+    if freq not in ("DAILY", "WEEKLY", "MONTHLY"):
+        return None
+    byweekday = None
+    if "BYDAY" in parts:
+        days = parts["BYDAY"].split(",")
+        if freq != "WEEKLY" or any(day not in ICS_WEEKDAYS for day in days):
+            return None
+        byweekday = [ICS_WEEKDAYS.index(day) for day in days]
+    until = None
+    if "UNTIL" in parts:
+        until, all_day = parse_datetime(parts["UNTIL"], {})
+        if all_day:
+            until += datetime.timedelta(days=1, microseconds=-1)
+    count = int(parts["COUNT"]) if "COUNT" in parts else None
+    return make_rule(freq.lower(), interval, byweekday, until, count)
+
+
+def vevent_to_doc(props, template):
+    """The app document for one VEVENT, or None when it is cancelled or has no DTSTART."""
+    if "DTSTART" not in props or props.get("STATUS", ({}, ""))[1].upper() == "CANCELLED":
+        return None
+    start_params, start_value = props["DTSTART"]
+    start, all_day = parse_datetime(start_value, start_params)
+    if "DTEND" in props:
+        end = parse_datetime(props["DTEND"][1], props["DTEND"][0])[0]
+    elif "DURATION" in props and parse_duration(props["DURATION"][1]) is not None:
+        end = start + parse_duration(props["DURATION"][1])
+    else:
+        end = start + datetime.timedelta(days=1) if all_day else start
+    title = unescape(props["SUMMARY"][1]) if "SUMMARY" in props else template.get("title", "Untitled")
+    uid = props["UID"][1] if "UID" in props else hashlib.sha1(f"{start_value}|{title}".encode()).hexdigest()
+    return dict(template, uid=uid, title=title, start=start, end=max(end, start), allDay=all_day)
+
+
+# --- import ---
+
+def import_calendar(repo, lines, kind, template, batch_size=IMPORT_BATCH_SIZE):
+    """Imports every VEVENT in `lines` as `kind` ("events" or "blockouts"), merging `template` into each document.
+
+    Writes at most `batch_size` documents per backend call and returns counts of what happened.
+    The caller invalidates caches once, after the whole import.
+    """
+    stats = Counter()
+    singles, series, exdates = {}, {}, {}
+
+    def flush(batch, is_series):
+        if batch:
+            inserted, replaced = repo.upsert_by_uid(kind, list(batch.values()), series=is_series)
+            stats["inserted"] += inserted
+            stats["updated"] += replaced
+            batch.clear()
+
+    for props in iter_vevents(lines):
+        try:
+            doc = vevent_to_doc(props, template)
+            if doc is None:
+                stats["skipped"] += 1
+                continue
+            if "RECURRENCE-ID" in props:
+                # A modified instance: stored as a one-off, and skipped in its series.
+                original = parse_datetime(props["RECURRENCE-ID"][1], props["RECURRENCE-ID"][0])[0]
+                exdates.setdefault(doc["uid"], []).append(original)
+                doc["uid"] = f"{doc['uid']}/{original.isoformat()}"
+                singles[doc["uid"]] = doc
+            elif "RRULE" in props:
+                rule = parse_rrule(props["RRULE"][1])
+                if rule is None:
+                    stats["unsupported_rules"] += 1  # imported as its first occurrence only
+                    singles[doc["uid"]] = doc
+                else:
+                    doc = new_series(doc, rule)
+                    doc["exdates"] = [
+                        parse_datetime(value, params)[0]
+                        for params, values in props.get("EXDATE", ()) for value in values.split(",")
+                    ]
+                    series[doc["uid"]] = doc
+            else:
+                singles[doc["uid"]] = doc
+        except ValueError:
+            stats["malformed"] += 1  # an unreadable date, duration or rule: skip the event, keep the rest
+            continue
+        if len(singles) >= batch_size:
+            flush(singles, False)
+        if len(series) >= batch_size:
+            flush(series, True)
+    flush(singles, False)
+    flush(series, True)
+    if exdates:
+        repo.add_series_exdates(kind, exdates)
+    return dict(stats)
+
+
+# --- export ---
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def fold(line):
+    """Folds a content line to at most 75 octets per physical line, as RFC 5545 asks."""
+    if len(line) <= 75 and line.isascii():
+        return line + "\r\n"
+    chunks, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > (75 if not chunks else 74):
+            chunks.append(current)
+            current, size = "", 0
+        current += char
+        size += width
+    chunks.append(current)
+    return "\r\n ".join(chunks) + "\r\n"
+
+
+def format_datetime(moment, all_day=False):
+    return moment.strftime("%Y%m%d") if all_day else moment.strftime("%Y%m%dT%H%M%S")
+
+
+def format_rrule(rule):
+    parts = [f"FREQ={rule['freq'].upper()}", f"INTERVAL={rule['interval']}"]
+    if rule.get("byweekday"):
+        parts.append("BYDAY=" + ",".join(ICS_WEEKDAYS[day] for day in rule["byweekday"]))
+    if rule.get("until"):
+        parts.append(f"UNTIL={format_datetime(rule['until'])}")
+    if rule.get("count"):
+        parts.append(f"COUNT={rule['count']}")
+    return ";".join(parts)
+
+
+def format_vevent(doc, stamp, recurrence_id=None):
+    all_day = bool(doc.get("allDay"))
+    date_param = ";VALUE=DATE" if all_day else ""
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{doc.get('uid') or str(doc['_id']) + '@rendezvous'}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART{date_param}:{format_datetime(doc['start'], all_day)}",
+        f"DTEND{date_param}:{format_datetime(doc.get('end') or doc['start'], all_day)}",
+        f"SUMMARY:{escape(doc.get('title') or 'Untitled')}",
+    ]
+    if recurrence_id is not None:
+        lines.append(f"RECURRENCE-ID{date_param}:{format_datetime(recurrence_id, all_day)}")
+    elif doc.get("recurrence"):
+        lines.append(f"RRULE:{format_rrule(doc['recurrence'])}")
+        lines += [f"EXDATE{date_param}:{format_datetime(exdate, all_day)}" for exdate in doc.get("exdates") or ()]
+    lines.append("END:VEVENT")
+    return "".join(fold(line) for line in lines)
+
+
+def export_calendar(repo, kinds, range_start, range_end):
+    """Yields the .ics text for `kinds` in [range_start, range_end), one VEVENT at a time."""
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{PRODID}\r\nCALSCALE:GREGORIAN\r\n"
+    for kind in kinds:
+        for doc in repo.iter_between(kind, range_start, range_end):
+            yield format_vevent(doc, stamp)
+        for series in repo.find_series(kind):
+            until = series["recurrence"].get("until")
+            if series["start"] >= range_end or (until is not None and until < range_start):
+                continue
+            yield format_vevent(series, stamp)
+            for override in series.get("overrides") or ():
+                instance = dict(series, **{key: value for key, value in override.items() if key != "original_start"})
+                yield format_vevent(instance, stamp, recurrence_id=override["original_start"])
+    yield "END:VCALENDAR\r\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export .ics files against the rendezvous database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import a .ics file")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--as", dest="kind", choices=("blockouts", "events"), default="blockouts")
+    import_parser.add_argument("--type", default="general", help="blockout type (blockouts only)")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    export_parser = commands.add_parser("export", help="export a date range to a .ics file ('-' for stdout)")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--start", type=datetime.datetime.fromisoformat, required=True)
+    export_parser.add_argument("--end", type=datetime.datetime.fromisoformat, required=True)
+    export_parser.add_argument("--kinds", nargs="+", choices=("blockouts", "events"), default=["events", "blockouts"])
+    for command_parser in (import_parser, export_parser):
+        command_parser.add_argument("--household", help="household id (default: the default household)")
+    args = parser.parse_args(argv)
+
+    from migrations import connect
+    from scheduling import blockout_style
+    from storage import DEFAULT_HOUSEHOLD, create_repository
+    repo = create_repository("mongo", db=connect(), household=args.household or DEFAULT_HOUSEHOLD)
+    if args.command == "import":
+        template = blockout_style(args.type) if args.kind == "blockouts" else {}
+        with open(args.file, encoding="utf-8-sig", errors="replace", newline="") as fh:
+            stats = import_calendar(repo, fh, args.kind, template, batch_size=args.batch_size)
+        print(f"Imported {args.file}: {stats}")
+    else:
+        out = contextlib.nullcontext(sys.stdout) if args.file == "-" else open(args.file, "w", encoding="utf-8", newline="")
+        with out as out:
+            out.writelines(export_calendar(repo, args.kinds, args.start, args.end))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Versioned schema migrations for the rendezvous database.
+
+Migrations run in order and each one is recorded in the ``schema`` document of
+``app_state`` once it succeeds, so every migration runs exactly once per database.
+This module also owns every index definition. The app applies pending migrations
+once per process, under a lease in ``app_state`` so that replicas starting together
+run each migration once, one after the other; deployments can apply them ahead of time
+instead::
+
+    python migrations.py upgrade
+    python migrations.py status
+
+The Mongo URI is read from ``MONGO_URI`` or, failing that, ``.streamlit/secrets.toml``
+(the same ``mongo_uri`` secret the app uses). Migrations are idempotent and the data
+migrations are batched, so an interrupted run can simply be started again.
+"""
+import argparse
+import datetime
+import os
+import socket
+import time
+import tomllib
+import uuid
+
+import certifi
+from pymongo import ASCENDING, DESCENDING, TEXT, MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from storage import DEFAULT_HOUSEHOLD
+
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+SCHEMA_KEY = "schema"
+BATCH_SIZE = 500
+# Only the process holding this app_state document migrates. It is renewed after every migration and expires on
+# its own, so a process that dies mid-migration holds up the others for at most LEASE_SECONDS.
+LEASE_KEY = "migration_lease"
+LEASE_SECONDS = 600
+LEASE_POLL_SECONDS = 2
+
+# .ics imports deduplicate on the VEVENT UID; documents created in the app have none.
+UID_INDEX = {"name": "import_uid", "unique": True, "partialFilterExpression": {"uid": {"$exists": True}}}
+HOUSEHOLD = ("household", ASCENDING)
+# app_state documents that belong to the deployment rather than to a household.
+ARCHIVE_STATE_KEY = "archive"
+DEPLOYMENT_STATE_KEYS = (SCHEMA_KEY, ARCHIVE_STATE_KEY, LEASE_KEY)
+
+# Every index the app relies on, per collection: (keys, create_index options). Every query is
+# scoped to one household, so every index leads with it.
+INDEXES = {
+    "events": [([HOUSEHOLD, ("start", ASCENDING)], {}), ([HOUSEHOLD, ("uid", ASCENDING)], UID_INDEX)],
+    "blockouts": [
+        ([HOUSEHOLD, ("start", ASCENDING), ("end", ASCENDING)], {}),
+        ([HOUSEHOLD, ("uid", ASCENDING)], UID_INDEX),
+    ],
+    "event_series": [([HOUSEHOLD, ("uid", ASCENDING)], UID_INDEX)],
+    "blockout_series": [([HOUSEHOLD, ("uid", ASCENDING)], UID_INDEX)],
+    "love_notes": [
+        # Keyset pagination on (timestamp, _id): notes written in the same instant are neither skipped nor repeated.
+        ([HOUSEHOLD, ("timestamp", DESCENDING), ("_id", DESCENDING)], {"name": "household_timestamp_id"}),
+        ([HOUSEHOLD, ("message", TEXT)], {"name": "message_text", "default_language": "english"}),
+    ],
+    "alerts": [([HOUSEHOLD, ("timestamp", DESCENDING)], {"name": "unseen_alerts", "partialFilterExpression": {"seen": False}})],
+    "moods": [
+        ([HOUSEHOLD, ("partner", ASCENDING), ("date", DESCENDING)], {}),
+        ([HOUSEHOLD, ("date", ASCENDING)], {}),
+    ],
+    "app_state": [([HOUSEHOLD, ("key", ASCENDING)], {"name": "household_key", "unique": True})],
+}
+
+# Fields that used to be stored as ISO strings and are now native BSON datetimes.
+DATETIME_FIELDS = {
+    "events": ("start", "end"),
+    "blockouts": ("start", "end"),
+    "moods": ("date",),
+}
+
+
+def load_mongo_uri():
+    uri = os.environ.get("MONGO_URI")
+    if uri:
+        return uri
+    with open(SECRETS_FILE, "rb") as fh:
+        return tomllib.load(fh)["mongo_uri"]
+
+
+def connect(**client_options):
+    return MongoClient(load_mongo_uri(), tlsCAFile=certifi.where(), **client_options).get_database("rendezvous")
+
+
+def parse_iso(value):
+    """Parses a legacy ISO string (datetime or bare date) into a naive datetime, or None if it is unreadable."""
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None)
+
+
+def convert_datetimes(db, batch_size=BATCH_SIZE, log=print):
+    """Rewrites string-typed date fields as BSON datetimes in `_id` order, one bulk_write per batch."""
+    for name, fields in DATETIME_FIELDS.items():
+        collection = db[name]
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        projection = dict.fromkeys(fields, 1)
+        converted = skipped = 0
+        last_id = None
+        while True:
+            page_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+            batch = list(collection.find(page_query, projection).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            ops = []
+            for doc in batch:
+                updates = {}
+                for field in fields:
+                    if isinstance(doc.get(field), str):
+                        parsed = parse_iso(doc[field])
+                        if parsed is None:
+                            skipped += 1
+                        else:
+                            updates[field] = parsed
+                if updates:
+                    # Match on the old values so a concurrent edit is never overwritten.
+                    match = {"_id": doc["_id"], **{field: doc[field] for field in updates}}
+                    ops.append(UpdateOne(match, {"$set": updates}))
+            if ops:
+                converted += collection.bulk_write(ops, ordered=False).modified_count
+        log(f"{name}: converted {converted} document(s), skipped {skipped} unreadable value(s)")
+
+
+def move_alerts(db, batch_size=BATCH_SIZE, log=print):
+    """Moves emergency alerts out of love_notes into their own collection.
+
+    Each batch is upserted into `alerts` before being deleted from `love_notes`,
+    so a run interrupted between the two steps just redoes the batch.
+    """
+    moved = 0
+    while True:
+        batch = list(db.love_notes.find({"type": "emergency_alert"}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        db.alerts.bulk_write([ReplaceOne({"_id": alert["_id"]}, alert, upsert=True) for alert in batch], ordered=False)
+        moved += db.love_notes.delete_many({"_id": {"$in": [alert["_id"] for alert in batch]}}).deleted_count
+    log(f"alerts: moved {moved} alert(s) out of love_notes")
+
+
+def seed_app_state(db, log=print):
+    """Creates the partner_names document with the defaults the UI falls back to."""
+    db.app_state.update_one(
+        {"key": "partner_names"}, {"$setOnInsert": {"value": ["Partner 1", "Partner 2"]}}, upsert=True
+    )
+
+
+def create_indexes(db, log=print):
+    """Creates every index in INDEXES; create_index is a no-op for indexes that already exist."""
+    for name, definitions in INDEXES.items():
+        for keys, options in definitions:
+            db[name].create_index(keys, **options)
+        log(f"{name}: {len(definitions)} index(es) ensured")
+
+
+def scope_to_households(db, log=print):
+    """Assigns every existing document to the default household and rebuilds the indexes household-first.
+
+    Covers the archive partitions too. Single-tenant indexes are dropped before the new ones are built, since the
+    text and uid indexes keep their names. Rerunning only touches what is still unscoped.
+    """
+    partitions = {name: name.rpartition("_archive_")[0] for name in db.list_collection_names() if "_archive_" in name}
+    for name, base in {**{name: name for name in INDEXES}, **partitions}.items():
+        collection = db[name]
+        unscoped = {"household": {"$exists": False}}
+        if name == "app_state":
+            unscoped["key"] = {"$nin": list(DEPLOYMENT_STATE_KEYS)}
+        # One server-side pass; the filter makes an interrupted run resume where it stopped.
+        stamped = collection.update_many(unscoped, {"$set": {"household": DEFAULT_HOUSEHOLD}}).modified_count
+        dropped = 0
+        for index in collection.list_indexes():
+            if index["name"] != "_id_" and next(iter(index["key"])) != "household":
+                collection.drop_index(index["name"])
+                dropped += 1
+        for keys, options in INDEXES[base]:
+            collection.create_index(keys, **options)
+        log(f"{name}: {stamped} document(s) assigned to {DEFAULT_HOUSEHOLD!r}, {dropped} single-tenant index(es) replaced")
+
+
+def add_note_tiebreak_index(db, log=print):
+    """Replaces the love_notes (household, timestamp) index, hot and archived, with (household, timestamp, _id)."""
+    for name in ["love_notes", *(name for name in db.list_collection_names() if name.startswith("love_notes_archive_"))]:
+        collection = db[name]
+        for keys, options in INDEXES["love_notes"]:
+            collection.create_index(keys, **options)
+        # The new index covers every query the old one served.
+        if "household_1_timestamp_-1" in collection.index_information():
+            collection.drop_index("household_1_timestamp_-1")
+        log(f"{name}: paging index now breaks timestamp ties on _id")
+
+
+# (version, description, migration). Append only; never renumber or edit applied entries.
+MIGRATIONS = [
+    (1, "seed partner names", seed_app_state),
+    (2, "create indexes", create_indexes),
+    (3, "convert ISO-string dates to BSON datetimes", convert_datetimes),
+    (4, "move emergency alerts out of love_notes", move_alerts),
+    (5, "create unique uid indexes for calendar imports", create_indexes),
+    (6, "create the love_notes message text index", create_indexes),
+    (7, "scope every collection to a household", scope_to_households),
+    (8, "page love notes on (timestamp, _id)", add_note_tiebreak_index),
+]
+
+
+def applied_versions(db):
+    doc = db.app_state.find_one({"key": SCHEMA_KEY}, {"applied.version": 1})
+    return {entry["version"] for entry in (doc or {}).get("applied", [])}
+
+
+def pending_migrations(db):
+    applied = applied_versions(db)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def acquire_lease(db, owner, seconds=LEASE_SECONDS):
+    """Takes (or renews) the migration lease for `owner`. Returns False while another owner holds it."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        # Keyed on _id: when the lease is held by someone else the upsert's insert fails instead of adding a second one.
+        db.app_state.find_one_and_update(
+            {"_id": LEASE_KEY, "$or": [{"owner": owner}, {"expires": {"$lte": now}}]},
+            {"$set": {"key": LEASE_KEY, "owner": owner, "expires": now + datetime.timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def release_lease(db, owner):
+    db.app_state.delete_one({"_id": LEASE_KEY, "owner": owner})
+
+
+def record_applied(db, version, description):
+    """Adds `version` to the schema document once, however many times it is called."""
+    db.app_state.update_one({"key": SCHEMA_KEY}, {"$setOnInsert": {"applied": []}}, upsert=True)
+    db.app_state.update_one(
+        {"key": SCHEMA_KEY, "applied.version": {"$ne": version}},
+        {"$push": {"applied": {"version": version, "description": description, "applied_at": datetime.datetime.now()}}},
+    )
+
+
+def upgrade(db, log=print, wait_seconds=LEASE_SECONDS):
+    """Runs every pending migration in order, recording each one as it completes. Returns how many ran.
+
+    Holds the migration lease while doing so; waits up to `wait_seconds` for another process's run to finish.
+    """
+    if not pending_migrations(db):
+        return 0
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + wait_seconds
+    while not acquire_lease(db, owner):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Another process has held the migration lease for over {wait_seconds}s")
+        log("Waiting for another process to finish migrating")
+        time.sleep(LEASE_POLL_SECONDS)
+    try:
+        # Read again under the lease: whoever held it before may have applied some or all of them.
+        pending = pending_migrations(db)
+        for version, description, migration in pending:
+            log(f"Applying migration {version}: {description}")
+            migration(db, log=log)
+            record_applied(db, version, description)
+            if not acquire_lease(db, owner):
+                raise RuntimeError(f"Lost the migration lease after migration {version}; another process took over")
+        return len(pending)
+    finally:
+        release_lease(db, owner)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("upgrade", help="apply pending migrations")
+    commands.add_parser("status", help="list applied and pending migrations")
+    args = parser.parse_args(argv)
+
+    db = connect()
+    if args.command == "upgrade":
+        print(f"Applied {upgrade(db)} migration(s).")
+    elif args.command == "status":
+        applied = applied_versions(db)
+        for version, description, _ in MIGRATIONS:
+            print(f"{version:>3} {'applied' if version in applied else 'pending':<8} {description}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Push delivery of emergency alerts.
+
+A backend keeps the set of unseen alerts in process memory and updates it as alerts
+are sent or cleared, so open sessions can check for an alert without touching Mongo.
+One backend serves every household: alerts are grouped by their ``household`` field
+and each household only sees (and is only notified about) its own.
+
+* ``InProcessBackend`` only sees writes made through this process (tests, single node).
+* ``ChangeStreamBackend`` additionally tails the ``alerts`` collection with a MongoDB
+  change stream, so alerts sent from other processes arrive within moments.
+"""
+import logging
+import threading
+import time
+
+from storage import DEFAULT_HOUSEHOLD
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationBackend:
+    """Base backend: an in-memory view of unseen alerts per household plus subscriber fan-out."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._unseen = {}      # household -> {alert id: alert}
+        self._households = {}  # alert id -> household
+        self._subscribers = []
+
+    def start(self):
+        return self
+
+    def subscribe(self, callback, household=DEFAULT_HOUSEHOLD):
+        """Calls `callback(alert_or_None)` whenever `household`'s newest unseen alert changes; returns an unsubscribe function."""
+        entry = (household, callback)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers.remove(entry)
+        return unsubscribe
+
+    def unseen_alert(self, household=DEFAULT_HOUSEHOLD):
+        """`household`'s newest unseen alert, or None. Served from memory."""
+        with self._lock:
+            return self._newest(household)
+
+    def notify_sent(self, alert):
+        if not alert.get("seen"):
+            household = alert.get("household", DEFAULT_HOUSEHOLD)
+            alert_id = str(alert["_id"])
+
+            def change():
+                self._households[alert_id] = household
+                self._unseen.setdefault(household, {})[alert_id] = alert
+            self._update(household, change)
+
+    def notify_seen(self, alert_id):
+        alert_id = str(alert_id)
+        with self._lock:
+            household = self._households.get(alert_id)
+        if household is None:
+            return
+
+        def change():
+            self._households.pop(alert_id, None)
+            unseen = self._unseen.get(household, {})
+            unseen.pop(alert_id, None)
+            if not unseen:
+                self._unseen.pop(household, None)
+        self._update(household, change)
+
+    def _newest(self, household):
+        return max(self._unseen.get(household, {}).values(), key=lambda alert: alert["timestamp"], default=None)
+
+    def _update(self, household, change):
+        with self._lock:
+            before = self._newest(household)
+            change()
+            after = self._newest(household)
+            subscribers = [callback for owner, callback in self._subscribers if owner == household]
+        if after is not before:
+            for callback in subscribers:
+                callback(after)
+
+
+class InProcessBackend(NotificationBackend):
+    """Pub/sub within a single process; writes made elsewhere are not seen."""
+
+
+class ChangeStreamBackend(NotificationBackend):
+    """Follows inserts and updates on the alerts collection through a change stream."""
+
+    RETRY_SECONDS = 2
+
+    def __init__(self, collection):
+        super().__init__()
+        self._collection = collection
+        self._resume_token = None
+
+    def start(self):
+        # Opening the stream up front surfaces "change streams unsupported" to the caller.
+        stream = self._open_stream()
+        for alert in self._collection.find({"seen": False}):
+            self.notify_sent(alert)
+        threading.Thread(target=self._run, args=(stream,), name="alert-change-stream", daemon=True).start()
+        return self
+
+    def _open_stream(self):
+        return self._collection.watch(
+            [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}],
+            full_document="updateLookup", resume_after=self._resume_token,
+        )
+
+    def _run(self, stream):
+        while True:
+            try:
+                with stream:
+                    for change in stream:
+                        self._resume_token = change["_id"]
+                        alert = change.get("fullDocument")
+                        if alert is None or alert.get("seen"):
+                            self.notify_seen(change["documentKey"]["_id"])
+                        else:
+                            self.notify_sent(alert)
+            except Exception:
+                logger.exception("Alert change stream interrupted; resuming")
+            time.sleep(self.RETRY_SECONDS)
+            try:
+                stream = self._open_stream()
+            except Exception:
+                logger.exception("Could not reopen alert change stream")
+
+
+def create_backend(name, collection):
+    """Builds and starts the named backend, falling back to in-process delivery if change streams are unavailable."""
+    if name == "change_stream":
+        try:
+            return ChangeStreamBackend(collection).start()
+        except Exception:
+            logger.exception("Change streams unavailable; falling back to in-process alert delivery")
+    backend = InProcessBackend().start()
+    for alert in collection.find({"seen": False}):
+        backend.notify_sent(alert)
+    return backend
@@ -0,0 +1,161 @@
+"""Lightweight per-rerun performance tracing.
+
+A trace covers one script run: a full rerun, or a fragment rerunning on its own
+(``traced_fragment``), which is what most interactions are. While it is active,
+``timed`` spans and every Mongo command issued from the same thread (via
+``MongoCommandListener``) are recorded on it; outside a trace both are near no-ops.
+Reply sizes cost a BSON re-encode per reply, so they are only measured by traces
+started with ``measure_bytes``. Finished traces are handed back to the caller for the
+debug panel and, when a trace file is configured, appended to it as JSON lines.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+
+import bson
+from pymongo import monitoring
+
+_local = threading.local()
+logger = logging.getLogger(__name__)
+_file_lock = threading.Lock()
+
+
+class RerunTrace:
+    def __init__(self, name, cache_before=None, measure_bytes=False):
+        self.name = name
+        self.cache_before = cache_before or {}
+        self.measure_bytes = measure_bytes
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.total_ms = None
+        self.spans = []
+        self.mongo = {"queries": 0, "bytes": 0, "ms": 0.0, "failures": 0}
+        self.mongo_by_command = {}
+        self.cache = {}
+
+    def add_span(self, name, ms):
+        self.spans.append((name, ms))
+
+    def add_command(self, command_name, ms, reply_bytes, failed=False):
+        self.mongo["queries"] += 1
+        self.mongo["bytes"] += reply_bytes
+        self.mongo["ms"] += ms
+        self.mongo["failures"] += failed
+        self.mongo_by_command[command_name] = self.mongo_by_command.get(command_name, 0) + 1
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self._t0) * 1000
+
+    def to_dict(self):
+        return {
+            "name": self.name, "started_at": self.started_at, "total_ms": round(self.total_ms or 0, 3),
+            "spans": [{"name": name, "ms": round(ms, 3)} for name, ms in self.spans],
+            "mongo": dict(self.mongo, ms=round(self.mongo["ms"], 3), by_command=self.mongo_by_command),
+            "cache": self.cache,
+        }
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def start_trace(name, cache_snapshot=None, measure_bytes=False):
+    """Starts a trace for this thread's run, dropping any run that ended early (e.g. via st.rerun)."""
+    trace = RerunTrace(name, cache_snapshot, measure_bytes)
+    _local.trace = trace
+    return trace
+
+
+def finish_trace(cache_snapshot=None, trace_file=None):
+    """Closes this thread's trace, records cache hits/misses since it started and optionally appends it to `trace_file`."""
+    trace = current_trace()
+    if trace is None:
+        return None
+    _local.trace = None
+    trace.finish()
+    for reader, stats in (cache_snapshot or {}).items():
+        before = trace.cache_before.get(reader, {})
+        hits = stats["hits"] - before.get("hits", 0)
+        shared_hits = stats.get("shared_hits", 0) - before.get("shared_hits", 0)
+        misses = stats["misses"] - before.get("misses", 0)
+        if hits or shared_hits or misses:
+            trace.cache[reader] = {"hits": hits, "shared_hits": shared_hits, "misses": misses}
+    if trace_file:
+        line = json.dumps(trace.to_dict(), default=str)
+        try:
+            with _file_lock, open(trace_file, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+        except OSError as exc:
+            # Tracing must never take the page down with it (full disk, unwritable path).
+            logger.warning("Could not append the trace to %s: %s", trace_file, exc)
+    return trace
+
+
+def traced_fragment(cache_snapshot=None, trace_file=None, measure_bytes=False, on_finish=None):
+    """Decorator for fragment bodies: when the fragment reruns on its own it gets a ``fragment:<name>`` trace.
+
+    Inside a full rerun the body just runs under that rerun's trace. `cache_snapshot` is a zero-argument callable
+    (like ``caching.cache_stats``); `on_finish` receives each finished fragment trace.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if current_trace() is not None:
+                return func(*args, **kwargs)
+            start_trace(f"fragment:{func.__name__}", cache_snapshot() if cache_snapshot else None, measure_bytes)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # Also reached when the fragment ends in st.rerun(), which raises.
+                trace = finish_trace(cache_snapshot() if cache_snapshot else None, trace_file)
+                if on_finish is not None:
+                    on_finish(trace)
+        return run
+    return decorator
+
+
+class timed:
+    """Records a span on the current trace. Usable as ``@timed()``, ``@timed("name")`` or ``with timed("name"):``."""
+
+    def __init__(self, name=None):
+        self.name = name
+
+    def __call__(self, func):
+        name = self.name or func.__name__
+
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            # A fresh timer per call keeps concurrent and nested calls from sharing _t0.
+            with timed(name):
+                return func(*args, **kwargs)
+        return run
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span(self.name, (time.perf_counter() - self._t0) * 1000)
+        return False
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts commands, reply bytes and server round-trip time on the trace of the issuing thread."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        trace = current_trace()
+        if trace is not None:
+            reply_bytes = len(bson.encode(event.reply)) if trace.measure_bytes else 0
+            trace.add_command(event.command_name, event.duration_micros / 1000, reply_bytes)
+
+    def failed(self, event):
+        trace = current_trace()
+        if trace is not None:
+            trace.add_command(event.command_name, event.duration_micros / 1000, 0, failed=True)
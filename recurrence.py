@@ -0,0 +1,162 @@
+"""Recurring events and blockouts: one stored document per series, expanded lazily.
+
+A series document looks like a normal event/blockout (``start``/``end`` are the first
+occurrence) plus::
+
+    "recurrence": {"freq": "daily" | "weekly" | "monthly", "interval": 1,
+                   "byweekday": [0, 2],        # weekly only, Monday = 0
+                   "until": datetime | None,   # inclusive
+                   "count": int | None},
+    "exdates": [datetime, ...],                # skipped occurrence starts
+    "overrides": [{"original_start": datetime, "start": ..., "end": ..., ...}],
+    "revision": int,                           # bumped whenever exceptions change
+
+Occurrences are only generated for the window being asked about, jumping straight to
+the first period that can reach it, so the cost of a query depends on the number of
+series and the window size, never on how long a series has been running.
+"""
+import calendar
+import datetime
+import threading
+from collections import OrderedDict
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+SERIES_ONLY_FIELDS = ("_id", "recurrence", "exdates", "overrides", "revision")
+
+
+def make_rule(freq, interval=1, byweekday=None, until=None, count=None):
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Unsupported frequency {freq!r}; expected one of {FREQUENCIES}")
+    return {"freq": freq, "interval": max(1, int(interval)), "byweekday": sorted(byweekday) if byweekday else None,
+            "until": until, "count": count}
+
+
+def new_series(doc, rule):
+    """Turns a single event/blockout document into a series document."""
+    return dict(doc, recurrence=rule, exdates=[], overrides=[], revision=0)
+
+
+def _week_start(moment):
+    return datetime.datetime.combine(moment.date() - datetime.timedelta(days=moment.weekday()), datetime.time())
+
+
+def _periods_before(first, moment, rule):
+    """Whole recurrence periods between the series start and `moment` (a safe lower bound to skip to)."""
+    interval = rule["interval"]
+    if rule["freq"] == "daily":
+        return max(0, (moment - first).days // interval)
+    if rule["freq"] == "weekly":
+        return max(0, (_week_start(moment) - _week_start(first)).days // 7 // interval)
+    months = (moment.year - first.year) * 12 + (moment.month - first.month)
+    return max(0, months // interval - 1)
+
+
+def _period_starts(first, rule, period):
+    interval = rule["interval"]
+    if rule["freq"] == "daily":
+        return [first + datetime.timedelta(days=period * interval)]
+    if rule["freq"] == "weekly":
+        week = _week_start(first) + datetime.timedelta(weeks=period * interval)
+        weekdays = rule.get("byweekday") or [first.weekday()]
+        return [datetime.datetime.combine((week + datetime.timedelta(days=day)).date(), first.time()) for day in weekdays]
+    month_index = first.month - 1 + period * interval
+    year, month = first.year + month_index // 12, month_index % 12 + 1
+    if first.day > calendar.monthrange(year, month)[1]:
+        return []  # e.g. the 31st in a 30-day month: skipped, as in RFC 5545
+    return [first.replace(year=year, month=month)]
+
+
+def iter_occurrence_starts(series, not_before=None):
+    """Occurrence starts in order. Skips ahead to `not_before` unless the series is count-limited."""
+    rule, first = series["recurrence"], series["start"]
+    count, until = rule.get("count"), rule.get("until")
+    period = 0
+    if not_before is not None and count is None and not_before > first:
+        period = _periods_before(first, not_before, rule)
+    produced = 0
+    while True:
+        for start in _period_starts(first, rule, period):
+            if start < first:
+                continue
+            if until is not None and start > until:
+                return
+            yield start
+            produced += 1
+            if count is not None and produced >= count:
+                return
+        period += 1
+
+
+def _occurrence_factory(series):
+    """Returns a function building the occurrence document for an original start, with any override applied."""
+    duration = series["end"] - series["start"]
+    overrides = {override["original_start"]: override for override in series.get("overrides") or ()}
+    base = {key: value for key, value in series.items() if key not in SERIES_ONLY_FIELDS}
+    series_id = str(series["_id"])
+
+    def occurrence(original_start):
+        occ = dict(base, start=original_start, end=original_start + duration, series_id=series_id,
+                   occurrence_start=original_start, _id=f"{series_id}@{original_start.isoformat()}")
+        override = overrides.get(original_start)
+        if override:
+            occ.update((key, value) for key, value in override.items() if key != "original_start")
+        return occ
+
+    return occurrence, overrides
+
+
+def expand(series, window_start, window_end):
+    """Occurrences of `series` that intersect [window_start, window_end), with exceptions applied."""
+    occurrence, overrides = _occurrence_factory(series)
+    skipped = set(series.get("exdates") or ())
+    occurrences, seen = [], set()
+    for start in iter_occurrence_starts(series, not_before=window_start - (series["end"] - series["start"])):
+        if start >= window_end:
+            break
+        seen.add(start)
+        if start not in skipped:
+            occurrences.append(occurrence(start))
+    # Overrides can move an occurrence into the window from outside it.
+    occurrences += [occurrence(original) for original in overrides if original not in seen and original not in skipped]
+    return [occ for occ in occurrences if occ["end"] > window_start and occ["start"] < window_end]
+
+
+def next_occurrences(series, after, limit):
+    """The first `limit` occurrences starting after `after`, in series order."""
+    occurrence, _ = _occurrence_factory(series)
+    skipped = set(series.get("exdates") or ())
+    found = []
+    for start in iter_occurrence_starts(series, not_before=after):
+        if start in skipped:
+            continue
+        occ = occurrence(start)
+        if occ["start"] > after:
+            found.append(occ)
+            if len(found) == limit:
+                break
+    return found
+
+
+class ExpansionCache:
+    """Bounded LRU of expansions keyed by (series id, revision, window)."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def expand(self, series, window_start, window_end):
+        key = (str(series["_id"]), series.get("revision", 0), window_start, window_end)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        occurrences = expand(series, window_start, window_end)
+        with self._lock:
+            self._entries[key] = occurrences
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return occurrences
+
+    def expand_all(self, series_list, window_start, window_end):
+        return [occ for series in series_list for occ in self.expand(series, window_start, window_end)]
@@ -0,0 +1,157 @@
+"""Pure scheduling helpers shared by the app and the benchmarks (no Streamlit imports)."""
+import datetime
+import heapq
+from bisect import bisect_left
+
+WAKING_HOURS = (8, 24)  # suggested times start no earlier than 08:00 and end by midnight
+BLOCKOUT_COLORS = {"health": "#FF9999", "work": "#B0B0B0", "family": "#D4C5B9", "personal": "#A7C7E7", "general": "#C0C0C0"}
+
+
+class IntervalIndex:
+    """Static index over (start, end, item) intervals for fast overlap queries.
+
+    Intervals are kept sorted by start. An implicit segment tree over that order
+    stores the maximum end of every subtree, so a query only walks the branches
+    that can still hold an overlap: O(log n + k) for k conflicts.
+    """
+
+    def __init__(self, intervals):
+        ordered = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [start for start, _, _ in ordered]
+        self._ends = [end for _, end, _ in ordered]
+        self._items = [item for _, _, item in ordered]
+        self._size = 1
+        while self._size < len(ordered):
+            self._size *= 2
+        tree = [None] * (2 * self._size)
+        tree[self._size:self._size + len(ordered)] = self._ends
+        for node in range(self._size - 1, 0, -1):
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if right is None or (left is not None and left >= right) else right
+        self._max_end = tree
+
+    def __len__(self):
+        return len(self._items)
+
+    def overlapping(self, start, end):
+        """Returns every item whose interval intersects [start, end), ordered by start."""
+        limit = bisect_left(self._starts, end)  # only intervals starting before `end` qualify
+        if limit == 0:
+            return []
+        hits = []
+        stack = [(1, 0, self._size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            max_end = self._max_end[node]
+            if lo >= limit or max_end is None or max_end <= start:
+                continue
+            if node >= self._size:
+                hits.append(lo)
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+        return [self._items[i] for i in hits]
+
+
+def build_blockout_index(blockouts):
+    return IntervalIndex((b['start'], b['end'], b) for b in blockouts)
+
+
+def upcoming_events(events, now, limit):
+    """The next `limit` events starting after `now`, soonest first, from an unsorted list in O(n log limit)."""
+    return heapq.nsmallest(limit, (e for e in events if e['start'] > now), key=lambda e: e['start'])
+
+
+def _ceil_to_step(moment, step):
+    """Rounds `moment` up to the next multiple of `step` after midnight (e.g. :00/:30 for 30-minute steps)."""
+    midnight = datetime.datetime.combine(moment.date(), datetime.time())
+    return midnight - ((midnight - moment) // step) * step
+
+
+def find_free_slots(busy, duration, window_start, window_end, count, step=datetime.timedelta(minutes=30)):
+    """Earliest `count` back-to-back free slots of `duration` inside [window_start, window_end).
+
+    `busy` is any iterable of (start, end) pairs. One sweep over them, sorted by start,
+    walks the gaps between merged busy periods, so the cost is O(k log k) in the number
+    of intervals that touch the window.
+    """
+    intervals = sorted((start, end) for start, end in busy if end > window_start and start < window_end)
+    intervals.append((window_end, window_end))
+    slots = []
+    cursor = _ceil_to_step(window_start, step)
+    for busy_start, busy_end in intervals:
+        while cursor + duration <= min(busy_start, window_end) and len(slots) < count:
+            slots.append((cursor, cursor + duration))
+            cursor += duration
+        if len(slots) >= count:
+            break
+        if busy_end > cursor:
+            cursor = _ceil_to_step(busy_end, step)
+    return slots
+
+
+def invitation_windows(timing, now):
+    """The time windows an invitation's "When?" choice covers."""
+    today = datetime.datetime.combine(now.date(), datetime.time())
+
+    def at(days, hour):
+        return today + datetime.timedelta(days=days, hours=hour)
+
+    if timing == "Sometime tonight":
+        return [(at(0, 18), at(1, 0))]
+    if timing == "Soon":
+        return [(now, now + datetime.timedelta(hours=6))]
+    if timing == "This afternoon":
+        return [(at(0, 12), at(0, 18))]
+    if timing == "Tomorrow evening":
+        return [(at(1, 17), at(1, 23))]
+    weekend_days = [0] if now.weekday() == 6 else [(5 - now.weekday()) % 7, (5 - now.weekday()) % 7 + 1]
+    return [(at(day, 10), at(day, 23)) for day in weekend_days]
+
+
+def same_time_windows(start, duration, days, spread=datetime.timedelta(hours=3), waking_hours=WAKING_HOURS):
+    """One window per day for `days` days around `start`'s time of day (`spread` either side), within waking hours.
+
+    Alternatives to a clashing time then stay near the hour that was asked for instead of running on through the
+    night. A time asked for outside waking hours keeps just that hour on each day.
+    """
+    windows = []
+    for day in range(days):
+        moment = start + datetime.timedelta(days=day)
+        midnight = datetime.datetime.combine(moment.date(), datetime.time())
+        window_start = max(moment - spread, midnight + datetime.timedelta(hours=waking_hours[0]))
+        window_end = min(moment + duration + spread, midnight + datetime.timedelta(hours=waking_hours[1]))
+        if window_end - window_start < duration:
+            window_start, window_end = moment, moment + duration
+        windows.append((window_start, window_end))
+    return windows
+
+
+def month_grid_range(day):
+    """Visible [start, end) of FullCalendar's dayGridMonth for the month containing `day` (6 weeks, Sunday first)."""
+    first = day.replace(day=1)
+    start = datetime.datetime.combine(first - datetime.timedelta(days=(first.weekday() + 1) % 7), datetime.time())
+    return start, start + datetime.timedelta(weeks=6)
+
+
+def padded_window(visible_start, visible_end, margin_days):
+    """Pads a visible range by `margin_days` on each side, snapped to midnight so nearby views share a cache key."""
+    margin = datetime.timedelta(days=margin_days)
+    start = datetime.datetime.combine((visible_start - margin).date(), datetime.time())
+    end = datetime.datetime.combine((visible_end + margin).date(), datetime.time()) + datetime.timedelta(days=1)
+    return start, end
+
+
+def to_calendar_events(docs):
+    """Converts stored datetimes to the ISO strings the calendar component expects; the only place we stringify."""
+    return [
+        {key: value.isoformat() if isinstance(value, datetime.datetime) else value for key, value in doc.items()}
+        for doc in docs
+    ]
+
+
+def blockout_style(blockout_type):
+    """The display fields stored on every blockout of `blockout_type`."""
+    color = BLOCKOUT_COLORS.get(blockout_type, BLOCKOUT_COLORS["general"])
+    return {"backgroundColor": color, "borderColor": color, "display": "background", "blockout_type": blockout_type}
@@ -0,0 +1,127 @@
+"""Local full-text search over love notes (no Streamlit imports).
+
+``InvertedIndex`` is the in-memory counterpart of the Mongo text index on
+``love_notes.message``: postings per term are compact arrays of document numbers
+and term frequencies, documents are only ever appended (so adding a note is
+incremental), and results are ranked with BM25, most recently added first on ties. Query syntax
+follows Mongo's ``$search`` for the parts we support: terms are OR-ed and a
+leading ``-`` excludes a term. Tokens are lowercased, English stopwords dropped
+and plurals folded, which approximates (but is not identical to) Mongo's stemming.
+"""
+import functools
+import heapq
+import math
+import re
+from array import array
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its me my of on or our so that the this to "
+    "was we were will with you your".split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def normalize(token):
+    """Lowercased token with simple plural folding ("notes" -> "note", "kisses" -> "kiss")."""
+    token = token.lower()
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("sses", "shes", "ches", "xes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+@functools.lru_cache(maxsize=65536)
+def _term(word):
+    """Index term for a lowercased word, or None for a stopword (cached: vocabularies are small)."""
+    return None if word in STOPWORDS else normalize(word)
+
+
+def tokenize(text):
+    return [term for term in map(_term, TOKEN_PATTERN.findall(text.lower())) if term is not None]
+
+
+def parse_query(query):
+    """(terms, excluded terms) for a Mongo-style search string."""
+    terms, excluded = [], []
+    for word in query.split():
+        target = excluded if word.startswith("-") else terms
+        target.extend(tokenize(word.lstrip("-")))
+    return terms, excluded
+
+
+class InvertedIndex:
+    def __init__(self):
+        self._postings = {}    # term -> array of document numbers, ascending
+        self._frequencies = {}  # term -> parallel array of term counts
+        self._ids = []
+        self._authors = []
+        self._timestamps = []
+        self._lengths = array("I")
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, doc_id, text, author, timestamp):
+        """Indexes one more document; existing postings are only appended to."""
+        number = len(self._ids)
+        self._ids.append(doc_id)
+        self._authors.append(author)
+        self._timestamps.append(timestamp)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array("I")
+                self._frequencies[term] = array("I")
+            postings.append(number)
+            self._frequencies[term].append(count)
+        length = counts.total()
+        self._lengths.append(length)
+        self._total_length += length
+
+    def search(self, query, author=None, range_start=None, range_end=None, skip=0, limit=25):
+        """Ranked (doc_id, score) pairs for one page of matches, best first."""
+        terms, excluded = parse_query(query)
+        if not terms or not self._ids:
+            return []
+        total = len(self._ids)
+        # BM25's length normalisation, per distinct document length (far fewer than documents).
+        average_length = self._total_length / total or 1
+        norms = {}
+        lengths = self._lengths
+        scores = {}
+        get_score = scores.get
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5)) * (BM25_K1 + 1)
+            for number, count in zip(postings, self._frequencies[term]):
+                length = lengths[number]
+                norm = norms.get(length)
+                if norm is None:
+                    norm = norms[length] = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                scores[number] = get_score(number, 0.0) + idf * count / (count + norm)
+        for term in excluded:
+            for number in self._postings.get(term, ()):
+                scores.pop(number, None)
+
+        candidates = scores.keys()
+        if author is not None or range_start is not None or range_end is not None:
+            authors, timestamps = self._authors, self._timestamps
+            candidates = [
+                number for number in candidates
+                if (author is None or authors[number] == author)
+                and (range_start is None or timestamps[number] >= range_start)
+                and (range_end is None or timestamps[number] < range_end)
+            ]
+        # Equal scores rank the most recently added note (the higher document number) first.
+        top = heapq.nlargest(skip + limit, candidates, key=lambda number: (scores[number], number))
+        return [(self._ids[number], scores[number]) for number in top[skip:]]
@@ -0,0 +1,280 @@
+"""Second-level cache shared by every app process (no Streamlit imports).
+
+``st.cache_data`` is per process, so with several replicas behind a load balancer
+each one used to query Mongo on its own and only saw its own writes. A shared tier
+holds two things every replica reads:
+
+* **version stamps** per (household, collection), bumped by ``caching.invalidate`` on
+  every write, so a write on one replica changes the cache keys on all of them;
+* **serialized payloads** of cached readers, keyed by reader, arguments and stamps,
+  so a replica that misses locally deserializes what another replica already loaded
+  instead of querying Mongo again.
+
+Backends:
+
+* ``"sqlite"`` (``SQLiteCache``): one WAL-mode SQLite file, memory-mapped, shared by
+  every process on the host.
+* ``"redis"`` (``KeyValueCache`` over ``redis.Redis``): any Redis-compatible server,
+  for replicas on several hosts. Needs the optional ``redis`` package; connects and
+  replies time out after ``timeout`` seconds (REDIS_TIMEOUT by default).
+* ``"local"`` (``KeyValueCache`` over ``InMemoryKeyValueStore``): an in-process
+  stand-in for the key-value server, for local runs, tests and benchmarks.
+
+``SharedTier`` is what ``caching`` does with a backend: stamp names, payload keys, and
+skipping an unreachable backend for a while. It lives here, away from Streamlit, so
+that it can be exercised without a running app.
+
+Payloads are pickled, like ``st.cache_data`` does, so only point this at storage the
+app's processes alone can write to.
+"""
+import contextlib
+import glob
+import hashlib
+import importlib
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "rendezvous-cache.sqlite3")
+DEFAULT_PREFIX = "rendezvous:"
+PURGE_EVERY = 256  # SQLite writes between sweeps of expired entries
+# Seconds to wait on a Redis connect or reply; the cache is an optimisation, so a slow server must never stall a rerun.
+REDIS_TIMEOUT = 0.25
+SHARED_TTL = 3600  # seconds, for readers declared without a ttl
+SHARED_RETRY_SECONDS = 30  # after a shared-tier failure, how long every call goes straight to the fallback
+logger = logging.getLogger(__name__)
+
+
+def code_version():
+    """The RENDEZVOUS_VERSION environment variable (e.g. the deployed commit), else a hash of the app's sources."""
+    version = os.environ.get("RENDEZVOUS_VERSION")
+    if version:
+        return version
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.blake2b(digest_size=6)
+    for path in sorted(glob.glob(os.path.join(root, "*.py")) + glob.glob(os.path.join(root, "storage", "*.py"))):
+        with open(path, "rb") as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+class SharedCache:
+    """Interface shared by every shared-cache backend. Payloads are bytes; versions are ints (0 when never bumped)."""
+
+    def get(self, key):
+        """The payload stored under `key`, or None when it is missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key, payload, ttl):
+        """Stores `payload` under `key` for `ttl` seconds."""
+        raise NotImplementedError
+
+    def versions(self, names):
+        """Current version stamps for `names`, in order, in one round trip."""
+        raise NotImplementedError
+
+    def bump(self, names):
+        """Increments the version stamps of `names`; every process sees the new stamps on its next read."""
+        raise NotImplementedError
+
+
+class SQLiteCache(SharedCache):
+    """Entries and stamps in one SQLite file, over one connection per process that callers take turns on.
+
+    Streamlit runs every rerun on a fresh thread, so per-thread connections would pile up; the
+    statements are all sub-millisecond, so serialising them is cheaper than opening connections.
+    """
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, mmap_size=64 * 1024 * 1024, timeout=5.0):
+        self.path = path
+        self.mmap_size = int(mmap_size)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+
+    @contextlib.contextmanager
+    def _connection(self):
+        with self._lock:
+            if self._db is None:
+                # Autocommit: every statement is its own short transaction, so readers never wait on a long one.
+                connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                             check_same_thread=False)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute(f"PRAGMA mmap_size={self.mmap_size}")
+                connection.execute("CREATE TABLE IF NOT EXISTS entries "
+                                   "(key TEXT PRIMARY KEY, payload BLOB, expires REAL)")
+                connection.execute("CREATE TABLE IF NOT EXISTS versions "
+                                   "(name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+                self._db = connection
+            yield self._db
+
+    def get(self, key):
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT payload FROM entries WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, payload, ttl):
+        with self._connection() as connection:
+            now = time.time()
+            connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, payload, now + ttl))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                # Entries under superseded stamps are never read again; they go once their TTL is up.
+                connection.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+
+    def versions(self, names):
+        placeholders = ", ".join("?" * len(names))
+        with self._connection() as connection:
+            found = dict(connection.execute(
+                f"SELECT name, version FROM versions WHERE name IN ({placeholders})", tuple(names)
+            ))
+        return tuple(found.get(name, 0) for name in names)
+
+    def bump(self, names):
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO versions VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET version = version + 1",
+                [(name,) for name in names],
+            )
+
+
+class KeyValueCache(SharedCache):
+    """Shared cache on a key-value server speaking the Redis subset ``get``, ``set(ex=)``, ``mget`` and ``incr``."""
+
+    def __init__(self, client, prefix=DEFAULT_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(f"{self.prefix}entry:{key}")
+
+    def set(self, key, payload, ttl):
+        self.client.set(f"{self.prefix}entry:{key}", payload, ex=max(1, int(ttl)))
+
+    def versions(self, names):
+        values = self.client.mget([f"{self.prefix}version:{name}" for name in names])
+        return tuple(int(value) if value is not None else 0 for value in values)
+
+    def bump(self, names):
+        for name in names:
+            self.client.incr(f"{self.prefix}version:{name}")
+
+
+class InMemoryKeyValueStore:
+    """Local stand-in for a Redis server: the same commands and return types, kept in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # key -> (bytes, expires or None)
+
+    def _live(self, key, now):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._values[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.time())
+            return entry[0] if entry else None
+
+    def mget(self, keys):
+        with self._lock:
+            now = time.time()
+            return [entry[0] if entry else None for entry in (self._live(key, now) for key in keys)]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._live(key, time.time())
+            value = int(entry[0]) + 1 if entry else 1
+            self._values[key] = (str(value).encode(), entry[1] if entry else None)
+            return value
+
+
+class SharedTier:
+    """A shared cache as the cached readers use it: per-household stamps and code-versioned payloads.
+
+    Stamps are named ``<household>/<collection>``. Payload keys carry the reader, the code version,
+    the household, its stamps and a hash of the arguments, so processes running different code never
+    exchange payloads. Backend errors are logged and answered with None, and the backend is then left
+    alone for `retry_seconds`, so later calls don't each wait for it to time out.
+    """
+
+    def __init__(self, cache, code_version, retry_seconds=SHARED_RETRY_SECONDS, clock=time.monotonic):
+        self.cache = cache
+        self.code_version = code_version
+        self.retry_seconds = retry_seconds
+        self._clock = clock
+        self._open_until = 0.0
+
+    def _call(self, method, *args):
+        if self._clock() < self._open_until:
+            return None
+        try:
+            return method(*args)
+        except Exception as exc:
+            self._open_until = self._clock() + self.retry_seconds
+            logger.warning("Shared cache unavailable, using the process-local cache only for %ss: %s",
+                           self.retry_seconds, exc)
+            return None
+
+    def versions(self, tenant, collections):
+        """`tenant`'s stamps of `collections` in one round trip, or None when the backend is unavailable."""
+        return self._call(self.cache.versions, [f"{tenant}/{name}" for name in collections])
+
+    def bump(self, tenant, collections):
+        self._call(self.cache.bump, [f"{tenant}/{name}" for name in collections])
+
+    def key(self, reader, args, kwargs, tenant, versions):
+        arguments = pickle.dumps((args, sorted(kwargs.items())), protocol=pickle.HIGHEST_PROTOCOL)
+        return (f"{reader}-{self.code_version}:{tenant}:{'.'.join(map(str, versions))}:"
+                f"{hashlib.blake2b(arguments, digest_size=16).hexdigest()}")
+
+    def load(self, reader, args, kwargs, tenant, versions, compute, ttl=None):
+        """The payload another process stored for this call, else `compute()`, stored for the others.
+
+        Returns (value, True when it came from the shared tier).
+        """
+        key = self.key(reader, args, kwargs, tenant, versions)
+        payload = self._call(self.cache.get, key)
+        if payload is not None:
+            return pickle.loads(payload), True
+        value = compute()
+        self._call(self.cache.set, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl or SHARED_TTL)
+        return value, False
+
+
+def _redis_cache(url, prefix=DEFAULT_PREFIX, timeout=REDIS_TIMEOUT):
+    redis = importlib.import_module("redis")  # optional dependency, only needed for this backend
+    client = redis.Redis.from_url(url, socket_connect_timeout=timeout, socket_timeout=timeout)
+    return KeyValueCache(client, prefix=prefix)
+
+
+def _local_cache(prefix=DEFAULT_PREFIX):
+    return KeyValueCache(InMemoryKeyValueStore(), prefix=prefix)
+
+
+BACKENDS = {"sqlite": SQLiteCache, "redis": _redis_cache, "local": _local_cache}
+
+
+def create_cache(name, **options):
+    """Builds the shared-cache backend registered as `name`."""
+    try:
+        factory = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown shared cache backend {name!r}; expected one of {sorted(BACKENDS)}") from None
+    return factory(**options)
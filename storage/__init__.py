@@ -0,0 +1,192 @@
+"""Storage backends for the app's collections.
+
+``Repository`` is the interface the app's data helpers use for events, blockouts,
+love_notes, moods, alerts and app_state, plus the recurring event/blockout series
+(one document per series, see ``recurrence``) and the cold-data archive (see
+``archive``). Backends:
+
+* ``"mongo"`` (``storage.mongo.MongoRepository``): the production pymongo backend.
+* ``"memory"`` (``storage.memory.MemoryRepository``): in-process, for local runs,
+  tests and the offline benchmarks.
+
+Documents go in and come out in the shape the app stores in Mongo (native
+datetimes, ``_id`` set on insert).
+
+A repository is bound to one household (tenant): it only reads and writes that
+household's documents. ``for_household`` returns a repository for another household
+that shares the same connection (or in-memory store), so one process serves every
+household from one backend.
+"""
+import importlib
+
+from scheduling import upcoming_events
+
+BACKENDS = {
+    "mongo": ("storage.mongo", "MongoRepository"),
+    "memory": ("storage.memory", "MemoryRepository"),
+}
+# Where each kind's recurring series live; occurrences are expanded on read, never stored.
+SERIES_COLLECTIONS = {"events": "event_series", "blockouts": "blockout_series"}
+# Collections with a cold tier, and the time field that decides a document's age and partition.
+ARCHIVED_COLLECTIONS = {"love_notes": "timestamp", "moods": "date", "events": "start"}
+# Love notes are paged newest first on this key; _id breaks ties between notes written in the same instant.
+NOTE_ORDER = ("timestamp", "_id")
+# The household documents belong to when none is configured (and every document from before tenancy).
+DEFAULT_HOUSEHOLD = "default"
+# Projections of the app's hot reads, shared with the benchmarks so they measure what the app fetches.
+CALENDAR_FIELDS = {"title": 1, "start": 1, "end": 1, "allDay": 1, "backgroundColor": 1, "borderColor": 1, "display": 1}
+UPCOMING_FIELDS = {"title": 1, "start": 1, "booker": 1, "is_spontaneous": 1}
+NOTE_FIELDS = {"author": 1, "message": 1, "timestamp": 1}  # _id stays: it is half of the paging cursor
+
+
+def archive_partition(collection, year):
+    """Name of the archive collection holding `collection`'s documents from `year`."""
+    return f"{collection}_archive_{year}"
+
+
+def partition_years(partitions, range_start, range_end, watermark):
+    """The archived years a read of [range_start, range_end) has to visit; none unless it reaches below the watermark."""
+    if watermark is None or (range_start is not None and range_start >= watermark):
+        return []
+    last = min(range_end, watermark) if range_end is not None else watermark
+    first = range_start.year if range_start is not None else min(partitions, default=last.year)
+    return sorted(year for year in partitions if first <= year <= last.year)
+
+
+class Repository:
+    """Interface shared by every storage backend."""
+
+    # Seconds a reader may keep using an old archive watermark (see archive.run_archiving).
+    watermark_ttl = 0
+    household = DEFAULT_HOUSEHOLD
+
+    def prepare(self, log=print):
+        """One-time setup when the process starts (schema migrations, indexes)."""
+
+    # --- tenancy ---
+    def for_household(self, household):
+        """A repository scoped to `household`, sharing this one's connection or store."""
+        raise NotImplementedError
+
+    def households(self):
+        """Ids of every household that has stored anything."""
+        raise NotImplementedError
+
+    # --- app_state ---
+    def get_partner_names(self):
+        raise NotImplementedError
+
+    def set_partner_names(self, names):
+        raise NotImplementedError
+
+    # --- events ---
+    def insert_event(self, event):
+        raise NotImplementedError
+
+    def find_events(self):
+        raise NotImplementedError
+
+    def events_between(self, range_start, range_end, fields=None):
+        """Events starting in [range_start, range_end), ordered by start; archived ones too if the range is old enough."""
+        raise NotImplementedError
+
+    def upcoming_events(self, now, limit, fields=None):
+        """The next `limit` events starting after `now`. Backends with a start index should override this."""
+        return upcoming_events(self.find_events(), now, limit)
+
+    # --- blockouts ---
+    def insert_blockout(self, blockout):
+        raise NotImplementedError
+
+    def find_blockouts(self):
+        raise NotImplementedError
+
+    def blockouts_between(self, range_start, range_end, fields=None):
+        """Blockouts intersecting [range_start, range_end), ordered by start."""
+        raise NotImplementedError
+
+    # --- recurring series (kind is "events" or "blockouts") ---
+    def insert_series(self, kind, series):
+        raise NotImplementedError
+
+    def find_series(self, kind):
+        raise NotImplementedError
+
+    def add_series_exception(self, kind, series_id, original_start, override=None):
+        """Skips the occurrence starting at `original_start`, or replaces its fields with `override`; bumps the revision."""
+        raise NotImplementedError
+
+    # --- bulk import/export (kind is "events" or "blockouts") ---
+    def upsert_by_uid(self, kind, docs, series=False):
+        """Inserts or replaces `docs` (each carrying a unique ``uid``) in one batch. Returns (inserted, replaced).
+
+        A replaced document may have been archived; its new version goes back to the hot tier.
+        """
+        raise NotImplementedError
+
+    def add_series_exdates(self, kind, exdates_by_uid):
+        """Adds skipped occurrence starts to the series with each uid, in one batch."""
+        raise NotImplementedError
+
+    def iter_between(self, kind, range_start, range_end, batch_size=1000):
+        """Iterates over the range's documents in start order. Backends with cursors should override this to stream."""
+        reader = self.events_between if kind == "events" else self.blockouts_between
+        return iter(reader(range_start, range_end))
+
+    # --- archiving (collection is a key of ARCHIVED_COLLECTIONS; watermarks are shared by every household) ---
+    def archive_watermark(self, collection):
+        """Documents older than this may live in the archive; None when nothing was ever archived."""
+        raise NotImplementedError
+
+    def set_archive_watermark(self, collection, cutoff):
+        raise NotImplementedError
+
+    def archive_batch(self, collection, cutoff, batch_size):
+        """Moves up to `batch_size` of this household's oldest documents older than `cutoff` to their year's partition.
+
+        Copies before deleting, so a batch interrupted half-way is simply moved again. Returns how many moved.
+        """
+        raise NotImplementedError
+
+    # --- love_notes ---
+    def insert_love_note(self, note):
+        raise NotImplementedError
+
+    def love_notes_page(self, before=None, limit=25, fields=None):
+        """Up to `limit` notes before the `before` cursor, newest first, continuing into the archive.
+
+        The cursor is the (timestamp, _id) of the last note of the previous page, so `fields` must keep both.
+        """
+        raise NotImplementedError
+
+    def search_love_notes(self, query, author=None, range_start=None, range_end=None, skip=0, limit=25, fields=None):
+        """Notes whose message matches `query`, best match first, each with a relevance ``score``."""
+        raise NotImplementedError
+
+    # --- moods ---
+    def upsert_mood(self, partner, date, values):
+        raise NotImplementedError
+
+    def mood_trends(self, range_start, range_end, unit):
+        """Per-partner rollups in the shape produced by trends.mood_rollup_pipeline."""
+        raise NotImplementedError
+
+    # --- alerts ---
+    def insert_alert(self, alert):
+        raise NotImplementedError
+
+    def mark_alert_seen(self, alert_id):
+        raise NotImplementedError
+
+    def notification_backend(self, name):
+        """A started notifications backend fed by every household's alerts (see notifications)."""
+        raise NotImplementedError
+
+
+def create_repository(name, **options):
+    """Instantiates the backend registered as `name`, importing it only when it is used."""
+    try:
+        module_name, class_name = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {name!r}; expected one of {sorted(BACKENDS)}") from None
+    return getattr(importlib.import_module(module_name), class_name)(**options)
@@ -0,0 +1,397 @@
+"""In-process repository: no database, same query semantics as the Mongo backend.
+
+Collections are kept sorted on the field their range queries use (the in-memory
+counterpart of the Mongo indexes), so range reads are bisections, not scans. Each
+household has its own repository (the counterpart of the household-first compound
+indexes); siblings made with ``for_household`` share ids, watermarks and the notifier.
+A household only becomes known (listed by ``households``) once it stores something,
+so reading an unknown household never creates one.
+"""
+import bisect
+import copy
+import itertools
+import operator
+import threading
+import weakref
+
+from notifications import InProcessBackend
+from search import InvertedIndex
+from storage import ARCHIVED_COLLECTIONS, DEFAULT_HOUSEHOLD, NOTE_ORDER, SERIES_COLLECTIONS, Repository, partition_years
+from trends import rollup_moods
+
+
+def _project(doc, fields):
+    """Copies `doc`, keeping only `fields` (Mongo projection semantics for inclusion projections)."""
+    if not fields:
+        return copy.copy(doc)
+    keep = {name for name, included in fields.items() if included}
+    if fields.get("_id", 1):
+        keep.add("_id")
+    return {name: value for name, value in doc.items() if name in keep}
+
+
+class _SortedCollection:
+    """Documents ordered by one field (or a tuple of fields), with a parallel key list for bisection.
+
+    Bulk writes (``extend``/``remove``) are applied lazily, in one sort on the next read,
+    so an import costs one re-sort rather than one per batch or per document.
+    """
+
+    def __init__(self, *fields):
+        self.key = operator.itemgetter(*fields)
+        self._keys = []
+        self._docs = []
+        self._pending = []
+        self._removed = set()
+
+    def _settle(self):
+        if not (self._pending or self._removed):
+            return
+        key = self.key
+        docs = itertools.chain(self._docs, self._pending)
+        if self._removed:
+            # Removed documents are still referenced until now, so their ids cannot have been reused.
+            docs = (doc for doc in docs if id(doc) not in self._removed)
+        self._docs = sorted(docs, key=key)
+        self._keys = list(map(key, self._docs))
+        self._pending, self._removed = [], set()
+
+    @property
+    def keys(self):
+        self._settle()
+        return self._keys
+
+    @property
+    def docs(self):
+        self._settle()
+        return self._docs
+
+    def insert(self, doc):
+        key = self.key(doc)
+        index = bisect.bisect_right(self.keys, key)
+        self._keys.insert(index, key)
+        self._docs.insert(index, doc)
+
+    def extend(self, docs):
+        self._pending.extend(docs)
+
+    def remove(self, doc):
+        self._removed.add(id(doc))
+
+
+def _between(collection, range_start, range_end):
+    """Documents of a sorted collection with range_start <= key < range_end (either bound may be None)."""
+    lo = 0 if range_start is None else bisect.bisect_left(collection.keys, range_start)
+    hi = len(collection.keys) if range_end is None else bisect.bisect_left(collection.keys, range_end)
+    return collection.docs[lo:hi]
+
+
+def _newest_before(collection, before, limit):
+    """Up to `limit` documents with key < `before` (or the newest overall), newest first."""
+    hi = len(collection.keys) if before is None else bisect.bisect_left(collection.keys, before)
+    return collection.docs[max(0, hi - limit):hi][::-1]
+
+
+class MemoryRepository(Repository):
+    # Readers see a raised watermark immediately, so the archiver need not wait.
+    watermark_ttl = 0
+
+    def __init__(self, household=DEFAULT_HOUSEHOLD, _shared=None):
+        if _shared is None:
+            _shared = {"households": {}, "unclaimed": weakref.WeakValueDictionary(), "ids": itertools.count(1),
+                       "watermarks": {}, "notifier": None, "lock": threading.Lock()}
+        self.household = household
+        self._shared = _shared
+        self._claimed = False
+        # Kept only while someone holds it, until its first write claims the household.
+        _shared["unclaimed"][household] = self
+        self._lock = threading.RLock()
+        self._ids = _shared["ids"]
+        self._partner_names = None
+        self._events = _SortedCollection("start")
+        self._blockouts = _SortedCollection("start")
+        self._max_blockout_span = None
+        self._series = {kind: {} for kind in SERIES_COLLECTIONS}
+        self._uid_indexes = {}
+        self._notes = _SortedCollection(*NOTE_ORDER)
+        self._notes_by_id = {}
+        self._note_index = InvertedIndex()
+        self._moods = {}
+        self._mood_dates = _SortedCollection("date")
+        self._alerts = {}
+        self._archives = {}  # (collection, year) -> _SortedCollection
+        self._archived_uids = {}  # (collection, uid) -> archived document, so a re-import replaces it
+        self._watermarks = _shared["watermarks"]
+
+    def _claim(self):
+        if not self._claimed:
+            with self._shared["lock"]:
+                self._shared["households"][self.household] = self
+                self._shared["unclaimed"].pop(self.household, None)
+                self._claimed = True
+
+    def _with_id(self, doc):
+        self._claim()
+        doc.setdefault("_id", f"{next(self._ids):024x}")
+        doc["household"] = self.household
+        return doc
+
+    # --- tenancy ---
+    def for_household(self, household):
+        with self._shared["lock"]:
+            tenant = self._shared["households"].get(household) or self._shared["unclaimed"].get(household)
+            return tenant if tenant is not None else MemoryRepository(household, _shared=self._shared)
+
+    def households(self):
+        with self._shared["lock"]:
+            return sorted(self._shared["households"])
+
+    # --- bulk loading (benchmarks, fixtures) ---
+    def load(self, events=(), blockouts=(), love_notes=(), moods=()):
+        with self._lock:
+            self._events.extend(self._with_id(dict(doc)) for doc in events)
+            blockouts = [self._with_id(dict(doc)) for doc in blockouts]
+            self._blockouts.extend(blockouts)
+            for blockout in blockouts:
+                self._track_span(blockout)
+            notes = [self._with_id(dict(doc)) for doc in love_notes]
+            self._notes.extend(notes)
+            for note in notes:
+                self._index_note(note)
+            for mood in moods:
+                self._store_mood(mood["partner"], mood["date"], mood)
+
+    # --- app_state ---
+    def get_partner_names(self):
+        return list(self._partner_names) if self._partner_names else None
+
+    def set_partner_names(self, names):
+        self._claim()
+        self._partner_names = list(names)
+
+    # --- events ---
+    def insert_event(self, event):
+        with self._lock:
+            self._events.insert(copy.copy(self._with_id(event)))
+
+    def find_events(self):
+        with self._lock:
+            return [copy.copy(doc) for doc in self._events.docs]
+
+    def events_between(self, range_start, range_end, fields=None):
+        with self._lock:
+            events = _between(self._events, range_start, range_end)
+            archived = self._archived("events", range_start, range_end)
+            if archived:
+                events = sorted(events + [doc for part in archived for doc in _between(part, range_start, range_end)],
+                                key=operator.itemgetter("start"))
+            return [_project(doc, fields) for doc in events]
+
+    def upcoming_events(self, now, limit, fields=None):
+        with self._lock:
+            lo = bisect.bisect_right(self._events.keys, now)
+            return [_project(doc, fields) for doc in self._events.docs[lo:lo + limit]]
+
+    # --- blockouts ---
+    def _track_span(self, blockout):
+        span = blockout["end"] - blockout["start"]
+        if self._max_blockout_span is None or span > self._max_blockout_span:
+            self._max_blockout_span = span
+
+    def insert_blockout(self, blockout):
+        with self._lock:
+            self._blockouts.insert(copy.copy(self._with_id(blockout)))
+            self._track_span(blockout)
+
+    def find_blockouts(self):
+        with self._lock:
+            return [copy.copy(doc) for doc in self._blockouts.docs]
+
+    def blockouts_between(self, range_start, range_end, fields=None):
+        with self._lock:
+            if self._max_blockout_span is None:
+                return []
+            # Nothing starting earlier than the longest blockout's span can still reach range_start.
+            lo = bisect.bisect_left(self._blockouts.keys, range_start - self._max_blockout_span)
+            hi = bisect.bisect_left(self._blockouts.keys, range_end)
+            return [_project(doc, fields) for doc in self._blockouts.docs[lo:hi] if doc["end"] > range_start]
+
+    # --- recurring series ---
+    def insert_series(self, kind, series):
+        with self._lock:
+            series = copy.deepcopy(self._with_id(series))
+            self._series[kind][series["_id"]] = series
+
+    def find_series(self, kind):
+        with self._lock:
+            return [copy.deepcopy(doc) for doc in self._series[kind].values()]
+
+    def add_series_exception(self, kind, series_id, original_start, override=None):
+        with self._lock:
+            series = self._series[kind].get(str(series_id))
+            if series is None:
+                return
+            if override:
+                series["overrides"].append(dict(override, original_start=original_start))
+            elif original_start not in series["exdates"]:
+                series["exdates"].append(original_start)
+            series["revision"] += 1
+
+    # --- bulk import/export ---
+    def _uid_index(self, kind, series):
+        """uid -> stored document, built on first use (only imported documents carry a uid)."""
+        key = (kind, series)
+        if key not in self._uid_indexes:
+            docs = self._series[kind].values() if series else getattr(self, f"_{kind}").docs
+            self._uid_indexes[key] = {doc["uid"]: doc for doc in docs if "uid" in doc}
+        return self._uid_indexes[key]
+
+    def upsert_by_uid(self, kind, docs, series=False):
+        with self._lock:
+            by_uid = self._uid_index(kind, series)
+            collection = None if series else getattr(self, f"_{kind}")
+            pending, replaced = {}, 0
+            unarchived = []  # referenced until their partitions settle (see _SortedCollection._settle)
+            for doc in docs:
+                doc = copy.deepcopy(doc) if series else copy.copy(doc)
+                old = pending.get(doc["uid"]) or by_uid.get(doc["uid"])
+                if old is None and not series:
+                    # Archived events come back to the hot tier; the archiver moves them again if they are still old.
+                    old = self._archived_uids.pop((kind, doc["uid"]), None)
+                    if old is not None:
+                        self._archives[(kind, old[ARCHIVED_COLLECTIONS[kind]].year)].remove(old)
+                        unarchived.append(old)
+                elif collection is not None and old is not None and doc["uid"] not in pending:
+                    collection.remove(old)
+                if old is not None:
+                    doc["_id"] = old["_id"]
+                    replaced += 1
+                    if series:
+                        # Same _id, new content: a fresh revision keeps cached expansions of the old one from being served.
+                        doc["revision"] = old.get("revision", 0) + 1
+                self._with_id(doc)
+                if series:
+                    self._series[kind][doc["_id"]] = doc
+                else:
+                    pending[doc["uid"]] = doc
+                by_uid[doc["uid"]] = doc
+            if collection is not None:
+                # One merge per batch instead of a sorted insert per document.
+                collection.extend(pending.values())
+                if kind == "blockouts":
+                    for doc in pending.values():
+                        self._track_span(doc)
+            for old in unarchived:
+                self._archives[(kind, old[ARCHIVED_COLLECTIONS[kind]].year)]._settle()
+            return len(docs) - replaced, replaced
+
+    def add_series_exdates(self, kind, exdates_by_uid):
+        with self._lock:
+            by_uid = self._uid_index(kind, True)
+            for uid, dates in exdates_by_uid.items():
+                series = by_uid.get(uid)
+                if series is not None:
+                    series["exdates"].extend(date for date in dates if date not in series["exdates"])
+                    series["revision"] += 1
+
+    # --- love_notes ---
+    def _index_note(self, note):
+        self._notes_by_id[note["_id"]] = note
+        self._note_index.add(note["_id"], note["message"], note["author"], note["timestamp"])
+
+    def insert_love_note(self, note):
+        with self._lock:
+            note = copy.copy(self._with_id(note))
+            self._notes.insert(note)
+            self._index_note(note)
+
+    def love_notes_page(self, before=None, limit=25, fields=None):
+        with self._lock:
+            page = _newest_before(self._notes, before, limit)
+            if len(page) < limit:
+                # Hot tier exhausted: continue into the archive, newest partition first.
+                for part in reversed(self._archived("love_notes", None, before and before[0])):
+                    page += _newest_before(part, before, limit - len(page))
+                    if len(page) >= limit:
+                        break
+            return [_project(doc, fields) for doc in page]
+
+    def search_love_notes(self, query, author=None, range_start=None, range_end=None, skip=0, limit=25, fields=None):
+        with self._lock:
+            hits = self._note_index.search(query, author, range_start, range_end, skip=skip, limit=limit)
+            return [dict(_project(self._notes_by_id[note_id], fields), score=score) for note_id, score in hits]
+
+    # --- moods ---
+    def _store_mood(self, partner, date, values):
+        key = (partner, date)
+        if key in self._moods:
+            self._moods[key].update(values)
+        else:
+            mood = self._with_id({"partner": partner, "date": date, **values})
+            self._moods[key] = mood
+            self._mood_dates.insert(mood)
+
+    def upsert_mood(self, partner, date, values):
+        with self._lock:
+            self._store_mood(partner, date, values)
+
+    def mood_trends(self, range_start, range_end, unit):
+        with self._lock:
+            moods = _between(self._mood_dates, range_start, range_end)
+            for part in self._archived("moods", range_start, range_end):
+                moods = moods + _between(part, range_start, range_end)
+            return rollup_moods(moods, unit)
+
+    # --- archiving ---
+    def _archived(self, collection, range_start, range_end):
+        years = partition_years({year for name, year in self._archives if name == collection},
+                                range_start, range_end, self._watermarks.get(collection))
+        return [self._archives[(collection, year)] for year in years]
+
+    def archive_watermark(self, collection):
+        return self._watermarks.get(collection)
+
+    def set_archive_watermark(self, collection, cutoff):
+        with self._shared["lock"]:
+            current = self._watermarks.get(collection)
+            self._watermarks[collection] = cutoff if current is None else max(current, cutoff)
+
+    def archive_batch(self, collection, cutoff, batch_size):
+        with self._lock:
+            hot = {"love_notes": self._notes, "moods": self._mood_dates, "events": self._events}[collection]
+            field = ARCHIVED_COLLECTIONS[collection]
+            order = NOTE_ORDER if collection == "love_notes" else (field,)
+            # (cutoff,) sorts before every (cutoff, _id) key, so compound keys stop at the same place.
+            batch = _between(hot, None, cutoff if len(order) == 1 else (cutoff,))[:batch_size]
+            hot_uids = self._uid_indexes.get((collection, False), {})
+            for doc in batch:
+                hot.remove(doc)
+                self._archives.setdefault((collection, doc[field].year), _SortedCollection(*order)).extend([doc])
+                if "uid" in doc:
+                    hot_uids.pop(doc["uid"], None)
+                    self._archived_uids[(collection, doc["uid"])] = doc
+                if collection == "moods":
+                    del self._moods[(doc["partner"], doc["date"])]
+            # Archived notes stay in the search index: the local index covers both tiers.
+            return len(batch)
+
+    # --- alerts ---
+    def insert_alert(self, alert):
+        with self._lock:
+            self._alerts[self._with_id(alert)["_id"]] = copy.copy(alert)
+
+    def mark_alert_seen(self, alert_id):
+        with self._lock:
+            alert = self._alerts.get(str(alert_id))
+            if alert is not None:
+                alert["seen"] = True
+
+    def notification_backend(self, name):
+        # Only this process can write to an in-memory store, so in-process delivery is all we need.
+        with self._shared["lock"]:
+            if self._shared["notifier"] is None:
+                notifier = self._shared["notifier"] = InProcessBackend().start()
+                for tenant in self._shared["households"].values():
+                    for alert in tenant._alerts.values():
+                        notifier.notify_sent(alert)
+            return self._shared["notifier"]
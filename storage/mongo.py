@@ -0,0 +1,292 @@
+"""pymongo-backed repository (production)."""
+import heapq
+import operator
+import time
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from migrations import ARCHIVE_STATE_KEY, INDEXES, upgrade
+from notifications import create_backend
+from storage import (
+    ARCHIVED_COLLECTIONS, DEFAULT_HOUSEHOLD, NOTE_ORDER, SERIES_COLLECTIONS, Repository, archive_partition,
+    partition_years,
+)
+from trends import mood_rollup_pipeline
+
+DUPLICATE_KEY = 11000
+# Connection pool for the app's process-wide client (app.init_connection). Script runs hold a connection only for
+# the few milliseconds of each query, so a modest pool serves hundreds of sessions across every household; the alert
+# change stream and the archiver each pin one more. Checkouts give up after waitQueueTimeoutMS instead of queueing
+# behind a stalled server, and maxConnecting limits the connection storm after a failover.
+POOL_OPTIONS = {
+    "maxPoolSize": 50, "minPoolSize": 5, "maxConnecting": 4, "maxIdleTimeMS": 60_000, "waitQueueTimeoutMS": 2_000,
+}
+
+
+def _below(query, cursor):
+    """`query` restricted to notes strictly before a (timestamp, _id) cursor, in NOTE_ORDER."""
+    if cursor is None:
+        return query
+    timestamp, note_id = cursor
+    return {**query, "$or": [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": note_id}}]}
+
+
+def _replace_bumping_revision(doc):
+    """Update pipeline replacing a series with `doc` but keeping its _id and moving its revision past the stored one."""
+    return [{"$replaceWith": {"$mergeObjects": [
+        {"$literal": doc},
+        {"_id": "$_id", "revision": {"$add": [{"$ifNull": ["$revision", -1]}, 1]}},
+    ]}}]
+
+
+class MongoRepository(Repository):
+    """Every query carries the household as its first (equality) predicate, matching the
+    household-first compound indexes in migrations.INDEXES; every insert is stamped with it."""
+
+    # Readers re-read the archive watermarks at most this often; the archiver waits this long
+    # after raising a watermark before it moves anything below it.
+    watermark_ttl = 30
+
+    def __init__(self, db, household=DEFAULT_HOUSEHOLD, _archive_cache=None):
+        self.db = db
+        self.household = household
+        # Shared by every household's repository: watermarks and partitions are per deployment.
+        self._archive_cache = _archive_cache if _archive_cache is not None else {"state": None, "read_at": 0.0}
+
+    def prepare(self, log=print):
+        upgrade(self.db, log=log)
+
+    def for_household(self, household):
+        return MongoRepository(self.db, household, _archive_cache=self._archive_cache)
+
+    def households(self):
+        # Answered from the household-first indexes (DISTINCT_SCAN), not by scanning documents.
+        found = set()
+        for collection in INDEXES:
+            found.update(self.db[collection].distinct("household"))
+        found.discard(None)  # app_state's deployment-wide documents
+        return sorted(found)
+
+    def _scoped(self, query=None):
+        return {"household": self.household, **(query or {})}
+
+    def _stamped(self, doc):
+        doc["household"] = self.household
+        return doc
+
+    def get_partner_names(self):
+        doc = self.db.app_state.find_one(self._scoped({"key": "partner_names"}))
+        return doc['value'] if doc else None
+
+    def set_partner_names(self, names):
+        self.db.app_state.update_one(self._scoped({"key": "partner_names"}), {"$set": {"value": list(names)}}, upsert=True)
+
+    def insert_event(self, event):
+        self.db.events.insert_one(self._stamped(event))
+
+    def find_events(self):
+        return list(self.db.events.find(self._scoped()))
+
+    def events_between(self, range_start, range_end, fields=None):
+        query = self._scoped({"start": {"$gte": range_start, "$lt": range_end}})
+        events = list(self.db.events.find(query, fields).sort("start", 1))
+        archives = self._archives("events", range_start, range_end)
+        if archives:
+            # A batch interrupted between copy and delete can leave a document in both tiers.
+            seen = {event["_id"] for event in events if "_id" in event}
+            for archive in archives:
+                events += [event for event in archive.find(query, fields) if "_id" not in event or event["_id"] not in seen]
+            events.sort(key=operator.itemgetter("start"))
+        return events
+
+    def upcoming_events(self, now, limit, fields=None):
+        return list(self.db.events.find(self._scoped({"start": {"$gt": now}}), fields).sort("start", 1).limit(limit))
+
+    def insert_blockout(self, blockout):
+        self.db.blockouts.insert_one(self._stamped(blockout))
+
+    def find_blockouts(self):
+        return list(self.db.blockouts.find(self._scoped()))
+
+    def blockouts_between(self, range_start, range_end, fields=None):
+        query = self._scoped({"start": {"$lt": range_end}, "end": {"$gt": range_start}})
+        return list(self.db.blockouts.find(query, fields).sort("start", 1))
+
+    def insert_series(self, kind, series):
+        self.db[SERIES_COLLECTIONS[kind]].insert_one(self._stamped(series))
+
+    def find_series(self, kind):
+        return list(self.db[SERIES_COLLECTIONS[kind]].find(self._scoped()))
+
+    def add_series_exception(self, kind, series_id, original_start, override=None):
+        if override:
+            change = {"$push": {"overrides": dict(override, original_start=original_start)}}
+        else:
+            change = {"$addToSet": {"exdates": original_start}}
+        change["$inc"] = {"revision": 1}
+        self.db[SERIES_COLLECTIONS[kind]].update_one(self._scoped({"_id": ObjectId(series_id)}), change)
+
+    def upsert_by_uid(self, kind, docs, series=False):
+        if series:
+            collection = self.db[SERIES_COLLECTIONS[kind]]
+            requests = [UpdateOne(self._scoped({"uid": doc["uid"]}), _replace_bumping_revision(self._stamped(doc)), upsert=True)
+                        for doc in docs]
+        else:
+            collection = self.db[kind]
+            requests = [ReplaceOne(self._scoped({"uid": doc["uid"]}), self._stamped(doc), upsert=True) for doc in docs]
+        archived = self._archived_uids(kind, [doc["uid"] for doc in docs]) if not series else {}
+        result = collection.bulk_write(requests, ordered=False)
+        if not archived:
+            return result.upserted_count, result.matched_count
+        # The new version is written to the hot tier before the archived one is dropped, so a crash in between
+        # leaves a duplicate (which the next archiver pass resolves) rather than losing the event.
+        for partition, uids in archived.items():
+            self.db[partition].delete_many(self._scoped({"uid": {"$in": uids}}))
+        archived_uids = {uid for uids in archived.values() for uid in uids}
+        returned = sum(1 for index in result.upserted_ids if docs[index]["uid"] in archived_uids)
+        return result.upserted_count - returned, result.matched_count + returned
+
+    def add_series_exdates(self, kind, exdates_by_uid):
+        requests = [
+            UpdateOne(self._scoped({"uid": uid}), {"$addToSet": {"exdates": {"$each": dates}}, "$inc": {"revision": 1}})
+            for uid, dates in exdates_by_uid.items()
+        ]
+        if requests:
+            self.db[SERIES_COLLECTIONS[kind]].bulk_write(requests, ordered=False)
+
+    def iter_between(self, kind, range_start, range_end, batch_size=1000):
+        if kind == "events":
+            query = self._scoped({"start": {"$gte": range_start, "$lt": range_end}})
+        else:
+            query = self._scoped({"start": {"$lt": range_end}, "end": {"$gt": range_start}})
+        cursors = [self.db[kind].find(query).sort("start", 1).batch_size(batch_size)]
+        if kind == "events":
+            cursors += [archive.find(query).sort("start", 1).batch_size(batch_size)
+                        for archive in self._archives("events", range_start, range_end)]
+        return heapq.merge(*cursors, key=operator.itemgetter("start")) if len(cursors) > 1 else cursors[0]
+
+    def _archived_uids(self, kind, uids):
+        """Archive partition -> which of `uids` it holds; re-imported events replace their archived versions."""
+        if kind not in ARCHIVED_COLLECTIONS:
+            return {}
+        found = {}
+        for year in self._read_archive_state()[1].get(kind, []):
+            partition = archive_partition(kind, year)
+            matches = self.db[partition].find(self._scoped({"uid": {"$in": uids}}), {"uid": 1, "_id": 0})
+            found[partition] = [doc["uid"] for doc in matches]
+        return {partition: matches for partition, matches in found.items() if matches}
+
+    def _read_archive_state(self):
+        doc = self.db.app_state.find_one({"key": ARCHIVE_STATE_KEY}) or {}
+        return doc.get("watermarks", {}), doc.get("partitions", {})
+
+    def _archives(self, collection, range_start, range_end):
+        """Archive partitions a read of [range_start, range_end) must also visit (usually none)."""
+        cache = self._archive_cache
+        if cache["state"] is None or time.monotonic() - cache["read_at"] > self.watermark_ttl:
+            cache["state"] = self._read_archive_state()
+            cache["read_at"] = time.monotonic()
+        watermarks, partitions = cache["state"]
+        years = partition_years(partitions.get(collection, ()), range_start, range_end, watermarks.get(collection))
+        return [self.db[archive_partition(collection, year)] for year in years]
+
+    def archive_watermark(self, collection):
+        return self._read_archive_state()[0].get(collection)
+
+    def set_archive_watermark(self, collection, cutoff):
+        self.db.app_state.update_one(
+            {"key": ARCHIVE_STATE_KEY}, {"$max": {f"watermarks.{collection}": cutoff}}, upsert=True
+        )
+
+    def archive_batch(self, collection, cutoff, batch_size):
+        field = ARCHIVED_COLLECTIONS[collection]
+        batch = list(self.db[collection].find(self._scoped({field: {"$lt": cutoff}})).sort(field, 1).limit(batch_size))
+        by_year = {}
+        for doc in batch:
+            by_year.setdefault(doc[field].year, []).append(doc)
+        known = self._read_archive_state()[1].get(collection, [])
+        for year, docs in by_year.items():
+            partition = self.db[archive_partition(collection, year)]
+            if year not in known:
+                for keys, options in INDEXES[collection]:
+                    partition.create_index(keys, **options)
+                self.db.app_state.update_one(
+                    {"key": ARCHIVE_STATE_KEY}, {"$addToSet": {f"partitions.{collection}": year}}, upsert=True
+                )
+            # Keyed on _id, so a copy left by an earlier, interrupted run is simply overwritten.
+            copies = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs]
+            try:
+                partition.bulk_write(copies, ordered=False)
+            except BulkWriteError as exc:
+                errors = exc.details["writeErrors"]
+                if any(error["code"] != DUPLICATE_KEY or "uid" not in docs[error["index"]] for error in errors):
+                    raise
+                # Another document with the same import uid: an older version of an event that was re-imported
+                # before upsert_by_uid looked in the archive. The hot document is the newer one.
+                clashing = [docs[error["index"]] for error in errors]
+                partition.delete_many(self._scoped({"uid": {"$in": [doc["uid"] for doc in clashing]},
+                                                    "_id": {"$nin": [doc["_id"] for doc in clashing]}}))
+                partition.bulk_write([copies[error["index"]] for error in errors], ordered=False)
+        if batch:
+            self.db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+        return len(batch)
+
+    def insert_love_note(self, note):
+        self.db.love_notes.insert_one(self._stamped(note))
+
+    def love_notes_page(self, before=None, limit=25, fields=None):
+        query = self._scoped({"type": "love_note"})
+        order = [(field, -1) for field in NOTE_ORDER]
+        notes = list(self.db.love_notes.find(_below(query, before), fields).sort(order).limit(limit))
+        if len(notes) < limit:
+            # The hot tier is exhausted: continue into the archive, newest partition first. Reading only
+            # below the oldest hot note also skips anything an interrupted batch left in both tiers.
+            oldest = (notes[-1]["timestamp"], notes[-1]["_id"]) if notes else before
+            for archive in reversed(self._archives("love_notes", None, oldest and oldest[0])):
+                notes += archive.find(_below(query, oldest), fields).sort(order).limit(limit - len(notes))
+                if len(notes) >= limit:
+                    break
+        return notes
+
+    def search_love_notes(self, query, author=None, range_start=None, range_end=None, skip=0, limit=25, fields=None):
+        # The text index is prefixed by household, so $text requires (and is narrowed by) the equality match.
+        filters = self._scoped({"$text": {"$search": query}, "type": "love_note"})
+        if author is not None:
+            filters["author"] = author
+        if range_start is not None or range_end is not None:
+            filters["timestamp"] = {}
+            if range_start is not None:
+                filters["timestamp"]["$gte"] = range_start
+            if range_end is not None:
+                filters["timestamp"]["$lt"] = range_end
+        score = {"$meta": "textScore"}
+        projection = dict(fields or {}, score=score)
+        # Archived notes are only searched when the date range reaches back into them.
+        archives = self._archives("love_notes", range_start, range_end) if range_start is not None else []
+        if not archives:
+            return list(self.db.love_notes.find(filters, projection).sort([("score", score), ("timestamp", -1)])
+                        .skip(skip).limit(limit))
+        notes = []
+        for collection in [self.db.love_notes, *archives]:
+            notes += collection.find(filters, projection).sort([("score", score), ("timestamp", -1)]).limit(skip + limit)
+        notes.sort(key=operator.itemgetter("score", "timestamp"), reverse=True)
+        return notes[skip:skip + limit]
+
+    def upsert_mood(self, partner, date, values):
+        self.db.moods.update_one(self._scoped({"partner": partner, "date": date}), {"$set": values}, upsert=True)
+
+    def mood_trends(self, range_start, range_end, unit):
+        archives = [archive.name for archive in self._archives("moods", range_start, range_end)]
+        pipeline = mood_rollup_pipeline(range_start, range_end, unit, archives=archives, household=self.household)
+        return list(self.db.moods.aggregate(pipeline))
+
+    def insert_alert(self, alert):
+        self.db.alerts.insert_one(self._stamped(alert))
+
+    def mark_alert_seen(self, alert_id):
+        self.db.alerts.update_one(self._scoped({"_id": ObjectId(alert_id)}), {"$set": {"seen": True}})
+
+    def notification_backend(self, name):
+        return create_backend(name, self.db.alerts)
@@ -0,0 +1,130 @@
+import datetime
+
+import pytest
+
+import archive
+from archive import run_archiving, start_scheduler
+from ical import import_calendar
+from storage import create_repository
+
+NOW = datetime.datetime(2025, 1, 1)
+WINDOW = (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1))
+TEMPLATE = {"backgroundColor": "#87CEEB", "borderColor": "#87CEEB", "booker": "Partner 1", "event_type": "date"}
+
+
+def quiet(message):
+    pass
+
+
+def events(titles, start=datetime.datetime(2020, 1, 10)):
+    starts = [start + datetime.timedelta(days=number) for number in range(len(titles))]
+    return [{"title": title, "start": at, "end": at + datetime.timedelta(hours=1)} for title, at in zip(titles, starts)]
+
+
+def with_households(*households, count=5):
+    repo = create_repository("memory")
+    for household in households:
+        repo.for_household(household).load(events=events([f"{household} {number}" for number in range(count)])
+                                           + events([f"{household} recent"], start=datetime.datetime(2024, 12, 20)))
+    return repo
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Records watermark raises, sleeps and archive batches, in order."""
+    recorded = []
+    memory = type(create_repository("memory"))
+    set_watermark, archive_batch = memory.set_archive_watermark, memory.archive_batch
+
+    def recording_set_watermark(self, collection, cutoff):
+        recorded.append(("watermark", collection))
+        set_watermark(self, collection, cutoff)
+
+    def recording_archive_batch(self, collection, cutoff, batch_size):
+        moved = archive_batch(self, collection, cutoff, batch_size)
+        recorded.append(("batch", collection, self.household, moved))
+        return moved
+
+    monkeypatch.setattr(memory, "set_archive_watermark", recording_set_watermark)
+    monkeypatch.setattr(memory, "archive_batch", recording_archive_batch)
+    monkeypatch.setattr(archive.time, "sleep", lambda seconds: recorded.append(("sleep", seconds)))
+    return recorded
+
+
+def calendar(summary, start="20200110T090000"):
+    return (f"BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:w1@x\r\nDTSTART:{start}\r\nSUMMARY:{summary}\r\n"
+            "END:VEVENT\r\nEND:VCALENDAR\r\n").splitlines(keepends=True)
+
+
+def test_reimporting_an_archived_event_replaces_it():
+    repo = create_repository("memory")
+    import_calendar(repo, calendar("Old work"), "events", TEMPLATE)
+    run_archiving(repo, now=NOW, log=quiet)
+    assert repo.find_events() == []
+
+    assert import_calendar(repo, calendar("Old work v2"), "events", TEMPLATE) == {"inserted": 0, "updated": 1}
+    assert [event["title"] for event in repo.events_between(*WINDOW)] == ["Old work v2"]
+
+    run_archiving(repo, now=NOW, log=quiet)
+    assert repo.find_events() == []
+    assert [event["title"] for event in repo.events_between(*WINDOW)] == ["Old work v2"]
+
+    # Moved out of the archived range, the new version stays hot and the old one is gone.
+    import_calendar(repo, calendar("Now recent", start="20241220T090000"), "events", TEMPLATE)
+    assert repo.events_between(*WINDOW) == []
+    assert [event["title"] for event in repo.find_events()] == ["Now recent"]
+
+
+def test_watermarks_are_raised_and_seen_before_anything_moves(calls):
+    repo = with_households("h1")
+    repo.watermark_ttl = 30
+    run_archiving(repo, now=NOW, log=quiet)
+    assert calls[:4] == [("watermark", "love_notes"), ("watermark", "moods"), ("watermark", "events"), ("sleep", 30)]
+    assert all(call[0] == "batch" for call in calls[4:])
+
+    # The same day's cutoffs are already in place: no wait, nothing left to move.
+    calls.clear()
+    assert run_archiving(repo, now=NOW, log=quiet) == {"love_notes": 0, "moods": 0, "events": 0}
+    assert [call[0] for call in calls] == ["batch"] * 3
+
+
+def test_documents_move_one_household_at_a_time(calls):
+    repo = with_households("h1", "h2")
+    assert run_archiving(repo, now=NOW, batch_size=2, log=quiet)["events"] == 10
+    batches = [(call[2], call[3]) for call in calls if call[:2] == ("batch", "events")]
+    assert batches == [("h1", 2), ("h1", 2), ("h1", 1), ("h2", 2), ("h2", 2), ("h2", 1)]
+    for household in ("h1", "h2"):
+        tenant = repo.for_household(household)
+        assert [event["title"] for event in tenant.find_events()] == [f"{household} recent"]
+        assert [event["title"] for event in tenant.events_between(*WINDOW)] == [f"{household} {n}" for n in range(5)]
+
+
+def test_an_interrupted_run_is_finished_by_the_next_one(calls, monkeypatch):
+    repo = with_households("h1", "h2")
+    memory = type(repo)
+    archive_batch = memory.archive_batch
+
+    def failing_on_h2(self, collection, cutoff, batch_size):
+        if (self.household, collection) == ("h2", "events"):
+            raise ConnectionError("lost the server")
+        return archive_batch(self, collection, cutoff, batch_size)
+
+    monkeypatch.setattr(memory, "archive_batch", failing_on_h2)
+    with pytest.raises(ConnectionError):
+        run_archiving(repo, now=NOW, batch_size=2, log=quiet)
+    assert repo.for_household("h2").archive_watermark("events") == archive.archive_cutoff(365, NOW)
+
+    monkeypatch.setattr(memory, "archive_batch", archive_batch)
+    calls.clear()
+    assert run_archiving(repo, now=NOW, batch_size=2, log=quiet)["events"] == 5
+    assert ("sleep", 0) not in calls
+    for household in ("h1", "h2"):
+        tenant = repo.for_household(household)
+        assert len(tenant.find_events()) == 1
+        assert len(tenant.events_between(*WINDOW)) == 5
+
+
+def test_the_scheduler_runs_once_per_process():
+    first = start_scheduler(create_repository("memory"), 3600, log=quiet)
+    assert start_scheduler(create_repository("memory"), 3600, log=quiet) is first
+    assert first.is_alive() and first.daemon
@@ -0,0 +1,29 @@
+import datetime
+
+from storage import NOTE_FIELDS, create_repository
+
+NOW = datetime.datetime(2024, 6, 1, 12, 0)
+
+
+def note(message):
+    return {"author": "Partner 1", "message": message, "timestamp": NOW, "type": "love_note"}
+
+
+def test_reading_an_unknown_household_does_not_create_it():
+    repo = create_repository("memory")
+    stranger = repo.for_household("guessed-id")
+    assert stranger.love_notes_page(fields=NOTE_FIELDS) == []
+    assert stranger.get_partner_names() is None
+    assert repo.households() == []
+
+
+def test_households_appear_on_first_write_and_stay_isolated():
+    repo = create_repository("memory")
+    ours, theirs = repo.for_household("ours"), repo.for_household("theirs")
+    ours.insert_love_note(note("only ours"))
+    theirs.set_partner_names(["A", "B"])
+    assert repo.households() == ["ours", "theirs"]
+    assert repo.for_household("ours") is ours
+    assert [n["message"] for n in repo.for_household("ours").love_notes_page(fields=NOTE_FIELDS)] == ["only ours"]
+    assert repo.for_household("theirs").love_notes_page(fields=NOTE_FIELDS) == []
+    assert repo.for_household("ours").get_partner_names() is None
@@ -0,0 +1,159 @@
+import datetime
+import io
+import zoneinfo
+
+import pytest
+
+from ical import export_calendar, fold, import_calendar, parse_datetime, parse_rrule, unfold
+from recurrence import ExpansionCache, expand, make_rule, new_series
+from storage import create_repository
+
+WINDOW = (datetime.datetime(2024, 1, 1), datetime.datetime(2025, 1, 1))
+TEMPLATE = {"backgroundColor": "#87CEEB", "borderColor": "#87CEEB", "booker": "Partner 1", "event_type": "date"}
+
+
+def calendar_text(*vevents):
+    body = "".join("BEGIN:VEVENT\r\n" + "".join(f"{line}\r\n" for line in lines) + "END:VEVENT\r\n" for lines in vevents)
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n{body}END:VCALENDAR\r\n"
+
+
+def import_text(repo, text, kind="events"):
+    return import_calendar(repo, text.splitlines(keepends=True), kind, TEMPLATE)
+
+
+def occurrences(repo, kind="events"):
+    """(start, end, title) of every single document and series occurrence in WINDOW."""
+    singles = repo.events_between(*WINDOW) if kind == "events" else repo.blockouts_between(*WINDOW)
+    found = [(doc["start"], doc["end"], doc["title"]) for doc in singles]
+    found += [(occ["start"], occ["end"], occ["title"]) for series in repo.find_series(kind) for occ in expand(series, *WINDOW)]
+    return sorted(found)
+
+
+WEEKLY = ["UID:yoga@example.com", "DTSTART:20240102T090000", "DTEND:20240102T100000", "SUMMARY:Yoga",
+          "RRULE:FREQ=WEEKLY;BYDAY=TU,TH;COUNT=10"]
+
+
+def test_export_then_import_round_trips():
+    original = create_repository("memory")
+    first = datetime.datetime(2024, 3, 4, 19, 0)
+    original.insert_event(dict(TEMPLATE, title="Dinner; then a walk, maybe", start=first, end=first + datetime.timedelta(hours=2)))
+    series = new_series({"title": "Date night", "start": first, "end": first + datetime.timedelta(hours=3)},
+                        make_rule("weekly", byweekday=[0, 4], until=datetime.datetime(2024, 6, 1)))
+    original.insert_series("events", series)
+    series_id = original.find_series("events")[0]["_id"]
+    original.add_series_exception("events", series_id, datetime.datetime(2024, 3, 8, 19, 0))
+    original.add_series_exception("events", series_id, datetime.datetime(2024, 3, 11, 19, 0), override={
+        "start": datetime.datetime(2024, 3, 12, 20, 0), "end": datetime.datetime(2024, 3, 12, 22, 0), "title": "Moved"})
+
+    text = "".join(export_calendar(original, ["events"], *WINDOW))
+    copy = create_repository("memory")
+    import_text(copy, text)
+
+    assert occurrences(copy) == occurrences(original)
+
+
+def test_reimport_is_idempotent_and_updates_in_place():
+    repo = create_repository("memory")
+    single = ["UID:dinner@example.com", "DTSTART:20240105T190000", "DTEND:20240105T210000", "SUMMARY:Dinner"]
+    assert import_text(repo, calendar_text(single, WEEKLY)) == {"inserted": 2, "updated": 0}
+    before = occurrences(repo)
+    assert import_text(repo, calendar_text(single, WEEKLY)) == {"inserted": 0, "updated": 2}
+    assert occurrences(repo) == before
+
+    moved = [line.replace("T1900", "T2000").replace("T2100", "T2200") for line in single]
+    import_text(repo, calendar_text(moved, WEEKLY))
+    assert [(start.hour, title) for start, _, title in occurrences(repo) if title == "Dinner"] == [(20, "Dinner")]
+    assert len(repo.events_between(*WINDOW)) == 1
+
+
+def test_reimporting_a_changed_series_invalidates_cached_expansions():
+    repo = create_repository("memory")
+    cache = ExpansionCache()
+    import_text(repo, calendar_text(WEEKLY))
+    stored = repo.find_series("events")
+    assert {occ["start"].hour for occ in cache.expand_all(stored, *WINDOW)} == {9}
+
+    changed = [line.replace("T0900", "T1300").replace("T1000", "T1400").replace("Yoga", "Hot yoga") for line in WEEKLY]
+    import_text(repo, calendar_text(changed))
+    restored = repo.find_series("events")
+    assert restored[0]["_id"] == stored[0]["_id"]
+    assert restored[0]["revision"] > stored[0]["revision"]
+    assert {(occ["start"].hour, occ["title"]) for occ in cache.expand_all(restored, *WINDOW)} == {(13, "Hot yoga")}
+
+
+def test_recurrence_id_becomes_a_single_and_an_exdate():
+    repo = create_repository("memory")
+    instance = ["UID:yoga@example.com", "RECURRENCE-ID:20240104T090000", "DTSTART:20240104T180000",
+                "DTEND:20240104T190000", "SUMMARY:Evening yoga"]
+    import_text(repo, calendar_text(WEEKLY, instance))
+    series = repo.find_series("events")[0]
+    assert series["exdates"] == [datetime.datetime(2024, 1, 4, 9, 0)]
+    [single] = repo.events_between(*WINDOW)
+    assert single["uid"] == "yoga@example.com/2024-01-04T09:00:00"
+    assert single["start"] == datetime.datetime(2024, 1, 4, 18, 0)
+    assert len(occurrences(repo)) == 10
+
+
+def test_fold_keeps_lines_within_75_octets_and_unfolds_back():
+    line = "SUMMARY:" + "Café au lait and croissants by the river ☕ " * 5
+    folded = fold(line)
+    assert all(len(physical.encode()) <= 75 for physical in folded.split("\r\n"))
+    assert list(unfold(folded.splitlines(keepends=True))) == [line]
+
+
+def test_tzid_and_utc_times_become_local():
+    expected = datetime.datetime(2024, 1, 15, 9, 0, tzinfo=zoneinfo.ZoneInfo("America/New_York")).astimezone().replace(tzinfo=None)
+    assert parse_datetime("20240115T090000", {"TZID": "America/New_York"}) == (expected, False)
+    utc = datetime.datetime(2024, 1, 15, 14, 0, tzinfo=datetime.timezone.utc).astimezone().replace(tzinfo=None)
+    assert parse_datetime("20240115T140000Z", {}) == (utc, False)
+    assert parse_datetime("20240115T090000", {"TZID": "Not/AZone"}) == (datetime.datetime(2024, 1, 15, 9, 0), False)
+    assert parse_datetime("20240115", {"VALUE": "DATE"}) == (datetime.datetime(2024, 1, 15), True)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("FREQ=DAILY;INTERVAL=2", make_rule("daily", 2)),
+    ("FREQ=WEEKLY;BYDAY=FR,MO;WKST=MO", make_rule("weekly", byweekday=[0, 4])),
+    ("FREQ=YEARLY", make_rule("monthly", 12)),
+    ("FREQ=MONTHLY;COUNT=6", make_rule("monthly", count=6)),
+    ("FREQ=WEEKLY;UNTIL=20240301", make_rule("weekly", until=datetime.datetime(2024, 3, 1, 23, 59, 59, 999999))),
+    ("FREQ=MONTHLY;BYDAY=1MO", None),
+    ("FREQ=MONTHLY;BYMONTHDAY=15", None),
+    ("FREQ=HOURLY", None),
+])
+def test_rrule_mapping(value, expected):
+    assert parse_rrule(value) == expected
+
+
+def test_unsupported_rule_imports_its_first_occurrence():
+    repo = create_repository("memory")
+    unsupported = ["UID:club@example.com", "DTSTART:20240105T190000", "DTEND:20240105T210000", "SUMMARY:Book club",
+                   "RRULE:FREQ=MONTHLY;BYDAY=1FR"]
+    assert import_text(repo, calendar_text(unsupported), "blockouts") == {"unsupported_rules": 1, "inserted": 1, "updated": 0}
+    assert occurrences(repo, "blockouts") == [(datetime.datetime(2024, 1, 5, 19, 0), datetime.datetime(2024, 1, 5, 21, 0), "Book club")]
+
+
+def test_an_unreadable_event_is_skipped_and_the_rest_imported():
+    repo = create_repository("memory")
+    broken = ["UID:broken@example.com", "DTSTART:2024-01-05 19:00", "SUMMARY:Broken"]
+    fine = ["UID:fine@example.com", "DTSTART:20240106T190000", "DTEND:20240106T200000", "SUMMARY:Fine"]
+    assert import_text(repo, calendar_text(broken, fine)) == {"malformed": 1, "inserted": 1, "updated": 0}
+    assert [title for _, _, title in occurrences(repo)] == ["Fine"]
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "empty"),
+    ("Subject,Start Date\r\nDinner,2024-01-05\r\n", "not an iCalendar file"),
+    (calendar_text(WEEKLY).split("END:VEVENT")[0], "truncated"),
+])
+def test_files_that_are_not_whole_calendars_raise(text, message):
+    with pytest.raises(ValueError, match=message):
+        import_text(create_repository("memory"), text)
+
+
+def test_bytes_that_are_not_utf8_do_not_stop_the_import():
+    repo = create_repository("memory")
+    latin1 = calendar_text(["UID:cafe@example.com", "DTSTART:20240105T190000", "DTEND:20240105T200000",
+                            "SUMMARY:Café"]).encode("latin-1")
+    lines = io.TextIOWrapper(io.BytesIO(latin1), encoding="utf-8-sig", errors="replace", newline="")
+    assert import_calendar(repo, lines, "events", TEMPLATE) == {"inserted": 1, "updated": 0}
+    assert [title for _, _, title in occurrences(repo)] == ["Caf\ufffd"]
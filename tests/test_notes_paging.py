@@ -0,0 +1,45 @@
+import datetime
+
+from storage import create_repository
+
+FIELDS = {"author": 1, "message": 1, "timestamp": 1}
+BASE = datetime.datetime(2025, 1, 1, 12, 0)
+
+
+def page_through(repo, limit):
+    seen, cursor = [], None
+    while True:
+        page = repo.love_notes_page(before=cursor, limit=limit, fields=FIELDS)
+        seen += page
+        if len(page) < limit:
+            return seen
+        cursor = (page[-1]["timestamp"], page[-1]["_id"])
+
+
+def test_paging_keeps_notes_that_share_a_timestamp():
+    repo = create_repository("memory")
+    # Pairs of notes written in the same instant, so page boundaries fall between twins.
+    notes = [{"author": "A", "message": f"note {i}", "timestamp": BASE + datetime.timedelta(minutes=i // 2),
+              "type": "love_note"} for i in range(60)]
+    repo.load(love_notes=notes)
+
+    seen = page_through(repo, limit=25)
+
+    assert sorted(note["message"] for note in seen) == sorted(note["message"] for note in notes)
+    keys = [(note["timestamp"], note["_id"]) for note in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_paging_continues_into_the_archive_across_ties():
+    repo = create_repository("memory")
+    old = datetime.datetime(2020, 6, 1)
+    repo.load(love_notes=[{"author": "A", "message": f"old {i}", "timestamp": old, "type": "love_note"} for i in range(7)]
+              + [{"author": "B", "message": f"new {i}", "timestamp": BASE, "type": "love_note"} for i in range(5)])
+    repo.set_archive_watermark("love_notes", datetime.datetime(2024, 1, 1))
+    while repo.archive_batch("love_notes", datetime.datetime(2024, 1, 1), 3):
+        pass
+
+    seen = page_through(repo, limit=4)
+
+    assert len(seen) == 12
+    assert len({note["_id"] for note in seen}) == 12
@@ -0,0 +1,114 @@
+import datetime
+import random
+
+import pytest
+
+from recurrence import ExpansionCache, expand, make_rule, new_series, next_occurrences
+from storage import create_repository
+
+FIRST = datetime.datetime(2024, 1, 31, 19, 30)
+HOUR = datetime.timedelta(hours=1)
+
+
+def brute_force_starts(series, horizon):
+    """Every occurrence start before `horizon`, found by walking day by day from the first one."""
+    rule, first = series["recurrence"], series["start"]
+    starts, day = [], first
+    while day < horizon:
+        days = (day.date() - first.date()).days
+        if rule["freq"] == "daily":
+            hit = days % rule["interval"] == 0
+        elif rule["freq"] == "weekly":
+            weeks = (days + first.weekday()) // 7
+            hit = weeks % rule["interval"] == 0 and day.weekday() in (rule["byweekday"] or [first.weekday()])
+        else:
+            months = (day.year - first.year) * 12 + day.month - first.month
+            hit = day.day == first.day and months % rule["interval"] == 0
+        if hit:
+            if rule["until"] is not None and day > rule["until"]:
+                break
+            starts.append(day)
+            if rule["count"] is not None and len(starts) == rule["count"]:
+                break
+        day += datetime.timedelta(days=1)
+    return starts
+
+
+def brute_force_expand(series, window_start, window_end):
+    duration = series["end"] - series["start"]
+    skipped = set(series["exdates"])
+    return [start for start in brute_force_starts(series, window_end)
+            if start not in skipped and start + duration > window_start]
+
+
+def series_with(rule, start=FIRST, duration=2 * HOUR, **extra):
+    return dict(new_series({"title": "Date night", "start": start, "end": start + duration}, rule), _id="s1", **extra)
+
+
+RULES = [
+    make_rule("daily"),
+    make_rule("daily", interval=3),
+    make_rule("weekly"),
+    make_rule("weekly", interval=2, byweekday=[0, 3, 5]),
+    make_rule("monthly"),
+    make_rule("monthly", interval=5),
+    make_rule("daily", count=40),
+    make_rule("weekly", byweekday=[1, 2], until=datetime.datetime(2024, 9, 4, 19, 30)),
+    make_rule("monthly", until=datetime.datetime(2026, 3, 31, 19, 30)),
+]
+
+
+@pytest.mark.parametrize("rule", RULES, ids=lambda rule: f"{rule['freq']}-{rule['interval']}-{rule['count']}-{rule['until']}")
+def test_expand_matches_brute_force(rule):
+    rng = random.Random(3)
+    series = series_with(rule, duration=30 * HOUR)  # longer than a day: occurrences reach into the next window
+    series["exdates"] = [FIRST + datetime.timedelta(days=day) for day in range(0, 400, 7)]
+    for _ in range(60):
+        window_start = FIRST + datetime.timedelta(hours=rng.randrange(-48, 24 * 900))
+        window_end = window_start + datetime.timedelta(hours=rng.randrange(1, 24 * 45))
+        got = [occ["start"] for occ in expand(series, window_start, window_end)]
+        assert got == brute_force_expand(series, window_start, window_end)
+
+
+def test_monthly_on_the_31st_skips_short_months():
+    starts = [occ["start"] for occ in expand(series_with(make_rule("monthly")), FIRST, datetime.datetime(2024, 9, 1))]
+    assert [start.month for start in starts] == [1, 3, 5, 7, 8]
+
+
+def test_overrides_move_occurrences_into_and_out_of_the_window():
+    moved_from = datetime.datetime(2024, 2, 7, 19, 30)
+    series = series_with(make_rule("weekly"), overrides=[
+        {"original_start": moved_from, "start": moved_from + datetime.timedelta(days=10),
+         "end": moved_from + datetime.timedelta(days=10) + HOUR, "title": "Moved"},
+    ])
+    window = (datetime.datetime(2024, 2, 5), datetime.datetime(2024, 2, 12))
+    assert [occ["title"] for occ in expand(series, *window)] == []
+    later = expand(series, datetime.datetime(2024, 2, 16), datetime.datetime(2024, 2, 19))
+    assert [(occ["title"], occ["occurrence_start"]) for occ in later] == [("Moved", moved_from)]
+
+
+def test_next_occurrences_honours_count_and_exdates():
+    series = series_with(make_rule("daily", count=5), exdates=[FIRST + datetime.timedelta(days=1)])
+    found = next_occurrences(series, FIRST - HOUR, 10)
+    assert [occ["start"].day for occ in found] == [31, 2, 3, 4]
+
+
+def test_expansion_cache_follows_revisions():
+    cache = ExpansionCache()
+    series = series_with(make_rule("daily"))
+    window = (FIRST, FIRST + datetime.timedelta(days=3))
+    assert len(cache.expand(series, *window)) == 3
+    skipped = dict(series, exdates=[FIRST], revision=1)
+    assert len(cache.expand(skipped, *window)) == 2
+
+
+@pytest.mark.parametrize("kind", ["events", "blockouts"])
+def test_skipping_an_occurrence_works_for_both_kinds(kind):
+    repo = create_repository("memory")
+    repo.insert_series(kind, new_series({"title": "Gym", "start": FIRST, "end": FIRST + HOUR}, make_rule("daily")))
+    stored = repo.find_series(kind)[0]
+    repo.add_series_exception(kind, stored["_id"], FIRST + datetime.timedelta(days=1))
+    updated = repo.find_series(kind)[0]
+    assert updated["revision"] == stored["revision"] + 1
+    starts = [occ["start"] for occ in expand(updated, FIRST, FIRST + datetime.timedelta(days=3))]
+    assert starts == [FIRST, FIRST + datetime.timedelta(days=2)]
@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from scheduling import WAKING_HOURS, find_free_slots, invitation_windows, same_time_windows
+
+FRIDAY = datetime.datetime(2024, 6, 7)
+HOUR = datetime.timedelta(hours=1)
+
+
+def at(hour, minute=0, day=0):
+    return FRIDAY + datetime.timedelta(days=day, hours=hour, minutes=minute)
+
+
+def slots_across(windows, busy, duration, count=5):
+    """What find_mutual_free_slots does with its windows, minus the storage reads."""
+    slots = []
+    for window_start, window_end in windows:
+        slots += find_free_slots(busy, duration, window_start, window_end, count - len(slots))
+        if len(slots) >= count:
+            break
+    return slots
+
+
+def test_window_edges_snap_to_the_step_and_stop_at_the_end():
+    assert find_free_slots([], HOUR, at(10, 7), at(12), 5) == [(at(10, 30), at(11, 30))]
+    assert find_free_slots([], HOUR, at(10), at(10, 59), 5) == []
+
+
+def test_a_gap_of_exactly_the_requested_length_is_a_slot():
+    busy = [(at(9), at(10)), (at(11), at(12))]
+    assert find_free_slots(busy, HOUR, at(9), at(12), 5) == [(at(10), at(11))]
+
+
+def test_overlapping_and_touching_busy_intervals_merge():
+    overlapping = [(at(9), at(11)), (at(10), at(12)), (at(10, 30), at(10, 45))]
+    assert find_free_slots(overlapping, HOUR, at(9), at(14), 5) == [(at(12), at(13)), (at(13), at(14))]
+    touching = [(at(9), at(10)), (at(10), at(11))]
+    assert find_free_slots(touching, HOUR, at(9), at(12), 5) == [(at(11), at(12))]
+
+
+def test_busy_intervals_reaching_past_the_window_and_ending_off_step():
+    busy = [(at(7), at(9, 10)), (at(11), at(15))]
+    assert find_free_slots(busy, HOUR, at(8), at(12), 5) == [(at(9, 30), at(10, 30))]
+
+
+def test_count_limits_the_slots():
+    slots = find_free_slots([], 2 * HOUR, at(8), at(23), 3)
+    assert slots == [(at(8), at(10)), (at(10), at(12)), (at(12), at(14))]
+
+
+def test_alternatives_to_a_clashing_evening_stay_in_the_evening():
+    busy = [(at(19), at(21))]
+    windows = same_time_windows(at(20), 2 * HOUR, 7)
+    assert windows[0] == (at(17), at(24))
+    assert slots_across(windows, busy, 2 * HOUR) == [
+        (at(17), at(19)), (at(21), at(23)), (at(17, day=1), at(19, day=1)), (at(19, day=1), at(21, day=1)),
+        (at(21, day=1), at(23, day=1)),
+    ]
+
+
+@pytest.mark.parametrize("hour", [8, 9, 13, 20, 22])
+def test_same_time_windows_stay_within_waking_hours(hour):
+    for window_start, window_end in same_time_windows(at(hour), 2 * HOUR, 7):
+        midnight = datetime.datetime.combine(window_start.date(), datetime.time())
+        assert window_start >= midnight + datetime.timedelta(hours=WAKING_HOURS[0])
+        assert window_end <= midnight + datetime.timedelta(hours=WAKING_HOURS[1])
+        assert window_end - window_start >= 2 * HOUR
+
+
+def test_a_time_asked_for_at_night_keeps_its_own_hour():
+    assert same_time_windows(at(2), HOUR, 2) == [(at(2), at(3)), (at(2, day=1), at(3, day=1))]
+
+
+@pytest.mark.parametrize("timing, now, expected", [
+    ("Sometime tonight", at(15), [(at(18), at(24))]),
+    ("Soon", at(15, 20), [(at(15, 20), at(21, 20))]),
+    ("This afternoon", at(9), [(at(12), at(18))]),
+    ("Tomorrow evening", at(9), [(at(17, day=1), at(23, day=1))]),
+    ("This weekend", at(9), [(at(10, day=1), at(23, day=1)), (at(10, day=2), at(23, day=2))]),     # from Friday
+    ("This weekend", at(9, day=1), [(at(10, day=1), at(23, day=1)), (at(10, day=2), at(23, day=2))]),  # Saturday
+    ("This weekend", at(9, day=2), [(at(10, day=2), at(23, day=2))]),                              # Sunday
+])
+def test_invitation_windows(timing, now, expected):
+    assert invitation_windows(timing, now) == expected
@@ -0,0 +1,107 @@
+import datetime
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from search import BM25_B, BM25_K1, InvertedIndex, normalize, parse_query, tokenize
+from storage import create_repository
+
+START = datetime.datetime(2024, 1, 1)
+WORDS = ["kiss", "kisses", "dinner", "dinners", "movie", "walk", "beach", "story", "stories", "coffee", "hug", "miss"]
+
+
+def reference_bm25(docs, query):
+    """Textbook BM25 (Lucene's idf) over tokenized `docs`, for every document matching a query term."""
+    terms, excluded = parse_query(query)
+    tokenized = [Counter(tokenize(text)) for text in docs]
+    average = sum(counts.total() for counts in tokenized) / len(docs)
+    scores = {}
+    for term in set(terms):
+        matching = sum(1 for counts in tokenized if term in counts)
+        idf = math.log(1 + (len(docs) - matching + 0.5) / (matching + 0.5))
+        for number, counts in enumerate(tokenized):
+            if term in counts:
+                tf = counts[term]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * counts.total() / average)
+                scores[number] = scores.get(number, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return {number: score for number, score in scores.items()
+            if not any(term in tokenized[number] for term in excluded)}
+
+
+@pytest.fixture
+def corpus():
+    rng = random.Random(7)
+    docs = [" ".join(rng.choices(WORDS + ["the", "and", "our"], k=rng.randrange(1, 15))) for _ in range(400)]
+    index = InvertedIndex()
+    for number, text in enumerate(docs):
+        index.add(number, text, "Partner 1" if number % 3 else "Partner 2", START + datetime.timedelta(hours=number))
+    return docs, index
+
+
+@pytest.mark.parametrize("query", ["kiss", "dinner movie", "stories -beach", "hug hug coffee", "the and"])
+def test_scores_match_reference_bm25(corpus, query):
+    docs, index = corpus
+    expected = reference_bm25(docs, query)
+    got = dict(index.search(query, limit=len(docs)))
+    assert got.keys() == expected.keys()
+    assert all(math.isclose(got[number], expected[number]) for number in got)
+    ranked = [score for _, score in index.search(query, limit=len(docs))]
+    assert ranked == sorted(ranked, reverse=True)
+
+
+def test_excluded_terms_remove_documents(corpus):
+    _, index = corpus
+    with_walk = {number for number, _ in index.search("walk", limit=1000)}
+    without = {number for number, _ in index.search("dinner -walk", limit=1000)}
+    assert without and not without & with_walk
+
+
+def test_filters_and_pages_follow_the_full_ranking(corpus):
+    _, index = corpus
+    since = START + datetime.timedelta(hours=100)
+    full = index.search("beach coffee", author="Partner 2", range_start=since, limit=1000)
+    assert all(number % 3 == 0 and number >= 100 for number, _ in full)
+    pages = [index.search("beach coffee", author="Partner 2", range_start=since, skip=skip, limit=7)
+             for skip in range(0, len(full), 7)]
+    assert [hit for page in pages for hit in page] == full
+
+
+def test_equal_scores_rank_the_newest_note_first():
+    index = InvertedIndex()
+    for number in range(5):
+        index.add(number, "miss you", "Partner 1", START + datetime.timedelta(days=number))
+    assert [number for number, _ in index.search("miss")] == [4, 3, 2, 1, 0]
+
+
+def test_equal_scores_rank_the_newest_note_first_across_terms():
+    index = InvertedIndex()
+    # Every note ties; whichever term is scored first, its postings interleave with the other term's by age.
+    for number, text in enumerate(["hug", "miss", "hug", "miss", "coffee"]):
+        index.add(number, text, "Partner 1", START + datetime.timedelta(days=number))
+    assert [number for number, _ in index.search("hug miss")] == [3, 2, 1, 0]
+    assert [number for number, _ in index.search("miss hug", skip=1, limit=2)] == [2, 1]
+
+
+@pytest.mark.parametrize("word, term", [
+    ("Notes", "note"), ("kisses", "kiss"), ("stories", "story"), ("wishes", "wish"), ("boxes", "box"),
+    ("bus", "bus"), ("this", "this"), ("kiss", "kiss"),
+])
+def test_normalize_folds_plurals(word, term):
+    assert normalize(word) == term
+
+
+def test_stopwords_and_punctuation_are_dropped():
+    assert tokenize("Thinking of YOU, my love... forever!") == ["thinking", "love", "forever"]
+    assert parse_query("the -and") == ([], [])
+
+
+def test_repository_search_returns_projected_notes_with_scores():
+    repo = create_repository("memory")
+    for number, message in enumerate(["beach walk", "beach beach sunset", "coffee date"]):
+        repo.insert_love_note({"author": "Partner 1", "message": message, "timestamp": START + datetime.timedelta(hours=number),
+                               "type": "love_note"})
+    hits = repo.search_love_notes("beaches", fields={"message": 1})
+    assert [hit["message"] for hit in hits] == ["beach beach sunset", "beach walk"]
+    assert set(hits[0]) == {"_id", "message", "score"}
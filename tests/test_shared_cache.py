@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+
+import shared_cache
+from shared_cache import InMemoryKeyValueStore, KeyValueCache, SharedTier, SQLiteCache, code_version
+
+
+@pytest.fixture(params=["sqlite", "key-value"])
+def cache(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteCache(path=str(tmp_path / "cache.sqlite3"))
+    return KeyValueCache(InMemoryKeyValueStore())
+
+
+class Replica:
+    """One app process: a process-local cache in front of the shared tier, like cached_reader's st.cache_data."""
+
+    def __init__(self, cache, version="v1"):
+        self.tier = SharedTier(cache, version)
+        self.local = {}
+        self.queries = 0
+
+    def calendar(self, tenant, month):
+        versions = self.tier.versions(tenant, ["events", "event_series"])
+        if (tenant, month, versions) not in self.local:
+            self.local[tenant, month, versions], _ = self.tier.load(
+                "get_events", (month,), {}, tenant, versions, lambda: self.query(tenant, month))
+        return self.local[tenant, month, versions]
+
+    def query(self, tenant, month):
+        self.queries += 1
+        return [f"{tenant} {month} #{self.queries}"]
+
+
+def test_bumps_change_only_the_named_stamps(cache):
+    tier = SharedTier(cache, "v1")
+    assert tier.versions("h1", ["events", "moods"]) == (0, 0)
+    tier.bump("h1", ["events"])
+    tier.bump("h1", ["events", "moods"])
+    assert tier.versions("h1", ["events", "moods", "love_notes"]) == (2, 1, 0)
+    assert tier.versions("h2", ["events"]) == (0,)
+
+
+def test_replicas_sharing_a_file_serve_each_others_payloads_until_a_write(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = Replica(SQLiteCache(path=path)), Replica(SQLiteCache(path=path))
+    assert first.calendar("h1", "2024-06") == second.calendar("h1", "2024-06") == ["h1 2024-06 #1"]
+    assert (first.queries, second.queries) == (1, 0)
+
+    second.tier.bump("h1", ["events"])  # a write on the second replica
+    assert first.calendar("h1", "2024-06") == ["h1 2024-06 #2"]
+    assert second.calendar("h1", "2024-06") == ["h1 2024-06 #2"]
+    assert (first.queries, second.queries) == (2, 0)
+    assert second.calendar("h2", "2024-06") == ["h2 2024-06 #1"]
+
+
+def test_payloads_are_not_shared_across_code_versions(cache):
+    old, new = Replica(cache, "v1"), Replica(cache, "v2")
+    old.calendar("h1", "2024-06")
+    new.calendar("h1", "2024-06")
+    assert (old.queries, new.queries) == (1, 1)
+    key = old.tier.key("get_events", ("2024-06",), {}, "h1", (0, 0))
+    assert key.startswith("get_events-v1:h1:0.0:")
+    assert key != new.tier.key("get_events", ("2024-06",), {}, "h1", (0, 0))
+
+
+def test_code_version_prefers_the_deployed_version(monkeypatch):
+    monkeypatch.setenv("RENDEZVOUS_VERSION", "abc123")
+    assert code_version() == "abc123"
+    monkeypatch.delenv("RENDEZVOUS_VERSION")
+    assert code_version() == code_version() != "abc123"
+
+
+class FlakyCache(KeyValueCache):
+    def __init__(self):
+        super().__init__(InMemoryKeyValueStore())
+        self.down = False
+        self.calls = 0
+
+    def versions(self, names):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("connection refused")
+        return super().versions(names)
+
+
+def test_an_unreachable_tier_is_skipped_then_retried():
+    backend, now = FlakyCache(), [0.0]
+    tier = SharedTier(backend, "v1", retry_seconds=30, clock=lambda: now[0])
+    backend.down = True
+    assert tier.versions("h1", ["events"]) is None
+    backend.down = False
+    now[0] = 29.9
+    assert tier.versions("h1", ["events"]) is None
+    assert backend.calls == 1  # skipped, not asked again
+
+    now[0] = 30.0
+    assert tier.versions("h1", ["events"]) == (0,)
+    assert backend.calls == 2
+
+
+def test_a_failed_load_falls_back_to_computing():
+    backend = FlakyCache()
+    tier = SharedTier(backend, "v1", clock=lambda: 0.0)
+    backend.client = None  # every get and set now fails
+    assert tier.load("get_events", (), {}, "h1", (0,), lambda: ["fresh"]) == (["fresh"], False)
+
+
+def test_sqlite_cache_keeps_one_connection_across_threads(tmp_path, monkeypatch):
+    connects, read = [], []
+    connect = shared_cache.sqlite3.connect
+
+    def counting_connect(*args, **kwargs):
+        connects.append(args)
+        return connect(*args, **kwargs)
+
+    monkeypatch.setattr(shared_cache.sqlite3, "connect", counting_connect)
+    cache = SQLiteCache(path=str(tmp_path / "cache.sqlite3"))
+
+    def rerun(number):  # Streamlit runs each rerun on a new thread
+        cache.bump(["h1/events"])
+        cache.set(f"key {number}", b"payload", 60)
+        read.append(cache.get(f"key {number}"))
+
+    threads = [threading.Thread(target=rerun, args=(number,)) for number in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(connects) == 1
+    assert read == [b"payload"] * 16
+    assert cache.versions(["h1/events"]) == (16,)
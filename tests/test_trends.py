@@ -0,0 +1,175 @@
+import datetime
+import random
+
+import pytest
+
+from trends import (
+    MAX_TREND_POINTS, MOOD_METRICS, downsample, mood_rollup_pipeline, pick_granularity, rollup_moods, truncate_date,
+)
+
+DAY = datetime.timedelta(days=1)
+START = datetime.datetime(2024, 1, 1)
+
+
+def moods_between(range_start, days, partners=("Partner 1", "Partner 2"), seed=1):
+    rng = random.Random(seed)
+    return [{"partner": partner, "date": range_start + day * DAY + datetime.timedelta(hours=rng.randrange(24)),
+             **{metric: rng.randrange(11) for metric in MOOD_METRICS}}
+            for day in range(days) for partner in partners]
+
+
+# --- a reference evaluator for the pipeline's stages, written against Mongo's documented semantics ---
+
+def date_trunc(value, unit):
+    midnight = datetime.datetime(value.year, value.month, value.day)
+    if unit == "day":
+        return midnight
+    if unit == "week":  # startOfWeek defaults to Sunday
+        return midnight - DAY * ((midnight.isoweekday()) % 7)
+    if unit == "month":
+        return datetime.datetime(value.year, value.month, 1)
+    raise AssertionError(f"unexpected unit {unit}")
+
+
+def evaluate(expression, doc):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = doc
+        for part in expression[1:].split("."):
+            value = value[part]
+        return value
+    if isinstance(expression, dict) and len(expression) == 1 and next(iter(expression)).startswith("$"):
+        (operator, argument), = expression.items()
+        if operator == "$dateTrunc":
+            assert set(argument) == {"date", "unit"}
+            return date_trunc(evaluate(argument["date"], doc), argument["unit"])
+        if operator == "$round":
+            return round(evaluate(argument[0], doc), argument[1])
+        raise AssertionError(f"unexpected operator {operator}")
+    if isinstance(expression, dict):
+        return {key: evaluate(value, doc) for key, value in expression.items()}
+    return expression
+
+
+def run_pipeline(pipeline, docs):
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [doc for doc in docs
+                    if all(cond["$gte"] <= doc[field] < cond["$lt"] if isinstance(cond, dict) else doc[field] == cond
+                           for field, cond in spec.items())]
+        elif name == "$group":
+            groups = {}
+            for doc in docs:
+                key = evaluate(spec["_id"], doc)
+                groups.setdefault(tuple(sorted(key.items())), []).append(doc)
+            docs = []
+            for key, members in groups.items():
+                row = {"_id": dict(key)}
+                for field, accumulator in spec.items():
+                    if field == "_id":
+                        continue
+                    (operator, argument), = accumulator.items()
+                    if operator == "$sum":
+                        row[field] = sum(evaluate(argument, doc) for doc in members)
+                    elif operator == "$avg":
+                        row[field] = sum(evaluate(argument, doc) for doc in members) / len(members)
+                    else:
+                        raise AssertionError(f"unexpected accumulator {operator}")
+                docs.append(row)
+        elif name == "$setWindowFields":
+            (sort_field, direction), = spec["sortBy"].items()
+            assert direction == 1
+            partitions = {}
+            for doc in sorted(docs, key=lambda doc: evaluate(f"${sort_field}", doc)):
+                partitions.setdefault(evaluate(spec["partitionBy"], doc), []).append(doc)
+            for rows in partitions.values():
+                for index, row in enumerate(rows):
+                    for field, window_spec in spec["output"].items():
+                        lower, upper = window_spec["window"]["documents"]
+                        window = rows[max(0, index + lower):index + upper + 1]
+                        row[field] = sum(evaluate(window_spec["$avg"], r) for r in window) / len(window)
+        elif name == "$project":
+            docs = [{field: evaluate(f"${field}", doc) if value == 1 else evaluate(value, doc)
+                     for field, value in spec.items() if value != 0} for doc in docs]
+        elif name == "$sort":
+            (field, direction), = spec.items()
+            docs = sorted(docs, key=lambda doc: doc[field], reverse=direction == -1)
+        else:
+            raise AssertionError(f"unexpected stage {name}")
+    return docs
+
+
+def by_partner_and_date(rows):
+    return sorted(rows, key=lambda row: (row["partner"], row["date"]))
+
+
+@pytest.mark.parametrize("unit", ["day", "week", "month"])
+def test_pipeline_and_in_memory_rollup_agree(unit):
+    range_start, range_end = datetime.datetime(2024, 1, 3), datetime.datetime(2024, 9, 17)
+    moods = moods_between(range_start - 10 * DAY, 270)
+    in_range = [mood for mood in moods if range_start <= mood["date"] < range_end]
+    pipeline = mood_rollup_pipeline(range_start, range_end, unit)
+    assert by_partner_and_date(run_pipeline(pipeline, moods)) == by_partner_and_date(rollup_moods(in_range, unit))
+
+
+def test_pipeline_groups_on_date_trunc_per_partner():
+    pipeline = mood_rollup_pipeline(START, START + 30 * DAY, "week", archives=["moods_archive_2023"], household="h1")
+    assert pipeline[0] == {"$match": {"household": "h1", "date": {"$gte": START, "$lt": START + 30 * DAY}}}
+    assert pipeline[1] == {"$unionWith": {"coll": "moods_archive_2023", "pipeline": [pipeline[0]]}}
+    group = pipeline[2]["$group"]
+    assert group["_id"] == {"partner": "$partner", "period": {"$dateTrunc": {"date": "$date", "unit": "week"}}}
+    assert group["days"] == {"$sum": 1}
+    assert {metric: group[metric] for metric in MOOD_METRICS} == {metric: {"$avg": f"${metric}"} for metric in MOOD_METRICS}
+
+
+@pytest.mark.parametrize("value, unit, expected", [
+    (datetime.datetime(2024, 3, 9, 23, 59), "week", datetime.datetime(2024, 3, 3)),   # Saturday -> previous Sunday
+    (datetime.datetime(2024, 3, 10, 0, 0), "week", datetime.datetime(2024, 3, 10)),   # Sunday starts its own week
+    (datetime.datetime(2024, 2, 29, 18, 0), "month", datetime.datetime(2024, 2, 1)),
+    (datetime.datetime(2024, 3, 1, 0, 0), "month", datetime.datetime(2024, 3, 1)),
+    (datetime.datetime(2024, 3, 1, 23, 59), "day", datetime.datetime(2024, 3, 1)),
+])
+def test_truncate_date_bucket_boundaries(value, unit, expected):
+    assert truncate_date(value, unit) == expected == date_trunc(value, unit)
+
+
+def test_rollup_buckets_split_at_boundaries():
+    moods = [
+        {"partner": "A", "date": datetime.datetime(2024, 3, 9, 22), "energy": 2, "desire": 4, "stress": 6},
+        {"partner": "A", "date": datetime.datetime(2024, 3, 10, 8), "energy": 8, "desire": 6, "stress": 4},
+        {"partner": "A", "date": datetime.datetime(2024, 3, 11, 8), "energy": 6, "desire": 6, "stress": 6},
+    ]
+    weeks = rollup_moods(moods, "week")
+    assert [(row["date"].day, row["days"], row["energy"]) for row in weeks] == [(3, 1, 2), (10, 2, 7)]
+    assert weeks[1]["energy_rolling"] == round((2 + 7) / 2, 2)
+    assert [row["days"] for row in rollup_moods(moods, "month")] == [3]
+
+
+@pytest.mark.parametrize("days, unit", [(1, "day"), (120, "day"), (121, "week"), (840, "week"), (841, "month"),
+                                        (3650, "month")])
+def test_pick_granularity_thresholds(days, unit):
+    assert pick_granularity(START, START + days * DAY) == unit
+
+
+@pytest.mark.parametrize("days", [90, 400, 900, 5 * 365])
+def test_downsampled_rollups_stay_within_the_point_budget(days):
+    moods = moods_between(START, days, partners=("A", "B", "C"))
+    unit = pick_granularity(START, START + days * DAY)
+    rows = rollup_moods(moods, unit)
+    thinned = downsample(rows)
+    for partner in ("A", "B", "C"):
+        mine = [row for row in rows if row["partner"] == partner]
+        kept = [row for row in thinned if row["partner"] == partner]
+        assert len(kept) <= MAX_TREND_POINTS
+        assert kept[-1] is mine[-1]
+
+
+def test_downsample_thins_each_partner_evenly_and_keeps_the_latest():
+    rows = [{"partner": partner, "date": START + i * DAY} for i in range(1000) for partner in ("A", "B")]
+    thinned = downsample(rows, max_points=10)
+    for partner in ("A", "B"):
+        dates = [row["date"] for row in thinned if row["partner"] == partner]
+        assert len(dates) == 10
+        assert dates[0] == START and dates[-1] == START + 999 * DAY
+        assert all(later > earlier for earlier, later in zip(dates, dates[1:]))
+    assert downsample(rows[:20], max_points=10) == rows[:20]
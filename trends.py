@@ -0,0 +1,107 @@
+"""Wellness trend rollups: server-side aggregation plus bounded downsampling (no Streamlit imports)."""
+import datetime
+
+MOOD_METRICS = ("energy", "desire", "stress")
+MAX_TREND_POINTS = 120  # per partner, whatever the selected range
+ROLLING_PERIODS = 7
+
+# Approximate length of each $dateTrunc unit, used to pick the finest one that fits.
+GRANULARITY_DAYS = (("day", 1), ("week", 7), ("month", 30.44))
+
+
+def pick_granularity(range_start, range_end, max_points=MAX_TREND_POINTS):
+    """Finest rollup unit that keeps one partner's series within `max_points`."""
+    span_days = max((range_end - range_start).days, 1)
+    for unit, days in GRANULARITY_DAYS:
+        if span_days / days <= max_points:
+            return unit
+    return GRANULARITY_DAYS[-1][0]
+
+
+def mood_rollup_pipeline(range_start, range_end, unit, rolling_periods=ROLLING_PERIODS, archives=(), household=None):
+    """Aggregation over `moods` (plus any `archives` collections): per-partner averages per `unit`,
+    plus a trailing rolling mean of each metric. `household` restricts it to one household's moods."""
+    match = {"$match": {"date": {"$gte": range_start, "$lt": range_end}}}
+    if household is not None:
+        match["$match"] = {"household": household, **match["$match"]}
+    return [
+        match,
+        *({"$unionWith": {"coll": name, "pipeline": [match]}} for name in archives),
+        {"$group": {
+            "_id": {"partner": "$partner", "period": {"$dateTrunc": {"date": "$date", "unit": unit}}},
+            "days": {"$sum": 1},
+            **{metric: {"$avg": f"${metric}"} for metric in MOOD_METRICS},
+        }},
+        {"$setWindowFields": {
+            "partitionBy": "$_id.partner",
+            "sortBy": {"_id.period": 1},
+            "output": {
+                f"{metric}_rolling": {"$avg": f"${metric}", "window": {"documents": [1 - rolling_periods, 0]}}
+                for metric in MOOD_METRICS
+            },
+        }},
+        {"$project": {
+            "_id": 0, "partner": "$_id.partner", "date": "$_id.period", "days": 1,
+            **{metric: {"$round": [f"${metric}", 2]} for metric in MOOD_METRICS},
+            **{f"{metric}_rolling": {"$round": [f"${metric}_rolling", 2]} for metric in MOOD_METRICS},
+        }},
+        {"$sort": {"date": 1}},
+    ]
+
+
+def truncate_date(value, unit):
+    """Python equivalent of $dateTrunc for the units we use (weeks start on Sunday, like Mongo's default)."""
+    day = datetime.datetime.combine(value.date(), datetime.time())
+    if unit == "week":
+        return day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+    if unit == "month":
+        return day.replace(day=1)
+    return day
+
+
+def rollup_moods(moods, unit, rolling_periods=ROLLING_PERIODS):
+    """In-memory equivalent of mood_rollup_pipeline's output for already range-filtered mood documents."""
+    groups = {}
+    for mood in moods:
+        key = (mood["partner"], truncate_date(mood["date"], unit))
+        sums = groups.setdefault(key, dict.fromkeys(MOOD_METRICS, 0) | {"days": 0})
+        sums["days"] += 1
+        for metric in MOOD_METRICS:
+            sums[metric] += mood[metric]
+
+    rows, history = [], {}
+    for (partner, period), sums in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1])):
+        row = {"partner": partner, "date": period, "days": sums["days"]}
+        for metric in MOOD_METRICS:
+            row[metric] = sums[metric] / sums["days"]
+        window = history.setdefault(partner, [])
+        window.append(row)
+        del window[:-rolling_periods]
+        for metric in MOOD_METRICS:
+            row[f"{metric}_rolling"] = round(sum(r[metric] for r in window) / len(window), 2)
+        rows.append(row)
+    for row in rows:
+        for metric in MOOD_METRICS:
+            row[metric] = round(row[metric], 2)
+    return sorted(rows, key=lambda row: row["date"])
+
+
+def downsample(rows, max_points=MAX_TREND_POINTS):
+    """Evenly thins each partner's rows to at most `max_points`, always keeping the latest one."""
+    by_partner = {}
+    for row in rows:
+        by_partner.setdefault(row["partner"], []).append(row)
+    thinned = []
+    for series in by_partner.values():
+        if len(series) <= max_points:
+            thinned.extend(series)
+            continue
+        step = len(series) / max_points
+        picks = {int(i * step) for i in range(max_points - 1)} | {len(series) - 1}
+        thinned.extend(series[i] for i in sorted(picks))
+    return sorted(thinned, key=lambda row: row["date"])
+
+
+def default_trend_range(today=None, days=90):
+    today = today or datetime.date.today()
+    return today - datetime.timedelta(days=days), today